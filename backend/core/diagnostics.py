@@ -0,0 +1,45 @@
+import logging
+
+DIAGNOSTICS_PARAM = 'diagnostics'
+DIAGNOSTICS_HEADER = 'HTTP_X_DIAGNOSTICS'
+
+def diagnostics_requested(request):
+    """
+    Return True when a staff user asked for diagnostics on this request with
+    ``?diagnostics=true`` or an ``X-Diagnostics: true`` header.
+    """
+    if request is None:
+        return False
+    user = getattr(request, 'user', None)
+    if not (user and user.is_authenticated and user.is_staff):
+        return False
+    query_params = getattr(request, 'query_params', request.GET)
+    flag = query_params.get(DIAGNOSTICS_PARAM) or request.META.get(DIAGNOSTICS_HEADER, '')
+    return flag.lower() in ('true', '1')
+
+class Diagnostics:
+    """
+    Logs diagnostic messages whose arguments are expensive to compute, such
+    as queryset counts or rendered SQL. Callable arguments are only called
+    when diagnostics are enabled, so no extra query runs otherwise:
+
+        diagnostics.log("Active modules count: %s", queryset.count)
+
+    Diagnostics are enabled when the logger is enabled for DEBUG, or for a
+    single request when diagnostics_requested() is true. Messages of a
+    requested diagnostics run are logged at INFO so they show up with the
+    default logging configuration.
+    """
+    def __init__(self, logger, request=None):
+        self.logger = logger
+        self.level = logging.DEBUG
+        if not logger.isEnabledFor(logging.DEBUG) and diagnostics_requested(request):
+            self.level = logging.INFO
+        self.enabled = logger.isEnabledFor(self.level)
+
+    def log(self, message, *args):
+        if not self.enabled:
+            return
+        args = tuple(arg() if callable(arg) else arg for arg in args)
+        # Attribute the record to the caller rather than this module
+        self.logger.log(self.level, message, *args, stacklevel=2)
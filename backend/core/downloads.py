@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from core.exceptions import NotFoundError
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Only single ranges are honoured, anything else is answered with the whole file
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+def is_object_store(storage):
+    """Whether ``storage`` hands out presigned URLs clients download from directly"""
+    return hasattr(storage, 'bucket_name')
+
+def serve_file(request, storage, name, file_name=None, as_attachment=True):
+    """
+    Respond with the stored file ``name`` once the caller has checked that
+    the user may read it. The bytes are sent by whichever is cheapest:
+
+    - object stores: a redirect to a presigned URL
+    - MEDIA_X_ACCEL_REDIRECT set: nginx, through an X-Accel-Redirect to the
+      internal location serving MEDIA_ROOT
+    - otherwise Django streams the file itself, honouring Range
+
+    ETag and Last-Modified are sent in every other case, and conditional
+    requests are answered with 304 before any byte is read.
+    """
+    file_name = file_name or os.path.basename(name)
+    disposition = content_disposition_header(as_attachment, file_name)
+    if is_object_store(storage):
+        return HttpResponseRedirect(storage.url(name, parameters={'ResponseContentDisposition': disposition}))
+
+    try:
+        size = storage.size(name)
+        last_modified = int(storage.get_modified_time(name).timestamp())
+    except (FileNotFoundError, NotADirectoryError):
+        raise NotFoundError("File not found")
+    # Same format as nginx, so either may answer a revalidation
+    etag = quote_etag(f'{last_modified:x}-{size:x}')
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        accel_path = get_accel_path(storage, name)
+        if accel_path:
+            response = HttpResponse(content_type=guess_content_type(file_name))
+            response['X-Accel-Redirect'] = accel_path
+        else:
+            response = stream_file(request, storage, name, file_name, size, etag, last_modified)
+        response['Content-Disposition'] = disposition
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Only the user who passed the permission checks may reuse it, after revalidating
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+def get_accel_path(storage, name):
+    """The internal nginx URI of ``name``, or None when nginx cannot serve it"""
+    prefix = settings.MEDIA_X_ACCEL_REDIRECT
+    if not prefix or not isinstance(storage, FileSystemStorage):
+        return None
+    path = os.path.relpath(storage.path(name), settings.MEDIA_ROOT)
+    if path.startswith('..'):
+        return None
+    return prefix.rstrip('/') + '/' + quote(path.replace(os.sep, '/'))
+
+def guess_content_type(file_name):
+    return mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+
+def get_range(request, size, etag, last_modified):
+    """
+    The (start, end) bytes of ``size`` requested with a satisfiable Range
+    header, end included, or None to send the whole file. Raises ValueError
+    when the range cannot be satisfied.
+    """
+    match = RANGE_PATTERN.match(request.META.get('HTTP_RANGE', '').strip())
+    if not match or request.method not in ('GET', 'HEAD'):
+        return None
+    # The range only applies to the representation the client already has part of
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not last or not int(last):
+            raise ValueError
+        # The last bytes of the file
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        raise ValueError
+    return start, end
+
+def stream_file(request, storage, name, file_name, size, etag, last_modified):
+    """Stream ``name`` from the storage in blocks, partially when a range is requested"""
+    try:
+        requested = get_range(request, size, etag, last_modified)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = storage.open(name, 'rb')
+    if requested is None:
+        return FileResponse(file, content_type=guess_content_type(file_name))
+
+    start, end = requested
+    response = StreamingHttpResponse(
+        read_range(file, start, end - start + 1),
+        status=206,
+        content_type=guess_content_type(file_name)
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
+
+def read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(STREAM_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
@@ -33,6 +33,12 @@ class NotFoundError(APIError):
     def __init__(self, message, details=None):
         super().__init__(message, code=404, details=details)
 
+class RateLimitError(APIError):
+    """Raised when a client sent too many requests, ``retry_after`` is sent as the Retry-After header"""
+    def __init__(self, message, retry_after, details=None):
+        self.retry_after = retry_after
+        super().__init__(message, code=429, details=details)
+
 class ServerError(APIError):
     """Raised when there's a server error"""
     def __init__(self, message, details=None):
@@ -55,7 +61,10 @@ def custom_exception_handler(exc, context):
                     'details': exc.details
                 }
             }
-            return Response(data, status=exc.code)
+            response = Response(data, status=exc.code)
+            if isinstance(exc, RateLimitError):
+                response['Retry-After'] = str(exc.retry_after)
+            return response
         return response
 
     # Format the response data to match our structure
@@ -0,0 +1,108 @@
+from rest_framework import permissions
+
+def _split_param(value):
+    """Split a comma separated query parameter into a list of names"""
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+class Fieldset:
+    """
+    Describes which fields of a serializer should be rendered.
+
+    ``fields`` is an allow list and ``omit`` a deny list of field names. A
+    dotted name such as ``modules.title`` applies to the nested serializer
+    rendered for ``modules``. ``representation='summary'`` limits the output
+    to the serializer's ``Meta.summary_fields`` unless ``fields`` is given.
+    """
+    SUMMARY = 'summary'
+
+    def __init__(self, fields=None, omit=None, representation=None):
+        self.fields = list(fields) if fields is not None else None
+        self.omit = list(omit or [])
+        self.representation = representation if representation == self.SUMMARY else None
+
+    @classmethod
+    def from_query_params(cls, query_params):
+        return cls(
+            fields=_split_param(query_params.get('fields')),
+            omit=_split_param(query_params.get('omit')),
+            representation=query_params.get('representation')
+        )
+
+    @property
+    def is_default(self):
+        return self.fields is None and not self.omit and self.representation is None
+
+    def select(self, names, summary_fields=None):
+        """Return the subset of ``names`` that should be rendered"""
+        names = list(names)
+        if self.fields is not None:
+            requested = {name.split('.', 1)[0] for name in self.fields}
+            names = [name for name in names if name in requested]
+        elif self.representation == self.SUMMARY and summary_fields is not None:
+            names = [name for name in names if name in summary_fields]
+
+        omitted = {name for name in self.omit if '.' not in name}
+        return [name for name in names if name not in omitted]
+
+    def nested(self, name):
+        """Return the fieldset that applies to the nested field ``name``"""
+        prefix = f"{name}."
+        fields = None
+        if self.fields is not None:
+            # Asking for "modules" alone renders every field of the modules
+            fields = [field[len(prefix):] for field in self.fields if field.startswith(prefix)] or None
+        omit = [field[len(prefix):] for field in self.omit if field.startswith(prefix)]
+        return Fieldset(fields=fields, omit=omit, representation=self.representation)
+
+    def as_kwargs(self):
+        return {'fields': self.fields, 'omit': self.omit, 'representation': self.representation}
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin that accepts ``fields``, ``omit`` and ``representation`` keyword
+    arguments and drops every field the caller did not ask for.
+    """
+    def __init__(self, *args, **kwargs):
+        self.fieldset = Fieldset(
+            fields=kwargs.pop('fields', None),
+            omit=kwargs.pop('omit', None),
+            representation=kwargs.pop('representation', None)
+        )
+        super().__init__(*args, **kwargs)
+
+        if not self.fieldset.is_default:
+            summary_fields = getattr(self.Meta, 'summary_fields', None)
+            selected = set(self.fieldset.select(self.fields.keys(), summary_fields))
+            for name in list(self.fields.keys()):
+                if name not in selected:
+                    self.fields.pop(name)
+
+    def get_nested_serializer(self, name, serializer_class, *args, **kwargs):
+        """Build the serializer for the nested field ``name`` with the fieldset that applies to it"""
+        kwargs.setdefault('context', self.context)
+        kwargs.update(self.fieldset.nested(name).as_kwargs())
+        return serializer_class(*args, **kwargs)
+
+class SparseFieldsetViewMixin:
+    """
+    View mixin that reads ``?fields=``, ``?omit=`` and
+    ``?representation=summary`` on read requests and passes them to
+    serializers using SparseFieldsetMixin. ``?view=`` is left to the views,
+    which use it to filter, e.g. the course tabs.
+    """
+    def get_fieldset(self):
+        if self.request.method not in permissions.SAFE_METHODS:
+            return Fieldset()
+        return Fieldset.from_query_params(self.request.query_params)
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), SparseFieldsetMixin):
+            for key, value in self.get_fieldset().as_kwargs().items():
+                kwargs.setdefault(key, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_rendered_fields(self):
+        """Names of the fields the current request will render"""
+        return set(self.get_serializer().fields.keys())
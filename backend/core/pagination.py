@@ -0,0 +1,180 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from uuid import UUID
+from django.db.models import F, Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from core.exceptions import ValidationError
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+class KeysetPaginationMixin:
+    """
+    Adds keyset (cursor) pagination next to the pagination style of the class
+    it is mixed into.
+
+    Keyset mode is used when the request carries ``?cursor=`` or
+    ``?pagination=cursor``. Pages are read with ``WHERE (field, pk) < cursor``
+    on the queryset's first ordering field plus the primary key, so deep pages
+    cost the same as the first one. Cursors are opaque base64 tokens and the
+    total count is only computed when ``?include_count=true`` is passed.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    count_query_param = 'include_count'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def use_keyset(self, request):
+        return (
+            self.cursor_query_param in request.query_params or
+            request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.use_keyset(request)
+        if self.keyset:
+            return self.paginate_keyset(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.get_keyset_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_keyset_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_keyset_ordering(self, queryset):
+        """Return (field, ascending) for the leading ordering field of the queryset"""
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        if not ordering or not isinstance(ordering[0], str):
+            return 'pk', True
+        field = ordering[0]
+        ascending = not field.startswith('-')
+        field = field.lstrip('-')
+        if '__' in field:
+            # Keyset values are read from the row itself, so related orderings fall back to the primary key
+            return 'pk', ascending
+        if field in ('pk', 'id', queryset.model._meta.pk.name):
+            return 'pk', ascending
+        return field, ascending
+
+    def encode_cursor(self, instance, forward):
+        payload = {
+            'v': _encode_value(getattr(instance, self.ordering_field)) if self.ordering_field != 'pk' else None,
+            'pk': _encode_value(instance.pk),
+            'f': forward
+        }
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            return payload['v'], payload['pk'], bool(payload['f'])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise ValidationError("Invalid pagination cursor")
+
+    def _keyset_filter(self, value, pk, forward):
+        field, ascending = self.ordering_field, self.ascending
+        # Moving forward through an ascending ordering means larger values come next
+        op = 'gt' if ascending == forward else 'lt'
+        pk_q = Q(**{f'pk__{op}': pk})
+        if field == 'pk':
+            return pk_q
+
+        # NULLs always sort last, after every non-null value
+        if value is None:
+            if forward:
+                return Q(**{f'{field}__isnull': True}) & pk_q
+            return Q(**{f'{field}__isnull': False}) | (Q(**{f'{field}__isnull': True}) & pk_q)
+
+        q = Q(**{f'{field}__{op}': value}) | (Q(**{field: value}) & pk_q)
+        if forward:
+            q |= Q(**{f'{field}__isnull': True})
+        return q
+
+    def _keyset_order_by(self, forward):
+        field, ascending = self.ordering_field, self.ascending
+        ascending = ascending == forward
+        if field == 'pk':
+            return ['pk' if ascending else '-pk']
+        nulls = {'nulls_last': True} if forward else {'nulls_first': True}
+        expression = F(field).asc(**nulls) if ascending else F(field).desc(**nulls)
+        return [expression, 'pk' if ascending else '-pk']
+
+    def paginate_keyset(self, queryset, request):
+        self.request = request
+        self.ordering_field, self.ascending = self.get_keyset_ordering(queryset)
+        page_size = self.get_keyset_page_size(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, 'false').lower() == 'true':
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request)
+        forward = True
+        if cursor:
+            value, pk, forward = cursor
+            queryset = queryset.filter(self._keyset_filter(value, pk, forward))
+
+        items = list(queryset.order_by(*self._keyset_order_by(forward))[:page_size + 1])
+        has_more = len(items) > page_size
+        items = items[:page_size]
+        if not forward:
+            items.reverse()
+
+        self.next_cursor = None
+        self.previous_cursor = None
+        if items:
+            if has_more or not forward:
+                self.next_cursor = self.encode_cursor(items[-1], forward=True)
+            if cursor and (forward or has_more):
+                self.previous_cursor = self.encode_cursor(items[0], forward=False)
+        return items
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_keyset_paginated_response(self, data):
+        response = {
+            'next': self.get_cursor_link(self.next_cursor),
+            'previous': self.get_cursor_link(self.previous_cursor),
+            'results': data
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+class KeysetPagination(KeysetPaginationMixin, BasePagination):
+    """
+    Keyset pagination for endpoints that return unpaginated lists by default.
+    Responses only become paginated when a cursor is requested.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.use_keyset(request)
+        if self.keyset:
+            return self.paginate_keyset(queryset, request)
+        return None
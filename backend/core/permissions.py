@@ -29,6 +29,10 @@ class OrganizationPermission(permissions.BasePermission):
             except Course.DoesNotExist:
                 return False
 
+        # Enrollments belong to the organization of their course
+        if hasattr(obj, 'course') and not hasattr(obj, 'organization'):
+            return obj.course.organization_id == request.user.organization_id
+
         # For other models, check their organization field
         obj_organization = getattr(obj, 'organization', None)
         if not obj_organization:
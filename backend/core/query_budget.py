@@ -0,0 +1,186 @@
+import os
+import time
+from django.core.cache import cache
+from django.db import connection
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the total SQL time of one request, in milliseconds
+DEFAULT_MAX_SQL_MS = 250
+
+# Set to a file path to also append every report to that file
+REPORT_ENV = 'QUERY_BUDGET_REPORT'
+
+def route_names(urlconf):
+    """Names of every route in ``urlconf``, without DRF's format suffix and root views"""
+    names = set()
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern) and pattern.name and pattern.name != 'api-root':
+                names.add(pattern.name)
+
+    walk(get_resolver(urlconf).url_patterns)
+    return names
+
+class QueryCapture:
+    """Counts and times every SQL statement run on a connection while active"""
+    def __init__(self, using=connection):
+        self.connection = using
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - start) * 1000))
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def sql_ms(self):
+        return sum(duration for _, duration in self.queries)
+
+    def format(self):
+        return '\n'.join(f'{index}. ({duration:.1f}ms) {sql}' for index, (sql, duration) in enumerate(self.queries, 1))
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin asserting how many SQL queries, and how much SQL time, an
+    API request may use. Every measured request is added to a report of
+    queries per endpoint that is printed when the test class finishes.
+
+    Budgets are declared per route name and HTTP method in ``query_budgets``,
+    and requests are sent with a real access token, so authentication is
+    part of the measured cost:
+
+        query_budgets = {'course-list': {'GET': 8, 'POST': 12}}
+
+        self.authenticate(self.admin)
+        self.assertQueryBudget('course-list', 'get', url)
+
+    assertConstantQueries() runs the same endpoint at growing page or data
+    sizes and fails when the query count grows with them.
+    """
+    query_budgets = {}
+    max_sql_ms = DEFAULT_MAX_SQL_MS
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.query_report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.query_report:
+            report = cls.format_query_report()
+            logger.debug(f'\n{report}')
+            path = os.environ.get(REPORT_ENV)
+            if path:
+                with open(path, 'a') as report_file:
+                    report_file.write(f'{report}\n\n')
+        super().tearDownClass()
+
+    @classmethod
+    def format_query_report(cls):
+        rows = [('route', 'method', 'size', 'queries', 'budget', 'sql ms')] + [
+            (row['route'], row['method'], row['size'], str(row['queries']), str(row['budget']), f"{row['sql_ms']:.1f}")
+            for row in sorted(cls.query_report, key=lambda row: (row['route'], row['method']))
+        ]
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return f'Query budget report for {cls.__name__}\n' + '\n'.join(lines)
+
+    def setUp(self):
+        super().setUp()
+        # Principals cached by an earlier test may describe rows it rolled back
+        cache.clear()
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        """Send the following requests as ``user``, or anonymously when None"""
+        if user is None:
+            self.client.credentials()
+        else:
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def measure(self, method, url, **kwargs):
+        """Send one request and return (response, capture)"""
+        with QueryCapture() as capture:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, capture
+
+    def assertRoutesHaveBudgets(self, urlconf):
+        """Fail when a route of ``urlconf`` has no entry in ``query_budgets``"""
+        missing = sorted(route_names(urlconf) - set(self.query_budgets))
+        self.assertEqual(missing, [], f'Routes of {urlconf} without a query budget: {", ".join(missing)}')
+
+    def assertQueryBudget(self, route, method, url, status=200, size='', max_sql_ms=None, **kwargs):
+        """
+        Send a request to ``url`` and fail unless it returns ``status`` within
+        the route's query budget and ``max_sql_ms`` of SQL time. Extra keyword
+        arguments are passed to the test client. Returns the response.
+        """
+        max_queries = self.query_budgets[route][method.upper()]
+        max_sql_ms = self.max_sql_ms if max_sql_ms is None else max_sql_ms
+        response, capture = self.measure(method, url, **kwargs)
+        self.query_report.append({
+            'route': route,
+            'method': method.upper(),
+            'size': str(size),
+            'queries': capture.count,
+            'budget': max_queries,
+            'sql_ms': capture.sql_ms,
+        })
+
+        body = getattr(response, 'data', None)
+        if body is None and not response.streaming:
+            body = response.content
+        self.assertEqual(
+            response.status_code, status,
+            f'{method.upper()} {url} returned {response.status_code}: {body}'
+        )
+        self.assertLessEqual(
+            capture.count, max_queries,
+            f'{method.upper()} {url} ran {capture.count} queries, the budget is {max_queries}:\n{capture.format()}'
+        )
+        self.assertLessEqual(
+            capture.sql_ms, max_sql_ms,
+            f'{method.upper()} {url} spent {capture.sql_ms:.1f}ms in SQL, the budget is {max_sql_ms}ms:\n{capture.format()}'
+        )
+        return response
+
+    def assertConstantQueries(self, route, method, urls, **kwargs):
+        """
+        Request each of ``urls``, a mapping of a size label to a URL of the
+        same endpoint at that page or data size, and fail unless every size
+        runs the same number of queries within the budget.
+        """
+        counts = {}
+        for size, url in urls.items():
+            # Every size pays for loading the principal, as the first request does
+            cache.clear()
+            self.assertQueryBudget(route, method, url, size=size, **kwargs)
+            counts[size] = self.query_report[-1]['queries']
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f'{method.upper()} {route} query count grows with size: {counts}'
+        )
@@ -0,0 +1,122 @@
+import math
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .exceptions import RateLimitError
+import logging
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+def parse_rate(rate):
+    """
+    Parse a rate such as ``'5/h'`` or ``'30/10m'`` into the bucket capacity
+    and the tokens refilled per second. The bucket holds up to 5 requests
+    and refills at 5 per hour, i.e. 5 requests may come in a burst, then
+    one every 12 minutes.
+    """
+    count, period = rate.split('/')
+    multiplier = period[:-1] or 1
+    return int(count), int(count) / (int(multiplier) * PERIODS[period[-1]])
+
+def get_client_ip(request):
+    """
+    The client's address. Behind RATE_LIMIT_PROXY_COUNT reverse proxies it
+    is the address the outermost of them put in X-Forwarded-For, as the
+    entries before it are set by the client.
+    """
+    proxies = settings.RATE_LIMIT_PROXY_COUNT
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR', '')
+
+def get_bucket_keys(request):
+    """The value of each kind of bucket for ``request``, ``None`` when it does not apply"""
+    email = request.data.get('email') if hasattr(request.data, 'get') else None
+    email = email.strip().lower() if isinstance(email, str) and '@' in email else None
+    return {
+        'ip': get_client_ip(request),
+        'email': email,
+        'domain': email.rsplit('@', 1)[1] if email else None,
+    }
+
+def take_token(key, capacity, refill_rate):
+    """
+    Take a token from the bucket ``key`` and return 0, or the seconds until
+    one is available when the bucket is empty.
+
+    The bucket is a single counter that every request increments and that
+    drains by ``refill_rate`` per second: it starts at the number of tokens
+    drained since the epoch, so the tokens in use are the counter minus
+    that number. Only atomic increments touch it, so concurrent requests on
+    any worker never take more tokens than the bucket holds.
+    """
+    timeout = math.ceil(capacity / refill_rate) + 1
+    drained = int(time.time() * refill_rate)
+    cache.add(key, drained, timeout)
+    used = cache.incr(key) - drained
+    if used < 1:
+        # Idle for longer than a refill, the bucket is full again. Concurrent
+        # requests may both catch up, which only leaves fewer tokens
+        cache.incr(key, 1 - used)
+        used = 1
+    if used > capacity:
+        # A refused request does not use a token
+        cache.decr(key)
+        return max(math.ceil((used - capacity) / refill_rate), 1)
+    cache.touch(key, timeout)
+    return 0
+
+def check_rate_limit(scope, request):
+    """
+    Take a token from every bucket RATE_LIMITS configures for ``scope``,
+    raising RateLimitError with the seconds to wait when one is empty.
+    Tokens already taken from the other buckets are given back then.
+    Requests are let through when the cache cannot be reached.
+    """
+    limits = settings.RATE_LIMITS.get(scope)
+    if not settings.RATE_LIMIT_ENABLED or not limits:
+        return
+
+    values = get_bucket_keys(request)
+    taken = []
+    try:
+        for kind, rate in limits.items():
+            if not values.get(kind):
+                continue
+            key = f'ratelimit:{scope}:{kind}:{values[kind]}'
+            retry_after = take_token(key, *parse_rate(rate))
+            if retry_after:
+                for taken_key in taken:
+                    cache.decr(taken_key)
+                logger.warning(f"Rate limit {scope} exceeded for {kind} {values[kind]}")
+                raise RateLimitError(
+                    "Too many requests. Please try again later.",
+                    retry_after=retry_after,
+                    details={'retry_after': retry_after}
+                )
+            taken.append(key)
+    except RateLimitError:
+        raise
+    except Exception as e:
+        logger.error(f"Rate limit {scope} not checked: {str(e)}")
+
+class RateLimitMixin:
+    """
+    ViewSet mixin checking the rate limits of an action before anything
+    else runs for the request, authentication included, so a refused
+    request runs no query. ``rate_limits`` maps actions to a scope of
+    RATE_LIMITS:
+
+        rate_limits = {'request_otp': 'request_otp'}
+    """
+    rate_limits = {}
+
+    def initial(self, request, *args, **kwargs):
+        scope = self.rate_limits.get(self.action)
+        if scope:
+            check_rate_limit(scope, request)
+        super().initial(request, *args, **kwargs)
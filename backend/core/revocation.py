@@ -0,0 +1,81 @@
+import threading
+import time
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+
+USER_KEY = 'auth:revoked:user:{}'
+TOKEN_KEY = 'auth:revoked:jti:{}'
+
+# Revocations this worker has already seen, key -> (value, expires at). It
+# only ever holds live revocations, which the shared cache is the source of
+_local = {}
+_local_lock = threading.Lock()
+
+def get_revocation_keys(user_id, jti):
+    """Cache keys of the revocations that may apply to a token of ``user_id`` with ``jti``"""
+    keys = [USER_KEY.format(user_id)]
+    if jti:
+        keys.append(TOKEN_KEY.format(jti))
+    return keys
+
+def _remember(key, value, expires_at):
+    now = time.time()
+    with _local_lock:
+        for stale in [stale for stale, (_, expiry) in _local.items() if expiry <= now]:
+            del _local[stale]
+        _local[key] = (value, expires_at)
+
+def _revoke(key, value, timeout):
+    if timeout <= 0:
+        return
+    cache.set(key, value, timeout)
+    _remember(key, value, time.time() + timeout)
+
+def revoke_user(user_id):
+    """
+    Revoke every token issued to ``user_id`` until now. Tokens issued
+    afterwards, e.g. once access is restored, are valid again.
+    """
+    timeout = int(max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME).total_seconds())
+    _revoke(USER_KEY.format(user_id), int(time.time()), timeout)
+
+def revoke_token(token):
+    """Revoke a single access or refresh token until it expires"""
+    jti = token.get(api_settings.JTI_CLAIM)
+    if jti:
+        _revoke(TOKEN_KEY.format(jti), True, int(token['exp'] - time.time()) + 1)
+
+def get_local_revocations(keys):
+    """The revocations among ``keys`` this worker already knows of, without asking the cache"""
+    now = time.time()
+    found = {}
+    for key in keys:
+        entry = _local.get(key)
+        if entry and entry[1] > now:
+            found[key] = entry[0]
+    return found
+
+def is_revoked(token, revocations):
+    """
+    Whether ``token`` is revoked according to ``revocations``, the values of
+    its get_revocation_keys() fetched from the cache. Revocations found are
+    kept by this worker so the token is refused without the cache next time.
+    """
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    keys = get_revocation_keys(user_id, token.get(api_settings.JTI_CLAIM))
+    revoked = False
+    revoked_at = revocations.get(keys[0])
+    if revoked_at is not None:
+        _remember(keys[0], revoked_at, revoked_at + api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+        # Tokens issued in the second of the revocation are let through, as
+        # ``iat`` has no finer resolution
+        revoked = token.get('iat', 0) < revoked_at
+    if len(keys) > 1 and revocations.get(keys[1]):
+        _remember(keys[1], True, token['exp'])
+        revoked = True
+    return revoked
+
+def is_token_revoked(token):
+    """Whether ``token`` or its user is revoked, looked up on its own"""
+    keys = get_revocation_keys(token.get(api_settings.USER_ID_CLAIM), token.get(api_settings.JTI_CLAIM))
+    return is_revoked(token, get_local_revocations(keys)) or is_revoked(token, cache.get_many(keys))
@@ -0,0 +1,45 @@
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import CharField, Lookup, Q, TextField
+from django.db.models.functions import Greatest
+from django.db.models.lookups import IContains
+
+SEARCH_MODE_PARAM = 'search_mode'
+SIMILARITY_MODE = 'similarity'
+
+@CharField.register_lookup
+@TextField.register_lookup
+class TrigramIContains(IContains):
+    """
+    Case insensitive containment written as ``column ILIKE '%term%'``, which
+    a pg_trgm GIN index on the column can serve. The built in icontains
+    compares ``UPPER(column)`` and always scans the table.
+    """
+    lookup_name = 'trgm_icontains'
+
+    def as_postgresql(self, compiler, connection):
+        # Skip the UPPER() cast BuiltinLookup adds to the column
+        lhs_sql, lhs_params = Lookup.process_lhs(self, compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} ILIKE {rhs_sql}', (*lhs_params, *rhs_params)
+
+def is_similarity_search(request):
+    """Return True when the request asked for ``?search_mode=similarity``"""
+    return request.query_params.get(SEARCH_MODE_PARAM) == SIMILARITY_MODE
+
+def search_q(term, fields, similarity=False):
+    """
+    Match ``term`` against any of ``fields``. In similarity mode words that
+    are close to the term (typos, partial words) match as well.
+    """
+    q = Q()
+    for field in fields:
+        q |= Q(**{f'{field}__trgm_icontains': term})
+        if similarity:
+            q |= Q(**{f'{field}__trigram_word_similar': term})
+    return q
+
+def rank_by_similarity(queryset, text, fields):
+    """Order ``queryset`` by how closely the best of ``fields`` resembles ``text``"""
+    similarities = [TrigramWordSimilarity(text, field) for field in fields]
+    rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', 'pk')
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -137,6 +138,110 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Internal nginx location serving MEDIA_ROOT (frontend/nginx.conf). Permission
+# checked downloads hand the file to nginx with X-Accel-Redirect when set, and
+# are streamed by Django otherwise (core.downloads)
+MEDIA_X_ACCEL_REDIRECT = config('MEDIA_X_ACCEL_REDIRECT', default='')
+
+# Storage of submitted files (courses.storage). 'local' keeps them below
+# MEDIA_ROOT, 's3' in an S3 compatible object store that clients upload to
+# and download from directly through presigned URLs
+SUBMISSION_STORAGE = config('SUBMISSION_STORAGE', default='local')
+SUBMISSION_URL_EXPIRY = config('SUBMISSION_URL_EXPIRY', default=15 * 60, cast=int)
+
+if SUBMISSION_STORAGE == 's3':
+    SUBMISSION_STORAGE_BACKEND = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': config('SUBMISSION_S3_BUCKET'),
+            'endpoint_url': config('SUBMISSION_S3_ENDPOINT_URL', default=None),
+            'region_name': config('SUBMISSION_S3_REGION', default=None),
+            'access_key': config('SUBMISSION_S3_ACCESS_KEY', default=None),
+            'secret_key': config('SUBMISSION_S3_SECRET_KEY', default=None),
+            'location': config('SUBMISSION_S3_PREFIX', default=''),
+            'signature_version': 's3v4',
+            'addressing_style': config('SUBMISSION_S3_ADDRESSING_STYLE', default='path'),
+            'querystring_expire': SUBMISSION_URL_EXPIRY,
+            # exists() only asks the store when files are not overwritten
+            'file_overwrite': False,
+            'default_acl': None,
+        },
+    }
+else:
+    SUBMISSION_STORAGE_BACKEND = {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': MEDIA_ROOT,
+            'base_url': MEDIA_URL,
+        },
+    }
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'submissions': SUBMISSION_STORAGE_BACKEND,
+}
+
+# Resumable submission uploads (courses.uploads)
+SUBMISSION_UPLOAD_CHUNK_SIZE = config('SUBMISSION_UPLOAD_CHUNK_SIZE', default=5 * 1024 * 1024, cast=int)
+SUBMISSION_UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Storage for submitted files per organization in MB, 0 for unlimited. An
+# organization's storage_quota_mb overrides it (courses.stats)
+ORGANIZATION_STORAGE_QUOTA_MB = config('ORGANIZATION_STORAGE_QUOTA_MB', default=0, cast=int)
+
+# Threads post-processing submitted files after the request (courses.processing).
+# 0 processes them in the request, right after its transaction commits
+SUBMISSION_PROCESSING_WORKERS = config('SUBMISSION_PROCESSING_WORKERS', default=2, cast=int)
+
+# Cache shared by the workers when CACHE_REDIS_URL is set (needs the redis
+# package), a per process memory cache otherwise. Token revocations and rate
+# limits need the shared cache, the system checks warn without it
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', default='')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds an authenticated user and their organization are cached for (core.authentication).
+# Other workers only see a change to them once their entry expires with the
+# per process cache, which keeps them for 30 seconds by default
+PRINCIPAL_CACHE_TTL = config('PRINCIPAL_CACHE_TTL', default=300 if CACHE_REDIS_URL else 30, cast=int)
+
+# Where login and registration OTPs are kept (users.otp): 'cache' or
+# 'database'. The cache store needs a cache shared by all workers
+OTP_STORE = config('OTP_STORE', default='cache' if CACHE_REDIS_URL else 'database')
+OTP_EXPIRY = timedelta(minutes=5)
+# Tries of an OTP before it is burned and a new one has to be requested
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)
+
+# Token buckets for the public endpoints (core.ratelimit), per scope and per
+# client IP, email or email domain. '5/h' lets 5 requests through in a burst,
+# then refills at 5 per hour. The buckets need a cache shared by all workers
+# (CACHE_REDIS_URL), with the memory cache each worker counts on its own and
+# the system checks warn (users.W001) when DEBUG is off
+RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+RATE_LIMITS = {
+    'request_otp': {'ip': '20/h', 'email': '5/h', 'domain': '300/h'},
+    'verify_otp': {'ip': '30/h', 'email': '10/h'},
+    'access_request': {'ip': '10/h', 'email': '3/h'},
+}
+# Reverse proxies in front of the app, whose X-Forwarded-For gives the client IP
+RATE_LIMIT_PROXY_COUNT = config('RATE_LIMIT_PROXY_COUNT', default=0, cast=int)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -148,7 +253,7 @@ AUTH_USER_MODEL = 'users.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',  # Default to requiring authentication
@@ -191,6 +296,11 @@ SIMPLE_JWT = {
             'message': 'User not found',
             'code': 401,
             'details': None
+        },
+        'token_revoked': {
+            'message': 'Token has been revoked',
+            'code': 401,
+            'details': None
         }
     }
 }
@@ -224,11 +334,26 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-chunk-checksum',
 ]
 
 # Email settings
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
-EMAIL_HOST_USER = 'noreply@example.com'
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='noreply@example.com')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_TIMEOUT = 30
+
+# Outgoing emails are queued in OutboundEmail and sent by these threads after
+# the request (users.mail), 0 sends them in the request after it commits
+EMAIL_OUTBOX_WORKERS = config('EMAIL_OUTBOX_WORKERS', default=1, cast=int)
+# Emails sent over one connection to the mail server
+EMAIL_BATCH_SIZE = 50
+# Tries of an email before it is marked FAILED, the delay doubling after each
+EMAIL_MAX_ATTEMPTS = config('EMAIL_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_RETRY_DELAY = timedelta(seconds=30)
 
 # Logging configuration
 LOGGING = {
@@ -1,5 +1,32 @@
 from django.contrib import admin
-from .models import Course, Module, Lesson, Tag, Assessment
+from .models import Course, Module, Lesson, Tag, Assessment, FileSubmission
+from .cascade import (
+    soft_delete_courses, restore_courses, soft_delete_modules, restore_modules,
+    soft_delete_lessons, restore_lessons
+)
+from .processing import process_submission
+
+class SoftDeleteAdminMixin:
+    """
+    Routes the admin's bulk delete action through the soft delete cascade
+    and adds a bulk restore action. ``soft_delete`` and ``restore`` are the
+    cascade functions for the model.
+    """
+    soft_delete = None
+    restore = None
+    actions = ['restore_selected']
+
+    def delete_queryset(self, request, queryset):
+        counts = self.soft_delete(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f"Soft deleted {self.format_counts(counts)}")
+
+    @admin.action(description='Restore selected items')
+    def restore_selected(self, request, queryset):
+        counts = self.restore(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f"Restored {self.format_counts(counts)}")
+
+    def format_counts(self, counts):
+        return ', '.join(f'{count} {name}' for name, count in counts.items() if count) or 'nothing'
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -10,7 +37,9 @@ class TagAdmin(admin.ModelAdmin):
     list_per_page = 10
 
 @admin.register(Course)
-class CourseAdmin(admin.ModelAdmin):
+class CourseAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
+    soft_delete = staticmethod(soft_delete_courses)
+    restore = staticmethod(restore_courses)
     list_display = ('title', 'organization', 'status', 'created_at', 'updated_at', 'deleted_at')
     list_filter = ('organization', 'status', 'created_at', 'tags', 'deleted_at')
     search_fields = ('title', 'description', 'organization__name', 'tags__name')
@@ -23,7 +52,9 @@ class CourseAdmin(admin.ModelAdmin):
         return Course.all_objects.all()
 
 @admin.register(Module)
-class ModuleAdmin(admin.ModelAdmin):
+class ModuleAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
+    soft_delete = staticmethod(soft_delete_modules)
+    restore = staticmethod(restore_modules)
     list_display = ('title', 'course', 'order', 'created_at', 'deleted_at')
     list_filter = ('course__organization', 'course', 'created_at', 'deleted_at')
     search_fields = ('title', 'description', 'course__title')
@@ -35,7 +66,9 @@ class ModuleAdmin(admin.ModelAdmin):
         return Module.all_objects.all()
 
 @admin.register(Lesson)
-class LessonAdmin(admin.ModelAdmin):
+class LessonAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
+    soft_delete = staticmethod(soft_delete_lessons)
+    restore = staticmethod(restore_lessons)
     list_display = ('title', 'module', 'order', 'created_at', 'deleted_at')
     list_filter = ('module__course__organization', 'module__course', 'module', 'created_at', 'deleted_at')
     search_fields = ('title', 'description', 'module__title', 'module__course__title')
@@ -57,3 +90,22 @@ class AssessmentAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         return Assessment.all_objects.all()
+
+@admin.register(FileSubmission)
+class FileSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'user', 'assessment', 'file_size', 'processing_status', 'detected_type', 'submitted_at')
+    list_filter = ('processing_status', 'detected_type', 'submitted_at')
+    # Extracted text makes the contents of submitted files searchable
+    search_fields = ('file_name', 'user__email', 'assessment__title', 'extracted_text')
+    ordering = ('-submitted_at',)
+    readonly_fields = ('file_path', 'file_size', 'blob', 'processing_status', 'processing_error', 'processed_at',
+                       'detected_type', 'page_count', 'preview_path', 'extracted_text', 'submitted_at',
+                       'created_at', 'updated_at')
+    list_select_related = ('user', 'assessment')
+    actions = ['process_selected']
+    list_per_page = 10
+
+    @admin.action(description='Process selected submissions again')
+    def process_selected(self, request, queryset):
+        statuses = [process_submission(pk) for pk in queryset.values_list('pk', flat=True)]
+        self.message_user(request, f"Processed {sum(1 for status in statuses if status)} submissions")
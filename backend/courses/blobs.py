@@ -0,0 +1,197 @@
+import hashlib
+import os
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import SubmissionBlob
+from .storage import get_submission_storage, copy_object
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+# Blob files written in the current blob_transaction(), as (storage, name, sha256)
+_written = ContextVar('written_blobs', default=None)
+
+def get_blob_name(sha256):
+    """
+    Storage name of the content ``sha256``, fanned out over two directory
+    levels so no directory grows too large: blobs/ab/cd/abcd...
+    """
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+def get_preview_name(sha256):
+    """Storage name of the preview image rendered from the content ``sha256``"""
+    return f'previews/{sha256[:2]}/{sha256}.png'
+
+def hash_chunks(chunks):
+    """Return (sha256, size) of the content yielded by ``chunks``"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+def read_chunks(path):
+    with open(path, 'rb') as source:
+        while True:
+            data = source.read(READ_SIZE)
+            if not data:
+                break
+            yield data
+
+class LocalFile(File):
+    """A file on local disk that a filesystem storage moves into place instead of copying"""
+    def temporary_file_path(self):
+        return self.name
+
+def _save(storage, name, content):
+    saved = storage.save(name, content)
+    if saved != name:
+        # Written concurrently by an identical submission, the storage kept both
+        storage.delete(saved)
+
+@contextmanager
+def blob_transaction():
+    """
+    transaction.atomic() for code storing blobs. The blob files written
+    inside it are deleted again when it rolls back, unless another
+    transaction committed a row for the same content meanwhile.
+    """
+    written = _written.get()
+    if written is None:
+        written = []
+    start = len(written)
+    token = _written.set(written)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        _discard_written(written[start:])
+        del written[start:]
+        raise
+    finally:
+        _written.reset(token)
+
+def _discard_written(written):
+    for storage, name, sha256 in written:
+        try:
+            if not SubmissionBlob.objects.filter(pk=sha256).exists():
+                storage.delete(name)
+                logger.info(f"Removed blob {sha256} written by a rolled back transaction")
+        except Exception as e:
+            # Left for clean_media to find
+            logger.error(f"Error removing blob {sha256} of a rolled back transaction: {str(e)}")
+
+def acquire_blob(sha256, size, write):
+    """
+    Take a reference to the blob holding content ``sha256`` and return its
+    key. ``write(storage, name)`` is only called to store the content when no copy
+    exists yet, so a duplicate costs a single UPDATE and no disk write. Call
+    inside the blob_transaction() that saves the referencing row.
+    """
+    storage = get_submission_storage()
+    name = get_blob_name(sha256)
+    # The UPDATE keeps the row locked until the transaction ends, so it cannot be released meanwhile
+    referenced = SubmissionBlob.objects.filter(pk=sha256).update(ref_count=F('ref_count') + 1)
+    if referenced and storage.exists(name):
+        logger.info(f"Blob {sha256} already stored, skipping the write")
+        return sha256
+    if referenced:
+        logger.warning(f"Blob {sha256} was missing from storage, storing it again")
+
+    write(storage, name)
+    written = _written.get()
+    if written is not None:
+        written.append((storage, name, sha256))
+    if not referenced:
+        try:
+            with transaction.atomic():
+                SubmissionBlob.objects.create(sha256=sha256, size=size, ref_count=1)
+        except IntegrityError:
+            # Stored concurrently by an identical submission
+            SubmissionBlob.objects.filter(pk=sha256).update(ref_count=F('ref_count') + 1)
+    return sha256
+
+def store_uploaded_file(file, sha256=None):
+    """
+    Store a Django UploadedFile as a blob and return its key, with a new
+    reference. Pass the ``sha256`` computed while the file was received
+    (SubmissionUploadHandler.checksums) so it is only read to be stored.
+    """
+    if sha256 is None:
+        sha256, _ = hash_chunks(file.chunks())
+    return acquire_blob(sha256, file.size, lambda storage, name: _save(storage, name, file))
+
+def store_local_file(source_path):
+    """
+    Store a file that is on local disk as a blob and return its key, with a
+    new reference. The file is moved into a local storage or streamed to a
+    remote one. What is left of it is removed once the transaction commits.
+    """
+    sha256, size = hash_chunks(read_chunks(source_path))
+
+    def write(storage, name):
+        with LocalFile(open(source_path, 'rb'), name=source_path) as content:
+            _save(storage, name, content)
+
+    def remove_source():
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+    acquire_blob(sha256, size, write)
+    transaction.on_commit(remove_source)
+    return sha256
+
+def store_staged_object(staging_name, sha256, size):
+    """
+    Store an object a client uploaded to the storage directly as a blob and
+    return its key, with a new reference. The object is copied inside the
+    storage, the staged copy is removed once the transaction commits.
+    """
+    storage = get_submission_storage()
+    acquire_blob(sha256, size, lambda storage, name: copy_object(storage, staging_name, name))
+    transaction.on_commit(lambda: storage.delete(staging_name))
+    return sha256
+
+def release_blobs(blob_ids):
+    """
+    Drop one reference per occurrence in ``blob_ids``. Blobs nobody refers to
+    anymore are deleted together with their file once the transaction
+    commits, so a rollback leaves every file in place.
+    """
+    released = Counter(blob_id for blob_id in blob_ids if blob_id)
+    if not released:
+        return
+    unused = []
+    with transaction.atomic():
+        blobs = SubmissionBlob.objects.select_for_update().filter(pk__in=released).order_by('pk')
+        for blob in blobs:
+            blob.ref_count = max(blob.ref_count - released[blob.pk], 0)
+            blob.save(update_fields=['ref_count'])
+            if not blob.ref_count:
+                unused.append(blob.pk)
+    if unused:
+        transaction.on_commit(lambda: delete_unused_blobs(unused))
+
+def delete_unused_blobs(blob_ids):
+    """
+    Delete the blobs of ``blob_ids`` that still have no reference, with
+    their files. Each is checked under its row lock, so a concurrent acquire
+    of the same content either keeps it or waits and writes a fresh copy.
+    """
+    storage = get_submission_storage()
+    for sha256 in blob_ids:
+        with transaction.atomic():
+            blob = SubmissionBlob.objects.select_for_update().filter(pk=sha256, ref_count=0).first()
+            if blob is None:
+                continue
+            blob.delete()
+            storage.delete(get_blob_name(sha256))
+            storage.delete(get_preview_name(sha256))
+        logger.info(f"Removed unused blob {sha256}")
@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Course, Module, Lesson, Assessment
+from .stats import record_course_change
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _counts(courses=0, modules=0, lessons=0, assessments=0):
+    return {'courses': courses, 'modules': modules, 'lessons': lessons, 'assessments': assessments}
+
+def _assessments(course_ids=(), module_ids=None, lesson_ids=None):
+    """Assessments attached to any of the given courses, modules or lessons"""
+    q = Q(assessable_type='Course', assessable_id__in=course_ids)
+    if module_ids is not None:
+        q |= Q(assessable_type='Module', assessable_id__in=module_ids)
+    if lesson_ids is not None:
+        q |= Q(assessable_type='Lesson', assessable_id__in=lesson_ids)
+    return Assessment.all_objects.filter(q)
+
+def _set_deleted_at(course_ids, module_ids, lesson_ids, deleted_at):
+    """
+    Apply ``deleted_at`` to everything below the given rows with one UPDATE
+    per table. Only rows whose state changes are touched and counted.
+    """
+    changed = Q(deleted_at__isnull=True) if deleted_at else Q(deleted_at__isnull=False)
+    now = timezone.now()
+
+    modules = Module.all_objects.filter(Q(course_id__in=course_ids) | Q(pk__in=module_ids))
+    lessons = Lesson.all_objects.filter(
+        Q(module__course_id__in=course_ids) | Q(module_id__in=module_ids) | Q(pk__in=lesson_ids)
+    )
+    assessments = _assessments(
+        course_ids,
+        modules.values('pk'),
+        lessons.values('pk')
+    )
+
+    return _counts(
+        assessments=assessments.filter(changed).update(deleted_at=deleted_at, updated_at=now),
+        lessons=lessons.filter(changed).update(deleted_at=deleted_at, updated_at=now),
+        modules=modules.filter(changed).update(deleted_at=deleted_at, updated_at=now),
+    )
+
+def _cascade_courses(course_ids, deleted_at):
+    with transaction.atomic():
+        courses = list(
+            Course.all_objects.select_for_update().filter(pk__in=course_ids).only('id', 'organization_id', 'status', 'deleted_at')
+        )
+        changing = [course for course in courses if (course.deleted_at is None) == (deleted_at is not None)]
+        ids = [course.id for course in changing]
+        if not ids:
+            return _counts()
+
+        counts = _set_deleted_at(ids, [], [], deleted_at)
+        counts['courses'] = Course.all_objects.filter(pk__in=ids).update(deleted_at=deleted_at, updated_at=timezone.now())
+        for course in changing:
+            if deleted_at:
+                record_course_change(course, course.status, None)
+            else:
+                record_course_change(course, None, course.status)
+    logger.info(f"{'Soft deleted' if deleted_at else 'Restored'} {len(ids)} courses: {counts}")
+    return counts
+
+def soft_delete_courses(course_ids):
+    """
+    Soft delete courses together with their modules, lessons and every
+    assessment attached to them, in one transaction and a fixed number of
+    queries. Returns the number of rows affected per type.
+    """
+    return _cascade_courses(course_ids, timezone.now())
+
+def restore_courses(course_ids):
+    """Undo soft_delete_courses, restoring every module, lesson and assessment below the courses"""
+    return _cascade_courses(course_ids, None)
+
+def _cascade_modules(module_ids, deleted_at):
+    with transaction.atomic():
+        counts = _set_deleted_at([], module_ids, [], deleted_at)
+    logger.info(f"{'Soft deleted' if deleted_at else 'Restored'} modules: {counts}")
+    return counts
+
+def soft_delete_modules(module_ids):
+    """Soft delete modules with their lessons and assessments. Returns the affected counts"""
+    return _cascade_modules(module_ids, timezone.now())
+
+def restore_modules(module_ids):
+    """Restore modules with their lessons and assessments. Returns the affected counts"""
+    return _cascade_modules(module_ids, None)
+
+def _cascade_lessons(lesson_ids, deleted_at):
+    with transaction.atomic():
+        counts = _set_deleted_at([], [], lesson_ids, deleted_at)
+    return counts
+
+def soft_delete_lessons(lesson_ids):
+    """Soft delete lessons with their assessments. Returns the affected counts"""
+    return _cascade_lessons(lesson_ids, timezone.now())
+
+def restore_lessons(lesson_ids):
+    """Restore lessons with their assessments. Returns the affected counts"""
+    return _cascade_lessons(lesson_ids, None)
@@ -0,0 +1,149 @@
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime, time
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from core.exceptions import ValidationError
+from .models import FileSubmission
+from .storage import get_submission_file, open_chunks
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = ['archive_path', 'user_email', 'file_name', 'file_size', 'submitted_at', 'sha256', 'status']
+# The columns an export reads, extracted_text and the other large ones are left in the database
+EXPORT_FIELDS = ['id', 'file_name', 'file_path', 'file_size', 'submitted_at', 'blob_id', 'user__email']
+# Submissions fetched from the database at a time while the archive is sent
+EXPORT_CHUNK_SIZE = 200
+
+def parse_bound(value, name, end=False):
+    """
+    A datetime from an ISO 8601 date or datetime query parameter. A plain
+    date covers the whole day, ``end`` selects its last moment.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError(f"{name} must be an ISO 8601 date or datetime")
+        parsed = datetime.combine(day, time.max if end else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+def filter_submissions(submissions, submitted_after=None, submitted_before=None, latest=False):
+    """Apply the export filters to a FileSubmission queryset"""
+    if submitted_after:
+        submissions = submissions.filter(submitted_at__gte=submitted_after)
+    if submitted_before:
+        submissions = submissions.filter(submitted_at__lte=submitted_before)
+    if latest:
+        # Postgres DISTINCT ON keeps the first row of every user in this order
+        return submissions.order_by('user_id', '-submitted_at').distinct('user_id')
+    return submissions.order_by('user_id', 'submitted_at')
+
+def latest_per_user(submissions):
+    """
+    Keep the last submission of every user, whatever the ordering of
+    ``submissions``. An anti-join on (assessment, user, submitted_at) rather
+    than DISTINCT ON, so the result can still be sorted and keyset paginated.
+    """
+    later = FileSubmission.objects.filter(
+        assessment=OuterRef('assessment'),
+        user=OuterRef('user'),
+        submitted_at__gt=OuterRef('submitted_at')
+    )
+    return submissions.filter(~Exists(later))
+
+class _ArchiveBuffer:
+    """
+    The file the ZipFile writes to. It is neither seekable nor tellable, so
+    zipfile streams entries with data descriptors, and it is drained into the
+    response after every write.
+    """
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+def get_archive_path(submission, taken):
+    submitted_at = timezone.localtime(submission.submitted_at)
+    file_name = os.path.basename(submission.file_name.replace('\\', '/')) or 'file'
+    path = f"{submission.user.email}/{submitted_at:%Y-%m-%d_%H-%M-%S}_{file_name}"
+    # Two files of one user in the same second keep apart
+    candidate, counter = path, 1
+    while candidate in taken:
+        root, ext = os.path.splitext(path)
+        candidate, counter = f"{root}_{counter}{ext}", counter + 1
+    taken.add(candidate)
+    return candidate
+
+def stream_submissions_zip(submissions):
+    """
+    Yield a ZIP of the files of ``submissions``, one per user directory and
+    named by submission time, followed by a CSV manifest. Files are stored
+    uncompressed and copied in blocks as they are read, so memory stays
+    bounded whatever the size of the archive. A file missing from storage
+    is left out and reported in the manifest.
+    """
+    buffer = _ArchiveBuffer()
+    manifest = io.StringIO()
+    writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    taken = {MANIFEST_NAME}
+
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for submission in submissions:
+            archive_path = get_archive_path(submission, taken)
+            row = {
+                'archive_path': archive_path,
+                'user_email': submission.user.email,
+                'file_name': submission.file_name,
+                'file_size': submission.file_size,
+                'submitted_at': submission.submitted_at.isoformat(),
+                'sha256': submission.blob_id or '',
+                'status': 'included',
+            }
+            storage, name = get_submission_file(submission)
+            try:
+                if storage is None:
+                    raise FileNotFoundError(submission.file_path)
+                # Opened before the entry is started, so a missing file leaves no trace in the archive
+                chunks = open_chunks(storage, name)
+            except Exception as e:
+                logger.warning(f"Submission {submission.id} left out of the export: {str(e)}")
+                row['status'] = 'missing'
+                writer.writerow(row)
+                continue
+
+            info = zipfile.ZipInfo(archive_path, timezone.localtime(submission.submitted_at).timetuple()[:6])
+            info.file_size = submission.file_size
+            info.external_attr = 0o644 << 16
+            try:
+                with archive.open(info, 'w') as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                        yield buffer.drain()
+            finally:
+                chunks.close()
+            writer.writerow(row)
+            yield buffer.drain()
+
+        archive.writestr(MANIFEST_NAME, manifest.getvalue())
+    yield buffer.drain()
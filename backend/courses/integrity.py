@@ -0,0 +1,187 @@
+import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from django.core.files.storage import storages
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from .blobs import delete_unused_blobs, get_blob_name, get_preview_name, hash_chunks, release_blobs
+from .models import FileSubmission, SubmissionBlob
+from .stats import rebuild_assessment_stats, rebuild_organization_stats
+from .storage import get_submission_storage, list_files, open_chunks
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Files of submissions made before the blob store, below MEDIA_ROOT (storages['default'])
+LEGACY_PREFIX = 'assessments'
+LEGACY_ROOT = 'media'
+
+class Tally:
+    """Number of files and bytes per finding of a scan"""
+    def __init__(self):
+        self.files = Counter()
+        self.bytes = Counter()
+
+    def add(self, finding, size):
+        self.files[finding] += 1
+        self.bytes[finding] += size or 0
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def find_orphans(storage, prefix, referenced, batch_size, workers, min_age):
+    """
+    Yield (name, size) of every file below ``prefix`` that no row refers to.
+    ``referenced(names)`` returns the names of a batch that are in use.
+    Files younger than ``min_age`` seconds are left alone: a blob is written
+    before the transaction saving its row commits.
+    """
+    cutoff = time.time() - min_age
+    for batch in batched(list_files(storage, prefix, workers), batch_size):
+        files = [(name, size) for name, size, modified in batch if modified <= cutoff]
+        in_use = referenced([name for name, _ in files]) if files else set()
+        for name, size in files:
+            if name not in in_use:
+                yield name, size
+
+def referenced_legacy_files(names):
+    """Names of legacy submission files, assessments/<assessment id>/<file>, that have a row"""
+    paths = {os.path.join(LEGACY_ROOT, name): name for name in names}
+    assessment_ids = set()
+    for name in names:
+        try:
+            assessment_ids.add(uuid.UUID(name.split('/')[1]))
+        except (IndexError, ValueError):
+            continue
+    # Narrowed to the assessments first, so the lookup uses the (assessment, ...) indexes
+    rows = FileSubmission.objects.filter(
+        assessment_id__in=assessment_ids, blob__isnull=True, file_path__in=paths
+    ).values_list('file_path', flat=True)
+    return {paths[path] for path in rows}
+
+def referenced_blob_files(names, get_name):
+    """Names of blob store files whose blob has a row, ``get_name(sha256)`` maps a blob to its file"""
+    keys = {os.path.basename(name).split('.')[0]: name for name in names}
+    rows = set(SubmissionBlob.objects.filter(pk__in=keys).values_list('pk', flat=True))
+    return {name for key, name in keys.items() if key in rows and get_name(key) == name}
+
+def scan_orphans(batch_size, workers, min_age):
+    """Yield (storage, name, size) of every stored submission file nothing refers to"""
+    default, submissions = storages['default'], get_submission_storage()
+    scans = [
+        (default, LEGACY_PREFIX, referenced_legacy_files),
+        (submissions, 'blobs', lambda names: referenced_blob_files(names, get_blob_name)),
+        (submissions, 'previews', lambda names: referenced_blob_files(names, get_preview_name)),
+    ]
+    for storage, prefix, referenced in scans:
+        for name, size in find_orphans(storage, prefix, referenced, batch_size, workers, min_age):
+            yield storage, name, size
+
+def scan_missing(batch_size, workers, verify=False):
+    """
+    Yield (finding, row, size) for every legacy submission and blob whose
+    file is 'missing' from storage, and with ``verify`` for every blob whose
+    content no longer matches its SHA-256 ('corrupt'). Rows are read and
+    checked a batch at a time.
+    """
+    default, submissions = storages['default'], get_submission_storage()
+
+    def check_legacy(row):
+        submission_id, file_path, size = row
+        name = os.path.relpath(file_path, LEGACY_ROOT)
+        return None if not name.startswith('..') and default.exists(name) else 'missing'
+
+    def check_blob(row):
+        sha256, size = row
+        name = get_blob_name(sha256)
+        if not verify:
+            return None if submissions.exists(name) else 'missing'
+        try:
+            actual, actual_size = hash_chunks(open_chunks(submissions, name))
+        except Exception:
+            return 'missing'
+        return None if (actual, actual_size) == (sha256, size) else 'corrupt'
+
+    scans = [
+        (FileSubmission.objects.filter(blob__isnull=True).order_by('pk').values_list('pk', 'file_path', 'file_size'), check_legacy),
+        (SubmissionBlob.objects.order_by('pk').values_list('pk', 'size'), check_blob),
+    ]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-check') as executor:
+        for rows, check in scans:
+            for batch in batched(rows.iterator(chunk_size=batch_size), batch_size):
+                for row, finding in zip(batch, executor.map(check, batch)):
+                    if finding:
+                        yield finding, row[0], row[-1]
+
+def delete_files(files, workers):
+    """Delete the (storage, name, size) ``files`` and return the bytes freed"""
+    def delete(file):
+        storage, name, size = file
+        # Deleting a file that is already gone is not an error for Django storages
+        storage.delete(name)
+        return size
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-delete') as executor:
+        return sum(executor.map(delete, files))
+
+def reconcile_references(dry_run=False):
+    """
+    Compare the reference count of every blob with the submissions actually
+    using it, which drifts when submissions are removed in bulk, e.g. by
+    cascade. Yields (sha256, stored, actual). Unless ``dry_run``, counts are
+    corrected and blobs nobody uses are deleted with their files, including
+    released blobs whose deletion after the commit did not happen.
+    """
+    drifted = SubmissionBlob.objects.annotate(actual=Count('submissions')).filter(
+        ~Q(ref_count=F('actual')) | Q(actual=0)
+    ).values_list('pk', 'ref_count', 'actual')
+    for sha256, stored, actual in drifted.iterator():
+        yield sha256, stored, actual
+        if dry_run:
+            continue
+        with transaction.atomic():
+            # Counted again under the lock, a submission may have been saved meanwhile
+            blob = SubmissionBlob.objects.select_for_update().filter(pk=sha256).first()
+            if blob is None:
+                continue
+            blob.ref_count = FileSubmission.objects.filter(blob_id=sha256).count()
+            blob.save(update_fields=['ref_count'])
+        if not blob.ref_count:
+            delete_unused_blobs([sha256])
+
+def purge_deleted_assessments(days, batch_size, dry_run=False):
+    """
+    Delete the submissions of assessments soft deleted more than ``days``
+    days ago, releasing their blobs and removing legacy files. Returns the
+    number of submissions and their bytes.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    rows = FileSubmission.objects.filter(assessment__deleted_at__lt=cutoff).order_by('pk').values_list(
+        'pk', 'blob_id', 'file_path', 'file_size', 'assessment_id', 'assessment__organization_id'
+    )
+    tally = Tally()
+    default = storages['default']
+    for batch in batched(rows.iterator(chunk_size=batch_size), batch_size):
+        for row in batch:
+            tally.add('purged', row[3])
+        if dry_run:
+            continue
+        with transaction.atomic():
+            FileSubmission.objects.filter(pk__in=[row[0] for row in batch]).delete()
+            release_blobs([row[1] for row in batch])
+            # The storage rollups are recomputed once per batch rather than adjusted per row
+            rebuild_assessment_stats({row[4] for row in batch})
+            rebuild_organization_stats({row[5] for row in batch})
+        for _, blob_id, file_path, *_ in batch:
+            name = os.path.relpath(file_path, LEGACY_ROOT)
+            if not blob_id and not name.startswith('..'):
+                default.delete(name)
+        logger.info(f"Purged {len(batch)} submissions of deleted assessments")
+    return tally.files['purged'], tally.bytes['purged']
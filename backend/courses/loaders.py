@@ -0,0 +1,152 @@
+from collections import defaultdict
+from django.db.models import Count, prefetch_related_objects
+from .models import Module, Lesson, CourseEnrollment, Assessment
+import logging
+
+logger = logging.getLogger(__name__)
+
+def show_deleted_requested(request):
+    """Return True when the request asked for soft-deleted rows as well"""
+    return bool(request) and request.query_params.get('show_deleted', 'false').lower() == 'true'
+
+class ModuleRelationLoader:
+    """
+    Batch loads the lessons for a list of modules so that ModuleSerializer
+    does not need to query once per module.
+
+    When a ModuleSerializer is given, only what it renders is loaded: no
+    lessons when ``lessons`` is not selected and no lesson ``content`` when
+    the nested lesson fields leave it out.
+    """
+    def __init__(self, modules, context=None, serializer=None):
+        self.modules = list(modules)
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.serializer = serializer
+
+    def load(self):
+        if self.serializer is not None and 'lessons' not in self.serializer.fields:
+            return self.modules
+
+        # Modules already loaded as part of a course page are skipped
+        pending = [module for module in self.modules if not hasattr(module, '_loaded_lessons')]
+        if not pending:
+            return self.modules
+
+        module_ids = [module.id for module in pending]
+        lessons = Lesson.all_objects.filter(module_id__in=module_ids).defer('search_vector')
+        if not show_deleted_requested(self.request):
+            lessons = lessons.filter(deleted_at__isnull=True)
+        if self.serializer is not None and 'content' not in self.serializer.get_lesson_serializer().fields:
+            lessons = lessons.defer('content')
+
+        lessons_by_module = defaultdict(list)
+        for lesson in lessons.order_by('order'):
+            lessons_by_module[lesson.module_id].append(lesson)
+
+        for module in pending:
+            module._loaded_lessons = lessons_by_module.get(module.id, [])
+        return self.modules
+
+class CourseRelationLoader:
+    """
+    Batch loads everything CourseSerializer renders for a page of courses:
+    modules and their lessons, tags, course level assessments with their
+    file submission config, the requesting user's latest enrollment and the
+    active enrollments count. The number of queries is fixed per page no
+    matter how many courses, modules or lessons it contains.
+
+    When a CourseSerializer is given, relations for fields it does not
+    render are not queried at all.
+    """
+    def __init__(self, courses, context=None, serializer=None):
+        self.courses = list(courses)
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.serializer = serializer
+
+    def wants(self, field_name):
+        return self.serializer is None or field_name in self.serializer.fields
+
+    def load(self):
+        if not self.courses:
+            return self.courses
+
+        course_ids = [course.id for course in self.courses]
+        show_deleted = show_deleted_requested(self.request)
+
+        prefetch_related_objects(self.courses, 'organization')
+        if self.wants('tags'):
+            prefetch_related_objects(self.courses, 'tags')
+        if self.wants('modules'):
+            self._load_modules(course_ids, show_deleted)
+        if self.wants('assessments'):
+            self._load_assessments(course_ids, show_deleted)
+        if self.wants('enrollment'):
+            self._load_enrollments(course_ids)
+        if self.wants('active_enrollments_count'):
+            self._load_active_enrollments_counts(course_ids)
+
+        logger.debug(f"Batch loaded relations for {len(self.courses)} courses")
+        return self.courses
+
+    def _load_modules(self, course_ids, show_deleted):
+        modules = Module.all_objects.filter(course_id__in=course_ids)
+        if not show_deleted:
+            modules = modules.filter(deleted_at__isnull=True)
+        modules = list(modules.order_by('order'))
+        module_serializer = self.serializer.get_module_serializer() if self.serializer is not None else None
+        ModuleRelationLoader(modules, self.context, serializer=module_serializer).load()
+
+        modules_by_course = defaultdict(list)
+        for module in modules:
+            modules_by_course[module.course_id].append(module)
+
+        for course in self.courses:
+            course._loaded_modules = modules_by_course.get(course.id, [])
+
+    def _load_assessments(self, course_ids, show_deleted):
+        assessments = Assessment.all_objects.filter(
+            assessable_type='Course',
+            assessable_id__in=course_ids
+        ).select_related('file_submission')
+        if not show_deleted:
+            assessments = assessments.filter(deleted_at__isnull=True)
+
+        assessments_by_course = defaultdict(list)
+        for assessment in assessments:
+            assessments_by_course[assessment.assessable_id].append(assessment)
+
+        for course in self.courses:
+            course._loaded_assessments = assessments_by_course.get(course.id, [])
+
+    def _load_enrollments(self, course_ids):
+        user = getattr(self.request, 'user', None)
+        latest_by_course = {}
+        if user and user.is_authenticated:
+            enrollments = CourseEnrollment.objects.filter(
+                user=user,
+                course_id__in=course_ids
+            ).order_by('course_id', '-enrolled_at')
+            for enrollment in enrollments:
+                # Rows are ordered newest first within each course
+                latest_by_course.setdefault(enrollment.course_id, enrollment)
+
+        for course in self.courses:
+            enrollment = latest_by_course.get(course.id)
+            if enrollment:
+                # Avoid lazy loads when CourseEnrollmentSerializer reads course.title and user.email
+                enrollment.course = course
+                enrollment.user = user
+            course._loaded_enrollment = enrollment
+
+    def _load_active_enrollments_counts(self, course_ids):
+        counts = dict(
+            CourseEnrollment.objects.filter(
+                course_id__in=course_ids,
+                status='ENROLLED'
+            ).order_by().values('course_id').annotate(count=Count('id')).values_list('course_id', 'count')
+        )
+
+        for course in self.courses:
+            course._loaded_active_enrollments_count = counts.get(course.id, 0)
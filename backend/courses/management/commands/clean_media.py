@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from courses.integrity import (
+    Tally, batched, scan_orphans, scan_missing, delete_files, reconcile_references, purge_deleted_assessments
+)
+from courses.uploads import purge_expired_uploads
+
+class Command(BaseCommand):
+    help = (
+        'Reconciles stored submission files with the database: reports files no submission refers to, '
+        'submissions whose file is missing and blob reference counts that drifted, and deletes the orphans '
+        'and the expired uploads'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of files or rows checked against the database, and orphans deleted, at a time',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Threads scanning directories, checking files and deleting orphans',
+        )
+        parser.add_argument(
+            '--min-age-minutes',
+            type=int,
+            default=60,
+            help='Leave files younger than this alone, their submission may still be saving',
+        )
+        parser.add_argument(
+            '--verify-checksums',
+            action='store_true',
+            help='Read every blob back and compare it with its SHA-256',
+        )
+        parser.add_argument(
+            '--purge-deleted-days',
+            type=int,
+            default=None,
+            help='Also delete the submissions of assessments soft deleted more than this many days ago',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report without deleting files or changing reference counts',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        workers = max(options['workers'], 1)
+        dry_run = options['dry_run']
+        verbose = options['verbosity'] > 1
+        tally = Tally()
+
+        if options['purge_deleted_days'] is not None:
+            self.stdout.write(f"Purging submissions of assessments deleted over {options['purge_deleted_days']} days ago...")
+            count, size = purge_deleted_assessments(options['purge_deleted_days'], batch_size, dry_run)
+            self.stdout.write(f'{count} submissions ({filesizeformat(size)}) of deleted assessments')
+
+        self.stdout.write('Removing expired uploads...')
+        self.stdout.write(f'Expired uploads: {purge_expired_uploads(batch_size, dry_run)}')
+
+        self.stdout.write('Reconciling blob reference counts...')
+        for sha256, stored, actual in reconcile_references(dry_run):
+            tally.files['drifted'] += 1
+            if verbose or not actual:
+                self.stdout.write(self.style.WARNING(f'Blob {sha256} has {stored} references, {actual} in use'))
+
+        self.stdout.write('Scanning for orphaned files...')
+        for batch in batched(scan_orphans(batch_size, workers, options['min_age_minutes'] * 60), batch_size):
+            for storage, name, size in batch:
+                tally.add('orphaned', size)
+                if verbose:
+                    self.stdout.write(f'Orphaned: {name} ({filesizeformat(size)})')
+            if not dry_run:
+                tally.files['deleted'] += len(batch)
+                tally.bytes['deleted'] += delete_files(batch, workers)
+
+        self.stdout.write('Checking that every stored submission has its file...')
+        for finding, key, size in scan_missing(batch_size, workers, options['verify_checksums']):
+            tally.add(finding, size)
+            self.stdout.write(self.style.WARNING(f'{finding.capitalize()}: {key} ({filesizeformat(size)})'))
+
+        for finding in ('orphaned', 'missing', 'corrupt'):
+            self.stdout.write(f'{finding.capitalize()} files: {tally.files[finding]} ({filesizeformat(tally.bytes[finding])})')
+        self.stdout.write(f"Blobs with drifted reference counts: {tally.files['drifted']}")
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS('Dry run complete. No files were deleted.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Deleted {tally.files['deleted']} orphaned files ({filesizeformat(tally.bytes['deleted'])})."
+            ))
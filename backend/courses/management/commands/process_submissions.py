@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from courses.models import FileSubmission
+from courses.processing import process_submission
+
+class Command(BaseCommand):
+    help = 'Runs the post-processing pipeline on file submissions that have not been processed or whose processing failed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of submissions loaded at a time',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Process every submission again, including ones left processing by a stopped worker',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many submissions would be processed without processing them',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        submissions = FileSubmission.objects.order_by('pk')
+        if not options['all']:
+            submissions = submissions.filter(processing_status__in=['PENDING', 'FAILED'])
+        submission_ids = list(submissions.values_list('pk', flat=True))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Dry run complete. {len(submission_ids)} submissions would be processed.'))
+            return
+
+        self.stdout.write(f'Processing {len(submission_ids)} submissions...')
+        counts = {}
+        for start in range(0, len(submission_ids), batch_size):
+            for submission_id in submission_ids[start:start + batch_size]:
+                status = process_submission(submission_id, force=options['all'])
+                counts[status] = counts.get(status, 0) + 1
+                if status in ('MISMATCH', 'FAILED'):
+                    error = FileSubmission.objects.filter(pk=submission_id).values_list('processing_error', flat=True).first()
+                    self.stdout.write(self.style.WARNING(f'Submission {submission_id}: {status} ({error})'))
+
+        summary = ', '.join(f'{count} {(status or "skipped").lower()}' for status, count in counts.items()) or 'nothing'
+        self.stdout.write(self.style.SUCCESS(f'Submissions processed: {summary}.'))
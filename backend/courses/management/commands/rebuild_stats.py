@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from courses.models import Assessment, Course
+from courses.stats import rebuild_organization_stats, rebuild_course_stats, rebuild_assessment_stats
+from users.models import Organization
+
+class Command(BaseCommand):
+    help = 'Recomputes the organization, course and assessment storage statistics rollups from the source tables and reports drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of organizations, courses or assessments rebuilt per transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without saving the recomputed counters',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        dry_run = options['dry_run']
+
+        organization_ids = list(Organization.objects.order_by('pk').values_list('pk', flat=True))
+        course_ids = list(Course.all_objects.order_by('pk').values_list('pk', flat=True))
+        # Soft deleted assessments keep their submissions, and their storage, until purged
+        assessment_ids = list(Assessment.all_objects.order_by('pk').values_list('pk', flat=True))
+
+        self.stdout.write(f'Rebuilding statistics for {len(organization_ids)} organizations...')
+        organization_drift = self.rebuild(rebuild_organization_stats, organization_ids, batch_size, dry_run)
+        self.stdout.write(f'Rebuilding statistics for {len(course_ids)} courses...')
+        course_drift = self.rebuild(rebuild_course_stats, course_ids, batch_size, dry_run)
+        self.stdout.write(f'Rebuilding storage statistics for {len(assessment_ids)} assessments...')
+        assessment_drift = self.rebuild(rebuild_assessment_stats, assessment_ids, batch_size, dry_run)
+
+        for label, drift in (
+            ('Organization', organization_drift), ('Course', course_drift), ('Assessment', assessment_drift)
+        ):
+            for pk, counters in drift.items():
+                changes = ', '.join(f'{name}: {stored} -> {actual}' for name, (stored, actual) in counters.items())
+                self.stdout.write(self.style.WARNING(f'{label} {pk} drifted ({changes})'))
+
+        summary = (
+            f'{len(organization_drift)} organizations, {len(course_drift)} courses '
+            f'and {len(assessment_drift)} assessments had drifted.'
+        )
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f'Dry run complete. {summary} No changes were saved.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Statistics rebuilt. {summary}'))
+
+    def rebuild(self, rebuild, ids, batch_size, dry_run):
+        drift = {}
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            with transaction.atomic():
+                drift.update(rebuild(batch))
+                if dry_run:
+                    transaction.set_rollback(True)
+        return drift
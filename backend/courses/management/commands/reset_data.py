@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from courses.models import Course, Module, Lesson, Tag, CourseEnrollment, Assessment
-from users.models import Organization, AccessRequest, EmailOTP
+from users.models import Organization, AccessRequest, EmailOTP, OutboundEmail
 from django.db import transaction
 
 User = get_user_model()
@@ -44,6 +44,7 @@ class Command(BaseCommand):
                 # Clear users app models
                 self.stdout.write('Clearing users app data...')
                 EmailOTP.objects.all().delete()
+                OutboundEmail.objects.all().delete()
                 AccessRequest.objects.all().delete()
                 
                 # Delete all users except superusers
@@ -53,6 +54,7 @@ class Command(BaseCommand):
                 Organization.objects.all().delete()
                 
                 self.stdout.write(self.style.SUCCESS('Successfully cleared all data while preserving superusers.'))
+                self.stdout.write('Stored submission files are left in place, run clean_media to remove them.')
                 
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'An error occurred: {str(e)}')) 
\ No newline at end of file
@@ -3,6 +3,7 @@ from django.utils import timezone
 from django.db import transaction
 from courses.models import Course, Module, Lesson, Tag, Assessment, FileSubmissionAssessment
 from users.models import Organization, User
+from courses.stats import rebuild_organization_stats
 
 class Command(BaseCommand):
     help = 'Seeds the database with e-commerce support training courses'
@@ -396,6 +397,9 @@ class Command(BaseCommand):
                 else:
                     self.stdout.write(self.style.SUCCESS(f'Using existing lesson: {lesson6.title}'))
 
+                # Seeded rows bypass the incremental counters, so refresh the rollup
+                rebuild_organization_stats([organization.pk])
+
                 self.stdout.write(self.style.SUCCESS('Successfully seeded support training courses'))
 
         except Exception as e:
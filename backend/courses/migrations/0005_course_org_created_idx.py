@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0004_alter_filesubmission_unique_together'),
+        ('users', '0002_access_request_org_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['organization', '-created_at', 'id'], name='course_org_created_idx'),
+        ),
+    ]
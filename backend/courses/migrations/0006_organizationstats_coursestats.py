@@ -0,0 +1,87 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_stats(apps, schema_editor):
+    Organization = apps.get_model('users', 'Organization')
+    User = apps.get_model('users', 'User')
+    Course = apps.get_model('courses', 'Course')
+    CourseEnrollment = apps.get_model('courses', 'CourseEnrollment')
+    OrganizationStats = apps.get_model('courses', 'OrganizationStats')
+    CourseStats = apps.get_model('courses', 'CourseStats')
+
+    enrollment_counts = dict(
+        total_enrollments=Count('pk'),
+        enrolled_enrollments=Count('pk', filter=Q(status='ENROLLED')),
+        completed_enrollments=Count('pk', filter=Q(status='COMPLETED')),
+        dropped_enrollments=Count('pk', filter=Q(status='DROPPED')),
+    )
+
+    course_rows = CourseEnrollment.objects.order_by().values('course_id').annotate(**enrollment_counts)
+    CourseStats.objects.bulk_create(
+        [CourseStats(**row) for row in course_rows.iterator()],
+        batch_size=1000
+    )
+
+    for organization_id in Organization.objects.values_list('pk', flat=True).iterator():
+        # Historical managers do not hide soft-deleted courses
+        courses = Course.objects.filter(organization_id=organization_id, deleted_at__isnull=True)
+        users = User.objects.filter(organization_id=organization_id)
+        enrollments = CourseEnrollment.objects.filter(course__organization_id=organization_id)
+        OrganizationStats.objects.create(
+            organization_id=organization_id,
+            **courses.aggregate(
+                total_courses=Count('pk'),
+                published_courses=Count('pk', filter=Q(status='PUBLISHED')),
+                draft_courses=Count('pk', filter=Q(status='DRAFT')),
+                archived_courses=Count('pk', filter=Q(status='ARCHIVED')),
+            ),
+            **enrollments.aggregate(**enrollment_counts),
+            **users.aggregate(
+                total_users=Count('pk'),
+                active_users=Count('pk', filter=Q(is_active=True)),
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_course_org_created_idx'),
+        ('users', '0002_access_request_org_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='courses.course')),
+                ('total_enrollments', models.IntegerField(default=0)),
+                ('enrolled_enrollments', models.IntegerField(default=0)),
+                ('completed_enrollments', models.IntegerField(default=0)),
+                ('dropped_enrollments', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrganizationStats',
+            fields=[
+                ('organization', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='users.organization')),
+                ('total_courses', models.IntegerField(default=0)),
+                ('published_courses', models.IntegerField(default=0)),
+                ('draft_courses', models.IntegerField(default=0)),
+                ('archived_courses', models.IntegerField(default=0)),
+                ('total_enrollments', models.IntegerField(default=0)),
+                ('enrolled_enrollments', models.IntegerField(default=0)),
+                ('completed_enrollments', models.IntegerField(default=0)),
+                ('dropped_enrollments', models.IntegerField(default=0)),
+                ('total_users', models.IntegerField(default=0)),
+                ('active_users', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
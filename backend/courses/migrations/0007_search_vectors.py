@@ -0,0 +1,86 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:08
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Weighted source columns of each searchable table. Keep in sync with courses/search.py
+SEARCH_COLUMNS = {
+    'courses_course': [('title', 'A'), ('description', 'B')],
+    'courses_module': [('title', 'A'), ('description', 'B')],
+    'courses_lesson': [('title', 'A'), ('description', 'B'), ('content', 'C')],
+}
+
+
+def create_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, columns in SEARCH_COLUMNS.items():
+        vector = ' || '.join(
+            f"setweight(to_tsvector('english', coalesce(NEW.{column}, '')), '{weight}')"
+            for column, weight in columns
+        )
+        column_names = ', '.join(column for column, _ in columns)
+        schema_editor.execute(f"""
+            CREATE OR REPLACE FUNCTION {table}_search_vector_trigger() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {vector};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        schema_editor.execute(f"""
+            CREATE TRIGGER {table}_search_vector_update
+            BEFORE INSERT OR UPDATE OF {column_names} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_trigger();
+        """)
+        # Fire the trigger once for the existing rows
+        first_column = columns[0][0]
+        schema_editor.execute(f"UPDATE {table} SET {first_column} = {first_column};")
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in SEARCH_COLUMNS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table};")
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {table}_search_vector_trigger();")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_organizationstats_coursestats'),
+        ('users', '0002_access_request_org_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='course_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='lesson_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='module',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='module_search_vector_idx'),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0009_submissionupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveIntegerField(help_text='Size in bytes')),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Number of submissions using this blob')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Stored contents. Empty for files submitted before blobs were introduced', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='submissions', to='courses.submissionblob'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:32
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+def use_storage_names(apps, schema_editor):
+    # Blob paths were relative to the working directory, they are now names in the submissions storage
+    FileSubmission = apps.get_model('courses', 'FileSubmission')
+    FileSubmission.objects.exclude(blob=None).filter(file_path__startswith='media/').update(
+        file_path=Substr('file_path', len('media/') + 1)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0010_submissionblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissionupload',
+            name='method',
+            field=models.CharField(choices=[('CHUNKED', 'Chunked'), ('DIRECT', 'Direct')], default='CHUNKED', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='submissionupload',
+            name='sha256',
+            field=models.CharField(blank=True, help_text='Declared SHA-256 of a direct upload', max_length=64),
+        ),
+        migrations.RunPython(use_storage_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0011_submissionupload_method'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesubmission',
+            name='detected_type',
+            field=models.CharField(blank=True, help_text="MIME type detected from the file's magic bytes", max_length=100),
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='extracted_text',
+            field=models.TextField(blank=True, help_text='Text content, for search'),
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='preview_path',
+            field=models.CharField(blank=True, help_text='Storage name of a PNG preview', max_length=512),
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='processing_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='filesubmission',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('DONE', 'Done'), ('MISMATCH', 'Type mismatch'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+    ]
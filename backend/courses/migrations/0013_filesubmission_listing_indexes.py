@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0012_filesubmission_processing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filesubmission',
+            index=models.Index(fields=['assessment', '-submitted_at', 'id'], name='submission_assessment_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filesubmission',
+            index=models.Index(fields=['assessment', 'user', '-submitted_at'], name='submission_assessment_user_idx'),
+        ),
+    ]
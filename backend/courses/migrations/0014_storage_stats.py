@@ -0,0 +1,54 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_storage_stats(apps, schema_editor):
+    FileSubmission = apps.get_model('courses', 'FileSubmission')
+    AssessmentStats = apps.get_model('courses', 'AssessmentStats')
+    OrganizationStats = apps.get_model('courses', 'OrganizationStats')
+
+    storage_counts = dict(submission_files=Count('pk'), submission_bytes=Sum('file_size'))
+
+    assessment_rows = FileSubmission.objects.order_by().values('assessment_id').annotate(**storage_counts)
+    AssessmentStats.objects.bulk_create(
+        [AssessmentStats(**row) for row in assessment_rows.iterator()],
+        batch_size=1000
+    )
+
+    # Organizations without stats rows get them, with these counters, the first time they are read
+    organization_rows = FileSubmission.objects.order_by().values('assessment__organization_id').annotate(**storage_counts)
+    for row in organization_rows.iterator():
+        OrganizationStats.objects.filter(pk=row.pop('assessment__organization_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0013_filesubmission_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssessmentStats',
+            fields=[
+                ('assessment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='courses.assessment')),
+                ('submission_files', models.IntegerField(default=0)),
+                ('submission_bytes', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='organizationstats',
+            name='submission_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='organizationstats',
+            name='submission_files',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_storage_stats, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 import uuid
 from users.models import Organization, User
 from django.utils import timezone
@@ -16,6 +18,9 @@ class Tag(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='tag_name_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -42,6 +47,8 @@ class Course(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    # Maintained by a database trigger from title and description
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = SoftDeleteManager()
     all_objects = models.Manager()  # Manager to access all courses including deleted ones
@@ -50,17 +57,24 @@ class Course(models.Model):
         ordering = ['-created_at']
         # Ensure title is unique within an organization
         unique_together = ['organization', 'title']
+        indexes = [
+            # Serves the default catalog ordering and its keyset pagination
+            models.Index(fields=['organization', '-created_at', 'id'], name='course_org_created_idx'),
+            GinIndex(fields=['search_vector'], name='course_search_vector_idx'),
+            # Trigram indexes serve the admin search box (core.search)
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='course_title_trgm_idx'),
+            GinIndex(fields=['description'], opclasses=['gin_trgm_ops'], name='course_description_trgm_idx'),
+        ]
 
     def __str__(self):
         return f"{self.organization.name} - {self.title}"
 
     def delete(self, *args, **kwargs):
-        self.deleted_at = timezone.now()
-        self.save()
-        # Soft delete all modules in this course
-        self.modules.all().update(deleted_at=timezone.now())
-        # Soft delete all lessons in these modules
-        Lesson.all_objects.filter(module__course=self).update(deleted_at=timezone.now())
+        # Soft delete the course with its modules, lessons and assessments
+        from .cascade import soft_delete_courses
+        counts = soft_delete_courses([self.pk])
+        self.refresh_from_db(fields=['deleted_at', 'updated_at'])
+        return counts
 
     def has_file_submission_assessments(self):
         """Check if the course has any file submission assessments"""
@@ -88,21 +102,27 @@ class Module(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    # Maintained by a database trigger from title and description
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = SoftDeleteManager()
     all_objects = models.Manager()
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='module_search_vector_idx'),
+        ]
 
     def __str__(self):
         return f"{self.course.title} - {self.title}"
 
     def delete(self, *args, **kwargs):
-        self.deleted_at = timezone.now()
-        self.save()
-        # Soft delete all lessons in this module
-        Lesson.all_objects.filter(module=self).update(deleted_at=timezone.now())
+        # Soft delete the module with its lessons and assessments
+        from .cascade import soft_delete_modules
+        counts = soft_delete_modules([self.pk])
+        self.refresh_from_db(fields=['deleted_at', 'updated_at'])
+        return counts
 
 class Lesson(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -114,19 +134,27 @@ class Lesson(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    # Maintained by a database trigger from title, description and content
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = SoftDeleteManager()
     all_objects = models.Manager()
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='lesson_search_vector_idx'),
+        ]
 
     def __str__(self):
         return f"{self.module.title} - {self.title}"
 
     def delete(self, *args, **kwargs):
-        self.deleted_at = timezone.now()
-        self.save()
+        # Soft delete the lesson with its assessments
+        from .cascade import soft_delete_lessons
+        counts = soft_delete_lessons([self.pk])
+        self.refresh_from_db(fields=['deleted_at', 'updated_at'])
+        return counts
 
 class CourseEnrollment(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -234,7 +262,25 @@ class FileSubmissionAssessment(models.Model):
     def __str__(self):
         return f"File Submission for {self.assessment.title}"
 
+class SubmissionBlob(models.Model):
+    """File contents shared by every submission of the same bytes (see courses.blobs)"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveIntegerField(help_text="Size in bytes")
+    ref_count = models.PositiveIntegerField(default=0, help_text="Number of submissions using this blob")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Blob {self.sha256} ({self.ref_count} references)"
+
 class FileSubmission(models.Model):
+    PROCESSING_STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('DONE', 'Done'),
+        ('MISMATCH', 'Type mismatch'),
+        ('FAILED', 'Failed'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     assessment = models.ForeignKey(
         Assessment,
@@ -249,12 +295,163 @@ class FileSubmission(models.Model):
     file_name = models.CharField(max_length=255)
     file_path = models.CharField(max_length=512)
     file_size = models.PositiveIntegerField(help_text="File size in bytes")
+    blob = models.ForeignKey(
+        SubmissionBlob,
+        related_name='submissions',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        help_text="Stored contents. Empty for files submitted before blobs were introduced"
+    )
+    # Filled in after the request by the post-processing pipeline (see courses.processing)
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_STATUS_CHOICES, default='PENDING')
+    processing_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    detected_type = models.CharField(max_length=100, blank=True, help_text="MIME type detected from the file's magic bytes")
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    preview_path = models.CharField(max_length=512, blank=True, help_text="Storage name of a PNG preview")
+    extracted_text = models.TextField(blank=True, help_text="Text content, for search")
     submitted_at = models.DateTimeField(auto_now_add=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-submitted_at']
+        indexes = [
+            # Serves the submissions listing of an assessment and its keyset pagination
+            models.Index(fields=['assessment', '-submitted_at', 'id'], name='submission_assessment_time_idx'),
+            # Serves the per user filter and the latest submission of every user
+            models.Index(fields=['assessment', 'user', '-submitted_at'], name='submission_assessment_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.assessment.title} - {self.file_name}"
+
+class SubmissionUpload(models.Model):
+    """
+    A resumable file submission that is sent in numbered chunks, or in one
+    piece to a presigned URL (see courses.uploads)
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('COMMITTED', 'Committed'),
+    ]
+    METHOD_CHOICES = [
+        ('CHUNKED', 'Chunked'),
+        ('DIRECT', 'Direct'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    assessment = models.ForeignKey(
+        Assessment,
+        related_name='uploads',
+        on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        'users.User',
+        related_name='submission_uploads',
+        on_delete=models.CASCADE
+    )
+    file_name = models.CharField(max_length=255)
+    file_size = models.PositiveIntegerField(help_text="Declared file size in bytes")
+    chunk_size = models.PositiveIntegerField(help_text="Size of every chunk but the last, in bytes")
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES, default='CHUNKED')
+    sha256 = models.CharField(max_length=64, blank=True, help_text="Declared SHA-256 of a direct upload")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    submission = models.OneToOneField(
+        FileSubmission,
+        related_name='upload',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Upload of {self.file_name} ({self.status})"
+
+    @property
+    def total_chunks(self):
+        return max((self.file_size + self.chunk_size - 1) // self.chunk_size, 1)
+
+    def get_chunk_length(self, index):
+        """Number of bytes chunk ``index`` must contain"""
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+class SubmissionUploadChunk(models.Model):
+    upload = models.ForeignKey(
+        SubmissionUpload,
+        related_name='chunks',
+        on_delete=models.CASCADE
+    )
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64, help_text="SHA-256 of the chunk, hex encoded")
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['index']
+        unique_together = ['upload', 'index']
+
+class OrganizationStats(models.Model):
+    """Running counters behind the admin dashboard overview, kept in step with the source tables"""
+    organization = models.OneToOneField(
+        Organization,
+        related_name='stats',
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    total_courses = models.IntegerField(default=0)
+    published_courses = models.IntegerField(default=0)
+    draft_courses = models.IntegerField(default=0)
+    archived_courses = models.IntegerField(default=0)
+    total_enrollments = models.IntegerField(default=0)
+    enrolled_enrollments = models.IntegerField(default=0)
+    completed_enrollments = models.IntegerField(default=0)
+    dropped_enrollments = models.IntegerField(default=0)
+    total_users = models.IntegerField(default=0)
+    active_users = models.IntegerField(default=0)
+    # Every FileSubmission of the organization's assessments, counted at its file_size
+    submission_files = models.IntegerField(default=0)
+    submission_bytes = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.organization_id}"
+
+class CourseStats(models.Model):
+    """Running enrollment counters for a single course"""
+    course = models.OneToOneField(
+        Course,
+        related_name='stats',
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    total_enrollments = models.IntegerField(default=0)
+    enrolled_enrollments = models.IntegerField(default=0)
+    completed_enrollments = models.IntegerField(default=0)
+    dropped_enrollments = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.course_id}"
+
+class AssessmentStats(models.Model):
+    """Running storage counters for the submissions of a single assessment"""
+    assessment = models.OneToOneField(
+        Assessment,
+        related_name='stats',
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    submission_files = models.IntegerField(default=0)
+    submission_bytes = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.assessment_id}"
@@ -0,0 +1,309 @@
+import hashlib
+import io
+import re
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+from .blobs import get_preview_name
+from .models import FileSubmission
+from .storage import get_submission_file, open_chunks
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes kept from the start of a file to detect its type
+HEAD_SIZE = 8 * 1024
+# PDFs are parsed in memory up to this size, larger ones get no page count or text
+PDF_MAX_BYTES = 20 * 1024 * 1024
+# Bytes inflated from the compressed streams of one PDF, all streams together
+PDF_INFLATED_MAX_BYTES = 20 * 1024 * 1024
+TEXT_MAX_BYTES = 1024 * 1024
+# Bytes of document.xml read from a DOCX, markup included
+DOCX_XML_MAX_BYTES = 4 * TEXT_MAX_BYTES
+TEXT_MAX_CHARS = 100 * 1000
+PREVIEW_SIZE = (320, 320)
+
+# (MIME type, magic bytes at offset 0), checked in order
+SIGNATURES = [
+    ('application/pdf', b'%PDF-'),
+    ('image/png', b'\x89PNG\r\n\x1a\n'),
+    ('image/jpeg', b'\xff\xd8\xff'),
+    ('image/gif', b'GIF87a'),
+    ('image/gif', b'GIF89a'),
+    ('application/zip', b'PK\x03\x04'),
+    ('application/x-ole-storage', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),
+]
+OFFICE_TYPES = {
+    'word/': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xl/': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'ppt/': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+TEXT_EXTENSIONS = {'txt', 'md', 'csv', 'json', 'xml', 'html', 'htm', 'py', 'js', 'ts', 'java', 'c', 'cpp', 'sql'}
+
+# What the content of a file with a given extension may be detected as
+EXTENSION_TYPES = {
+    'pdf': {'application/pdf'},
+    'png': {'image/png'},
+    'jpg': {'image/jpeg'},
+    'jpeg': {'image/jpeg'},
+    'gif': {'image/gif'},
+    'webp': {'image/webp'},
+    'zip': {'application/zip'},
+    'docx': {OFFICE_TYPES['word/']},
+    'xlsx': {OFFICE_TYPES['xl/']},
+    'pptx': {OFFICE_TYPES['ppt/']},
+    'doc': {'application/x-ole-storage'},
+    'xls': {'application/x-ole-storage'},
+    'ppt': {'application/x-ole-storage'},
+    **{extension: {'text/plain'} for extension in TEXT_EXTENSIONS},
+}
+
+PDF_STREAM_PATTERN = re.compile(rb'stream\r?\n(.*?)\r?\nendstream', re.S)
+PDF_PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+PDF_TEXT_PATTERN = re.compile(rb'\((?:[^()\\]|\\.)*\)\s*Tj|\[(?:[^\]\\]|\\.)*\]\s*TJ|T\*|Td|TD', re.S)
+PDF_STRING_PATTERN = re.compile(rb'\(((?:[^()\\]|\\.)*)\)', re.S)
+PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+class MismatchError(Exception):
+    """The content of a file is not what its extension promises"""
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SUBMISSION_PROCESSING_WORKERS,
+                thread_name_prefix='submission-processing'
+            )
+        return _executor
+
+def schedule_processing(submission):
+    """
+    Post-process ``submission`` on the worker pool once the current
+    transaction commits, so the request returns as soon as the file is
+    stored. With SUBMISSION_PROCESSING_WORKERS = 0 it runs right after the
+    commit instead.
+    """
+    submission_id = submission.pk
+
+    def enqueue():
+        if settings.SUBMISSION_PROCESSING_WORKERS > 0:
+            get_executor().submit(_process_in_worker, submission_id)
+        else:
+            process_submission(submission_id)
+
+    transaction.on_commit(enqueue)
+
+def _process_in_worker(submission_id):
+    # Worker threads have their own connection, closed like a request's would be
+    close_old_connections()
+    try:
+        process_submission(submission_id)
+    except Exception as e:
+        logger.error(f"Error processing submission {submission_id}: {str(e)}")
+    finally:
+        close_old_connections()
+
+def process_submission(submission_id, force=False):
+    """
+    Run the pipeline on one submission and save the results on its row.
+    Returns the resulting processing status, or None when the submission is
+    gone or another worker is already processing it. ``force`` also takes
+    over a submission left in PROCESSING by a worker that died.
+    """
+    submissions = FileSubmission.objects.filter(pk=submission_id)
+    if not force:
+        submissions = submissions.exclude(processing_status='PROCESSING')
+    claimed = submissions.update(
+        processing_status='PROCESSING', processing_error=''
+    )
+    if not claimed:
+        return None
+    try:
+        submission = FileSubmission.objects.get(pk=submission_id)
+    except FileSubmission.DoesNotExist:
+        return None
+
+    try:
+        results = analyze_submission(submission)
+        results['processing_status'] = 'DONE'
+    except MismatchError as e:
+        results = {'processing_status': 'MISMATCH', 'processing_error': str(e)}
+    except Exception as e:
+        logger.error(f"Processing of submission {submission_id} failed: {str(e)}")
+        results = {'processing_status': 'FAILED', 'processing_error': str(e)[:1000]}
+    results['processed_at'] = timezone.now()
+    FileSubmission.objects.filter(pk=submission_id).update(**results)
+    logger.info(f"Processed submission {submission_id}: {results['processing_status']}")
+    return results['processing_status']
+
+def analyze_submission(submission):
+    """
+    The pipeline stages: hash, type detection against the extension,
+    preview, page count and text. Raises MismatchError when the content does
+    not match the extension.
+    """
+    extension = submission.file_name.rsplit('.', 1)[-1].lower() if '.' in submission.file_name else ''
+
+    # Identical content was already analyzed for another submission
+    if submission.blob_id:
+        twin = FileSubmission.objects.filter(blob_id=submission.blob_id, processing_status='DONE').exclude(
+            pk=submission.pk
+        ).only('detected_type', 'page_count', 'preview_path', 'extracted_text').first()
+        if twin:
+            check_extension(extension, twin.detected_type)
+            return {
+                'detected_type': twin.detected_type,
+                'page_count': twin.page_count,
+                'preview_path': twin.preview_path,
+                'extracted_text': twin.extracted_text,
+            }
+
+    storage, name = get_submission_file(submission)
+    if storage is None:
+        raise FileNotFoundError(submission.file_path)
+
+    sha256, head = hash_and_head(storage, name)
+    if submission.blob_id and sha256 != submission.blob_id:
+        raise ValueError("The stored file does not match its checksum")
+
+    detected_type = detect_type(storage, name, head)
+    check_extension(extension, detected_type)
+
+    results = {'detected_type': detected_type, 'page_count': None, 'preview_path': '', 'extracted_text': ''}
+    if detected_type.startswith('image/') and submission.blob_id:
+        results['preview_path'] = make_preview(storage, name, get_preview_name(submission.blob_id))
+    elif detected_type == 'application/pdf' and submission.file_size <= PDF_MAX_BYTES:
+        results['page_count'], results['extracted_text'] = read_pdf(storage, name)
+    elif detected_type == 'text/plain':
+        results['extracted_text'] = read_text(storage, name)
+    elif detected_type == OFFICE_TYPES['word/']:
+        results['extracted_text'] = read_docx(storage, name)
+    results['extracted_text'] = clean_text(results['extracted_text'])
+    return results
+
+def hash_and_head(storage, name):
+    """SHA-256 of the file and its first bytes, in one pass"""
+    digest = hashlib.sha256()
+    head = b''
+    for chunk in open_chunks(storage, name):
+        digest.update(chunk)
+        if len(head) < HEAD_SIZE:
+            head += chunk[:HEAD_SIZE - len(head)]
+    return digest.hexdigest(), head
+
+def detect_type(storage, name, head):
+    """MIME type of the content from its magic bytes, 'text/plain' for UTF-8 text"""
+    for mime_type, magic in SIGNATURES:
+        if head.startswith(magic):
+            if mime_type == 'application/zip':
+                return detect_zip_type(storage, name)
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if b'\x00' not in head:
+        try:
+            # A multi-byte character may be cut at the end of the head
+            head.decode('utf-8')
+            return 'text/plain'
+        except UnicodeDecodeError as e:
+            if e.start >= len(head) - 3:
+                return 'text/plain'
+    return 'application/octet-stream'
+
+def detect_zip_type(storage, name):
+    """Office documents are ZIP archives told apart by their contents"""
+    try:
+        with storage.open(name, 'rb') as file, zipfile.ZipFile(file) as archive:
+            names = archive.namelist()
+    except zipfile.BadZipFile:
+        return 'application/octet-stream'
+    if '[Content_Types].xml' in names:
+        for prefix, mime_type in OFFICE_TYPES.items():
+            if any(entry.startswith(prefix) for entry in names):
+                return mime_type
+    return 'application/zip'
+
+def check_extension(extension, detected_type):
+    expected = EXTENSION_TYPES.get(extension)
+    if expected and detected_type not in expected:
+        raise MismatchError(f"The content of this .{extension} file was detected as {detected_type}")
+
+def make_preview(storage, name, preview_name):
+    """Store a PNG thumbnail of an image once per content and return its storage name"""
+    if storage.exists(preview_name):
+        return preview_name
+    with storage.open(name, 'rb') as file, Image.open(file) as image:
+        # Lets JPEG decode at a reduced scale straight away
+        image.draft('RGB', PREVIEW_SIZE)
+        image.thumbnail(PREVIEW_SIZE)
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+    storage.save(preview_name, ContentFile(output.getvalue()))
+    return preview_name
+
+def read_pdf(storage, name):
+    """
+    Page count and text of a PDF, read without a PDF library: page objects
+    and text operators are looked up in the file and in its Flate
+    compressed streams. Good enough for search, not for layout. Streams are
+    inflated up to PDF_INFLATED_MAX_BYTES in total, so a deflate bomb
+    cannot exhaust memory.
+    """
+    with storage.open(name, 'rb') as file:
+        data = file.read(PDF_MAX_BYTES)
+    sections = [data]
+    remaining = PDF_INFLATED_MAX_BYTES
+    for match in PDF_STREAM_PATTERN.finditer(data):
+        if remaining <= 0:
+            break
+        try:
+            section = zlib.decompressobj().decompress(match.group(1), remaining)
+        except zlib.error:
+            continue
+        remaining -= len(section)
+        sections.append(section)
+
+    page_count = sum(len(PDF_PAGE_PATTERN.findall(section)) for section in sections) or None
+    words = []
+    for section in sections[1:] or sections:
+        for operator in PDF_TEXT_PATTERN.finditer(section):
+            text = operator.group(0)
+            if text in (b'T*', b'Td', b'TD'):
+                words.append(b'\n')
+                continue
+            words.extend(unescape_pdf_string(string) for string in PDF_STRING_PATTERN.findall(text))
+    text = b''.join(words).decode('latin-1')
+    return page_count, re.sub(r'\n{2,}', '\n', text).strip()
+
+def unescape_pdf_string(value):
+    value = re.sub(rb'\\([0-7]{1,3})', lambda match: bytes([int(match.group(1), 8) & 0xff]), value)
+    return re.sub(rb'\\(.)', lambda match: PDF_ESCAPES.get(match.group(1), match.group(1)), value, flags=re.S)
+
+def read_text(storage, name):
+    with storage.open(name, 'rb') as file:
+        return file.read(TEXT_MAX_BYTES).decode('utf-8', errors='ignore')
+
+def read_docx(storage, name):
+    """Text of a DOCX, from at most DOCX_XML_MAX_BYTES of its document.xml however well it compresses"""
+    with storage.open(name, 'rb') as file, zipfile.ZipFile(file) as archive:
+        with archive.open('word/document.xml') as entry:
+            document = entry.read(DOCX_XML_MAX_BYTES).decode('utf-8', errors='ignore')
+    document = re.sub(r'</w:p>', '\n', document)
+    # A document cut short may end inside a tag
+    return re.sub(r'<[^>]+>|<[^>]*$', '', document)
+
+def clean_text(text):
+    # Postgres text cannot hold NUL characters
+    return text.replace('\x00', '')[:TEXT_MAX_CHARS]
@@ -0,0 +1,74 @@
+import base64
+import binascii
+import json
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+from core.exceptions import ValidationError
+from .models import Course, Module, Lesson
+
+# Text search configuration used by the search_vector triggers (see migration 0007)
+SEARCH_CONFIG = 'english'
+
+SEARCH_TYPES = ['courses', 'modules', 'lessons']
+
+def build_search_query(text):
+    """
+    Turn user input into a prefix matching tsquery, so that "intro pyth"
+    matches "Introduction to Python". Returns None when nothing searchable
+    is left.
+    """
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    return SearchQuery(' & '.join(f'{term}:*' for term in terms), config=SEARCH_CONFIG, search_type='raw')
+
+def get_search_queryset(search_type, organization, query):
+    """
+    Every matching row of one type in the organization, best match first.
+    The GIN index finds the matches and all of them are ranked, so the best
+    ones are never left out of a broad query.
+    """
+    # Only the columns of the compact result are loaded, never the vector or lesson content
+    if search_type == 'courses':
+        queryset = Course.objects.filter(organization=organization).only('id', 'title', 'description', 'status')
+    elif search_type == 'modules':
+        queryset = Module.objects.filter(course__organization=organization).select_related('course').only(
+            'id', 'title', 'description', 'course__id', 'course__title'
+        )
+    else:
+        queryset = Lesson.objects.filter(module__course__organization=organization).select_related(
+            'module__course'
+        ).only(
+            'id', 'title', 'description', 'module__id', 'module__title', 'module__course__id', 'module__course__title'
+        )
+
+    return queryset.filter(search_vector=query).annotate(
+        # ts_rank is a real, as a double the rank of a cursor compares equal to the row's
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+    ).order_by('-rank', 'id')
+
+def encode_search_cursor(result):
+    payload = {'rank': result.rank, 'pk': str(result.pk)}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_search_cursor(token):
+    """The (rank, pk) of the last result a search cursor points after"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        return float(payload['rank']), str(payload['pk'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ValidationError("Invalid search cursor")
+
+def search(search_type, organization, query, offset, limit, cursor=None):
+    """
+    Return (results, has_more) for one page of a search type, the page
+    after the (rank, pk) ``cursor`` when given.
+    """
+    queryset = get_search_queryset(search_type, organization, query)
+    if cursor:
+        rank, pk = cursor
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, pk__gt=pk))
+    results = list(queryset[offset:offset + limit + 1])
+    return results[:limit], len(results) > limit
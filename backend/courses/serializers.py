@@ -1,15 +1,21 @@
 from rest_framework import serializers
-from .models import Course, Module, Lesson, CourseEnrollment, Tag, Assessment, FileSubmissionAssessment, FileSubmission
+from django.db import models
+from .models import Course, Module, Lesson, CourseEnrollment, Tag, Assessment, FileSubmissionAssessment, FileSubmission, SubmissionUpload
+from .loaders import CourseRelationLoader, ModuleRelationLoader
+from .storage import get_download_url, get_upload_url, get_upload_headers
 from core.exceptions import ValidationError
+from core.fieldsets import SparseFieldsetMixin
+import os
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Lesson
         fields = ['id', 'title', 'description', 'content', 'order', 'module', 'created_at', 'updated_at', 'deleted_at']
+        summary_fields = ['id', 'title', 'description', 'order', 'module', 'deleted_at']
         read_only_fields = ['created_at', 'updated_at']
         extra_kwargs = {
             'content': {'required': False, 'allow_blank': True}
@@ -44,15 +50,33 @@ class TagSerializer(serializers.ModelSerializer):
         # Convert name to lowercase for consistency
         return value.lower()
 
-class ModuleSerializer(serializers.ModelSerializer):
+class ModuleListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Load the lessons of every module up front instead of once per module
+        modules = ModuleRelationLoader(
+            data.all() if isinstance(data, models.Manager) else data,
+            self.context,
+            serializer=self.child
+        ).load()
+        return super().to_representation(modules)
+
+class ModuleSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     lessons = serializers.SerializerMethodField()
 
     class Meta:
         model = Module
-        fields = '__all__'
+        exclude = ['search_vector']
         read_only_fields = ['created_at', 'updated_at']
+        summary_fields = ['id', 'course', 'title', 'description', 'order', 'deleted_at']
+        list_serializer_class = ModuleListSerializer
+
+    def get_lesson_serializer(self, *args, **kwargs):
+        return self.get_nested_serializer('lessons', LessonSerializer, *args, **kwargs)
 
     def get_lessons(self, obj):
+        if hasattr(obj, '_loaded_lessons'):
+            return self.get_lesson_serializer(obj._loaded_lessons, many=True).data
+
         request = self.context.get('request')
         show_deleted = request and request.query_params.get('show_deleted', 'false').lower() == 'true'
         
@@ -62,8 +86,10 @@ class ModuleSerializer(serializers.ModelSerializer):
             lessons = Lesson.all_objects.filter(module=obj)
         else:
             lessons = Lesson.all_objects.filter(module=obj, deleted_at__isnull=True)
-            
-        return LessonSerializer(lessons, many=True).data
+
+        if 'content' not in self.get_lesson_serializer().fields:
+            lessons = lessons.defer('content')
+        return self.get_lesson_serializer(lessons, many=True).data
 
     def validate(self, data):
         # Ensure the course belongs to the user's organization
@@ -74,7 +100,17 @@ class ModuleSerializer(serializers.ModelSerializer):
                 raise ValidationError("You don't have permission to modify this module")
         return data
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Batch load the relations of the whole page so each course renders without queries
+        courses = CourseRelationLoader(
+            data.all() if isinstance(data, models.Manager) else data,
+            self.context,
+            serializer=self.child
+        ).load()
+        return super().to_representation(courses)
+
+class CourseSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     modules = serializers.SerializerMethodField()
     organization_name = serializers.CharField(source='organization.name', read_only=True)
     organization_domain = serializers.CharField(source='organization.domain', read_only=True)
@@ -96,8 +132,17 @@ class CourseSerializer(serializers.ModelSerializer):
                  'active_enrollments_count', 'deleted_at', 'assessments']
         read_only_fields = ['organization', 'organization_name', 'organization_domain', 
                           'created_at', 'updated_at', 'active_enrollments_count']
+        summary_fields = ['id', 'organization', 'organization_name', 'title', 'description', 'status',
+                          'tags', 'created_at', 'updated_at', 'enrollment', 'active_enrollments_count', 'deleted_at']
+        list_serializer_class = CourseListSerializer
+
+    def get_module_serializer(self, *args, **kwargs):
+        return self.get_nested_serializer('modules', ModuleSerializer, *args, **kwargs)
 
     def get_modules(self, obj):
+        if hasattr(obj, '_loaded_modules'):
+            return self.get_module_serializer(obj._loaded_modules, many=True).data
+
         request = self.context.get('request')
         show_deleted = request and request.query_params.get('show_deleted', 'false').lower() == 'true'
         
@@ -107,10 +152,14 @@ class CourseSerializer(serializers.ModelSerializer):
             modules = Module.all_objects.filter(course=obj)
         else:
             modules = Module.all_objects.filter(course=obj, deleted_at__isnull=True)
-            
-        return ModuleSerializer(modules, many=True, context=self.context).data
+
+        return self.get_module_serializer(modules, many=True).data
 
     def get_enrollment(self, obj):
+        if hasattr(obj, '_loaded_enrollment'):
+            enrollment = obj._loaded_enrollment
+            return CourseEnrollmentSerializer(enrollment).data if enrollment else None
+
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             # Get the latest enrollment for this user and course
@@ -124,12 +173,17 @@ class CourseSerializer(serializers.ModelSerializer):
         return None
 
     def get_active_enrollments_count(self, obj):
+        if hasattr(obj, '_loaded_active_enrollments_count'):
+            return obj._loaded_active_enrollments_count
         return CourseEnrollment.objects.filter(
             course=obj,
             status='ENROLLED'
         ).count()
 
     def get_assessments(self, obj):
+        if hasattr(obj, '_loaded_assessments'):
+            return AssessmentSerializer(obj._loaded_assessments, many=True, context=self.context).data
+
         request = self.context.get('request')
         show_deleted = request and request.query_params.get('show_deleted', 'false').lower() == 'true'
         
@@ -328,16 +382,101 @@ class FileSubmissionAssessmentSerializer(serializers.ModelSerializer):
 class FileSubmissionSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True)
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
 
     class Meta:
         model = FileSubmission
         fields = ['id', 'assessment', 'user', 'user_email', 'file_name', 'file_path', 
-                 'file_size', 'submitted_at', 'file_url', 'created_at', 'updated_at']
-        read_only_fields = ['user', 'file_path', 'file_size', 'submitted_at', 
-                          'created_at', 'updated_at']
+                 'file_size', 'submitted_at', 'file_url', 'processing_status', 'processing_error',
+                 'detected_type', 'page_count', 'preview_url', 'created_at', 'updated_at']
+        read_only_fields = ['user', 'file_path', 'file_size', 'submitted_at', 'processing_status',
+                          'processing_error', 'detected_type', 'page_count', 'created_at', 'updated_at']
 
     def get_file_url(self, obj):
         request = self.context.get('request')
-        if request:
-            return request.build_absolute_uri(f'/{obj.file_path}')
-        return None 
\ No newline at end of file
+        if not request:
+            return None
+        if obj.blob_id:
+            return get_download_url(request, obj.file_path, obj.file_name)
+        # Files submitted before the storage backends are served from MEDIA_URL
+        return request.build_absolute_uri(f'/{obj.file_path}')
+
+    def get_preview_url(self, obj):
+        request = self.context.get('request')
+        if not request or not obj.preview_path:
+            return None
+        return get_download_url(request, obj.preview_path, f'{obj.file_name}.png')
+
+class SubmissionUploadSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+    upload_url = serializers.SerializerMethodField()
+    upload_headers = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SubmissionUpload
+        fields = ['id', 'assessment', 'file_name', 'file_size', 'method', 'sha256', 'chunk_size', 'total_chunks',
+                 'received_chunks', 'upload_url', 'upload_headers', 'status', 'submission', 'created_at', 'expires_at']
+        read_only_fields = ['assessment', 'method', 'chunk_size', 'status', 'submission', 'created_at', 'expires_at']
+
+    def get_received_chunks(self, obj):
+        if obj.pk is None or obj.status != 'PENDING':
+            return []
+        return list(obj.chunks.values_list('index', flat=True))
+
+    def get_upload_url(self, obj):
+        request = self.context.get('request')
+        if not request or obj.method != 'DIRECT' or obj.status != 'PENDING':
+            return None
+        return get_upload_url(request, obj)
+
+    def get_upload_headers(self, obj):
+        if obj.method != 'DIRECT' or obj.status != 'PENDING':
+            return None
+        return get_upload_headers(obj)
+
+    def validate_file_name(self, value):
+        # Only the base name is kept, the client does not choose where the file goes
+        value = os.path.basename(value.replace('\\', '/')).strip()
+        if not value or value in ('.', '..'):
+            raise ValidationError("A file name is required")
+        return value
+
+    def validate_file_size(self, value):
+        if value <= 0:
+            raise ValidationError("file_size must be a positive number of bytes")
+        return value
+
+    def validate_sha256(self, value):
+        # Only given for direct uploads, the file is then sent in one piece
+        value = value.strip().lower()
+        if value and not re.match(r'^[0-9a-f]{64}$', value):
+            raise ValidationError("sha256 must be the hex encoded SHA-256 of the file")
+        return value
+
+class SearchResultSerializer(serializers.ModelSerializer):
+    """Compact search hit: enough to render and link a result, nothing nested"""
+    rank = serializers.FloatField(read_only=True)
+
+class CourseSearchResultSerializer(SearchResultSerializer):
+    class Meta:
+        model = Course
+        fields = ['id', 'title', 'description', 'status', 'rank']
+
+class ModuleSearchResultSerializer(SearchResultSerializer):
+    course_id = serializers.UUIDField(source='course.id', read_only=True)
+    course_title = serializers.CharField(source='course.title', read_only=True)
+
+    class Meta:
+        model = Module
+        fields = ['id', 'title', 'description', 'course_id', 'course_title', 'rank']
+
+class LessonSearchResultSerializer(SearchResultSerializer):
+    module_id = serializers.UUIDField(source='module.id', read_only=True)
+    module_title = serializers.CharField(source='module.title', read_only=True)
+    course_id = serializers.UUIDField(source='module.course.id', read_only=True)
+    course_title = serializers.CharField(source='module.course.title', read_only=True)
+
+    class Meta:
+        model = Lesson
+        fields = ['id', 'title', 'description', 'module_id', 'module_title', 'course_id', 'course_title', 'rank']
@@ -0,0 +1,447 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    BigIntegerField, Case, Count, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from core.exceptions import ValidationError
+from users.models import Organization, User
+from .models import AssessmentStats, Course, CourseEnrollment, FileSubmission, OrganizationStats, CourseStats
+
+COURSE_STATS_ORDERING_FIELDS = [
+    'title', 'status', 'created_at', 'total_enrollments', 'completed_enrollments',
+    'active_enrollments', 'completion_rate'
+]
+
+COURSE_STATUS_FIELDS = {
+    'PUBLISHED': 'published_courses',
+    'DRAFT': 'draft_courses',
+    'ARCHIVED': 'archived_courses',
+}
+
+ENROLLMENT_STATUS_FIELDS = {
+    'ENROLLED': 'enrolled_enrollments',
+    'COMPLETED': 'completed_enrollments',
+    'DROPPED': 'dropped_enrollments',
+}
+
+ORGANIZATION_COUNTERS = [
+    'total_courses', 'published_courses', 'draft_courses', 'archived_courses',
+    'total_enrollments', 'enrolled_enrollments', 'completed_enrollments', 'dropped_enrollments',
+    'total_users', 'active_users', 'submission_files', 'submission_bytes'
+]
+
+COURSE_COUNTERS = ['total_enrollments', 'enrolled_enrollments', 'completed_enrollments', 'dropped_enrollments']
+
+ASSESSMENT_COUNTERS = ['submission_files', 'submission_bytes']
+
+def _count(queryset, group_by, **filters):
+    """Scalar subquery counting the rows of ``queryset`` that match ``filters``"""
+    subquery = queryset.order_by().values(group_by).annotate(
+        count=Count('pk', filter=Q(**filters))
+    ).values('count')
+    return Coalesce(Subquery(subquery, output_field=IntegerField()), Value(0))
+
+def _sum(queryset, group_by, field):
+    """Scalar subquery adding up ``field`` over the rows of ``queryset``"""
+    subquery = queryset.order_by().values(group_by).annotate(total=Sum(field)).values('total')
+    return Coalesce(Subquery(subquery, output_field=BigIntegerField()), Value(0))
+
+def completion_rate(completed, total):
+    if not total:
+        return 0
+    return round((completed / total) * 100, 2)
+
+def aggregate_organization_counters(organization_ids):
+    """
+    Compute the organization counters from the source tables in a single
+    query. Each figure is a conditional count over its own table, so no
+    table is joined to another and counts never multiply.
+    """
+    courses = Course.objects.filter(organization=OuterRef('pk'))
+    enrollments = CourseEnrollment.objects.filter(course__organization=OuterRef('pk'))
+    users = User.objects.filter(organization=OuterRef('pk'))
+    submissions = FileSubmission.objects.filter(assessment__organization=OuterRef('pk'))
+
+    rows = Organization.objects.filter(pk__in=organization_ids).annotate(
+        total_courses=_count(courses, 'organization'),
+        published_courses=_count(courses, 'organization', status='PUBLISHED'),
+        draft_courses=_count(courses, 'organization', status='DRAFT'),
+        archived_courses=_count(courses, 'organization', status='ARCHIVED'),
+        total_enrollments=_count(enrollments, 'course__organization'),
+        enrolled_enrollments=_count(enrollments, 'course__organization', status='ENROLLED'),
+        completed_enrollments=_count(enrollments, 'course__organization', status='COMPLETED'),
+        dropped_enrollments=_count(enrollments, 'course__organization', status='DROPPED'),
+        total_users=_count(users, 'organization'),
+        active_users=_count(users, 'organization', is_active=True),
+        submission_files=_count(submissions, 'assessment__organization'),
+        submission_bytes=_sum(submissions, 'assessment__organization', 'file_size'),
+    ).values('pk', *ORGANIZATION_COUNTERS)
+    return {row.pop('pk'): row for row in rows}
+
+def aggregate_course_counters(course_ids):
+    """Compute the enrollment counters of the given courses in one grouped query"""
+    rows = CourseEnrollment.objects.filter(course_id__in=course_ids).order_by().values('course_id').annotate(
+        total_enrollments=Count('pk'),
+        enrolled_enrollments=Count('pk', filter=Q(status='ENROLLED')),
+        completed_enrollments=Count('pk', filter=Q(status='COMPLETED')),
+        dropped_enrollments=Count('pk', filter=Q(status='DROPPED')),
+    )
+    counters = {course_id: dict.fromkeys(COURSE_COUNTERS, 0) for course_id in course_ids}
+    for row in rows:
+        counters[row.pop('course_id')] = row
+    return counters
+
+def aggregate_assessment_counters(assessment_ids):
+    """Compute the storage counters of the given assessments in one grouped query"""
+    rows = FileSubmission.objects.filter(assessment_id__in=assessment_ids).order_by().values('assessment_id').annotate(
+        submission_files=Count('pk'),
+        submission_bytes=Sum('file_size'),
+    )
+    counters = {assessment_id: dict.fromkeys(ASSESSMENT_COUNTERS, 0) for assessment_id in assessment_ids}
+    for row in rows:
+        counters[row.pop('assessment_id')] = row
+    return counters
+
+def rebuild_organization_stats(organization_ids):
+    """
+    Recompute the counters of the given organizations from the source tables.
+    Returns {organization_id: {counter: (stored, actual)}} for every counter
+    that had drifted.
+    """
+    drift = {}
+    with transaction.atomic():
+        stored = {
+            stats.organization_id: stats
+            for stats in OrganizationStats.objects.select_for_update().filter(organization_id__in=organization_ids)
+        }
+        for organization_id, actual in aggregate_organization_counters(organization_ids).items():
+            stats = stored.get(organization_id)
+            if stats is None:
+                OrganizationStats.objects.create(organization_id=organization_id, **actual)
+                continue
+            changed = {
+                name: (getattr(stats, name), value)
+                for name, value in actual.items()
+                if getattr(stats, name) != value
+            }
+            if changed:
+                drift[organization_id] = changed
+                OrganizationStats.objects.filter(pk=organization_id).update(updated_at=timezone.now(), **actual)
+    return drift
+
+def rebuild_course_stats(course_ids):
+    """Recompute the counters of the given courses, returning the drift like rebuild_organization_stats"""
+    drift = {}
+    with transaction.atomic():
+        stored = {
+            stats.course_id: stats
+            for stats in CourseStats.objects.select_for_update().filter(course_id__in=course_ids)
+        }
+        missing = []
+        for course_id, actual in aggregate_course_counters(course_ids).items():
+            stats = stored.get(course_id)
+            if stats is None:
+                missing.append(CourseStats(course_id=course_id, **actual))
+                continue
+            changed = {
+                name: (getattr(stats, name), value)
+                for name, value in actual.items()
+                if getattr(stats, name) != value
+            }
+            if changed:
+                drift[course_id] = changed
+                CourseStats.objects.filter(pk=course_id).update(updated_at=timezone.now(), **actual)
+        CourseStats.objects.bulk_create(missing, ignore_conflicts=True)
+    return drift
+
+def rebuild_assessment_stats(assessment_ids):
+    """Recompute the counters of the given assessments, returning the drift like rebuild_organization_stats"""
+    drift = {}
+    with transaction.atomic():
+        stored = {
+            stats.assessment_id: stats
+            for stats in AssessmentStats.objects.select_for_update().filter(assessment_id__in=assessment_ids)
+        }
+        missing = []
+        for assessment_id, actual in aggregate_assessment_counters(assessment_ids).items():
+            stats = stored.get(assessment_id)
+            if stats is None:
+                missing.append(AssessmentStats(assessment_id=assessment_id, **actual))
+                continue
+            changed = {
+                name: (getattr(stats, name), value)
+                for name, value in actual.items()
+                if getattr(stats, name) != value
+            }
+            if changed:
+                drift[assessment_id] = changed
+                AssessmentStats.objects.filter(pk=assessment_id).update(updated_at=timezone.now(), **actual)
+        AssessmentStats.objects.bulk_create(missing, ignore_conflicts=True)
+    return drift
+
+def _apply_deltas(model, pk, deltas, rebuild):
+    """
+    Add ``deltas`` to the counters of one stats row with a single atomic
+    UPDATE. A missing row is built from the source tables instead, which
+    already include the change being recorded.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = model.objects.filter(pk=pk).update(
+        updated_at=timezone.now(),
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                rebuild([pk])
+        except IntegrityError:
+            # Another request created the row first; it already counted this change
+            pass
+
+def _enrollment_deltas(old_status, new_status):
+    deltas = {}
+    if old_status is None:
+        deltas['total_enrollments'] = 1
+    if new_status is None:
+        deltas['total_enrollments'] = -1
+    if old_status in ENROLLMENT_STATUS_FIELDS:
+        deltas[ENROLLMENT_STATUS_FIELDS[old_status]] = -1
+    if new_status in ENROLLMENT_STATUS_FIELDS:
+        name = ENROLLMENT_STATUS_FIELDS[new_status]
+        deltas[name] = deltas.get(name, 0) + 1
+    return deltas
+
+def record_enrollment_change(course, old_status, new_status):
+    """
+    Record that an enrollment of ``course`` moved from ``old_status`` to
+    ``new_status``. ``None`` stands for an enrollment that did not exist
+    before or no longer exists. Call inside the transaction that wrote it.
+    """
+    if old_status == new_status:
+        return
+    deltas = _enrollment_deltas(old_status, new_status)
+    _apply_deltas(CourseStats, course.pk, deltas, rebuild_course_stats)
+    _apply_deltas(OrganizationStats, course.organization_id, deltas, rebuild_organization_stats)
+
+def record_course_change(course, old_state, new_state):
+    """
+    Record a course being created, changing status, soft deleted or restored.
+    States are the course status, or ``None`` when the course does not exist
+    or is soft deleted; build them with course_state().
+    """
+    if old_state == new_state:
+        return
+    deltas = {}
+    if old_state is None:
+        deltas['total_courses'] = 1
+    if new_state is None:
+        deltas['total_courses'] = -1
+    if old_state in COURSE_STATUS_FIELDS:
+        deltas[COURSE_STATUS_FIELDS[old_state]] = -1
+    if new_state in COURSE_STATUS_FIELDS:
+        name = COURSE_STATUS_FIELDS[new_state]
+        deltas[name] = deltas.get(name, 0) + 1
+    _apply_deltas(OrganizationStats, course.organization_id, deltas, rebuild_organization_stats)
+
+def course_state(course):
+    # Soft-deleted courses are not counted, matching Course.objects
+    return None if course.deleted_at is not None else course.status
+
+def record_user_change(organization_id, old_active, new_active):
+    """
+    Record a user being created, activated, revoked or deleted. ``None``
+    stands for a user that did not exist before or no longer exists.
+    """
+    if organization_id is None or old_active == new_active:
+        return
+    deltas = {}
+    if old_active is None:
+        deltas['total_users'] = 1
+    if new_active is None:
+        deltas['total_users'] = -1
+    deltas['active_users'] = int(bool(new_active)) - int(bool(old_active))
+    _apply_deltas(OrganizationStats, organization_id, deltas, rebuild_organization_stats)
+
+def get_storage_quota(organization):
+    """Bytes of submitted files ``organization`` may store, or None when unlimited"""
+    quota_mb = organization.storage_quota_mb
+    if quota_mb is None:
+        quota_mb = settings.ORGANIZATION_STORAGE_QUOTA_MB
+    return quota_mb * 1024 * 1024 if quota_mb else None
+
+def get_storage_used(organization_id):
+    """Bytes of submitted files the organization stores, read from the rollup table"""
+    used = OrganizationStats.objects.filter(pk=organization_id).values_list('submission_bytes', flat=True).first()
+    if used is None:
+        rebuild_organization_stats([organization_id])
+        used = OrganizationStats.objects.filter(pk=organization_id).values_list('submission_bytes', flat=True).first()
+    return used or 0
+
+def check_storage_quota(organization, size, quota=None, used=None):
+    """
+    Raise ValidationError when ``size`` more bytes would take
+    ``organization`` over its storage quota. ``quota`` and ``used`` may be
+    passed when already known.
+    """
+    quota = get_storage_quota(organization) if quota is None else quota
+    if quota is None:
+        return
+    used = get_storage_used(organization.pk) if used is None else used
+    if used + size > quota:
+        raise ValidationError(
+            f"This file exceeds the storage quota of {quota // (1024 * 1024)}MB of your organization",
+            details={'quota_bytes': quota, 'used_bytes': used}
+        )
+
+def record_submission_change(assessment, files, size):
+    """
+    Record ``files`` submissions of ``size`` bytes in total being added to,
+    or when negative removed from, ``assessment``. Removals are recorded
+    after their rows are deleted. An addition is recorded before its file is
+    stored: the UPDATE that counts it also checks the organization's quota,
+    so concurrent uploads cannot overshoot it and a file that does not fit
+    is never written. Call inside the transaction that saves the change.
+    """
+    deltas = {'submission_files': files, 'submission_bytes': size}
+    if size <= 0:
+        _apply_deltas(AssessmentStats, assessment.pk, deltas, rebuild_assessment_stats)
+        _apply_deltas(OrganizationStats, assessment.organization_id, deltas, rebuild_organization_stats)
+        return
+
+    organization = assessment.organization
+    quota = get_storage_quota(organization)
+    counted = _reserve_storage(organization.pk, quota, files, size)
+    if not counted and not OrganizationStats.objects.filter(pk=organization.pk).exists():
+        # The submission is not saved yet, so the row built from the source tables does not include it
+        _rebuild_missing(rebuild_organization_stats, organization.pk)
+        counted = _reserve_storage(organization.pk, quota, files, size)
+    if not counted:
+        # Raises unless the usage dropped in between, in which case it is counted below
+        check_storage_quota(organization, size, quota=quota)
+        _apply_deltas(OrganizationStats, organization.pk, deltas, rebuild_organization_stats)
+
+    if not AssessmentStats.objects.filter(pk=assessment.pk).update(
+        updated_at=timezone.now(),
+        submission_files=F('submission_files') + files,
+        submission_bytes=F('submission_bytes') + size
+    ):
+        _rebuild_missing(rebuild_assessment_stats, assessment.pk)
+        _apply_deltas(AssessmentStats, assessment.pk, deltas, rebuild_assessment_stats)
+
+def _reserve_storage(organization_id, quota, files, size):
+    """Count ``size`` more bytes for an organization when they fit ``quota``, returning whether they did"""
+    rows = OrganizationStats.objects.filter(pk=organization_id)
+    if quota is not None:
+        rows = rows.filter(submission_bytes__lte=quota - size)
+    return rows.update(
+        updated_at=timezone.now(),
+        submission_files=F('submission_files') + files,
+        submission_bytes=F('submission_bytes') + size
+    )
+
+def _rebuild_missing(rebuild, pk):
+    try:
+        with transaction.atomic():
+            rebuild([pk])
+    except IntegrityError:
+        # Built by another request meanwhile
+        pass
+
+def get_storage_usage(organization):
+    """Storage used by the submissions of ``organization`` in total and per assessment, read from the rollup tables"""
+    stats = OrganizationStats.objects.filter(organization=organization).first()
+    if stats is None:
+        rebuild_organization_stats([organization.pk])
+        stats = OrganizationStats.objects.get(organization=organization)
+    assessments = AssessmentStats.objects.filter(
+        assessment__organization=organization, submission_files__gt=0
+    ).select_related('assessment').order_by('-submission_bytes', 'assessment_id')
+    quota = get_storage_quota(organization)
+    return {
+        'submission_files': stats.submission_files,
+        'submission_bytes': stats.submission_bytes,
+        'quota_bytes': quota,
+        'available_bytes': max(quota - stats.submission_bytes, 0) if quota is not None else None,
+        'assessments': [
+            {
+                'assessment_id': str(row.assessment_id),
+                'title': row.assessment.title,
+                'deleted': row.assessment.deleted_at is not None,
+                'submission_files': row.submission_files,
+                'submission_bytes': row.submission_bytes,
+            }
+            for row in assessments
+        ]
+    }
+
+def get_overview(organization):
+    """Read the organization overview from the rollup table"""
+    stats = OrganizationStats.objects.filter(organization=organization).first()
+    if stats is None:
+        rebuild_organization_stats([organization.pk])
+        stats = OrganizationStats.objects.get(organization=organization)
+
+    return {
+        'total_courses': stats.total_courses,
+        'published_courses': stats.published_courses,
+        'draft_courses': stats.draft_courses,
+        'total_enrollments': stats.total_enrollments,
+        'completed_enrollments': stats.completed_enrollments,
+        'active_enrollments': stats.enrolled_enrollments,
+        'total_users': stats.total_users,
+        'active_users': stats.active_users,
+        'completion_rate': completion_rate(stats.completed_enrollments, stats.total_enrollments)
+    }
+
+def get_course_stats_queryset(organization, course_ids=None, ordering=None):
+    """
+    Per course enrollment figures read from the course rollup table.
+    ``ordering`` is one of COURSE_STATS_ORDERING_FIELDS, optionally prefixed
+    with '-'.
+    """
+    queryset = Course.objects.filter(organization=organization)
+    if course_ids:
+        queryset = queryset.filter(id__in=course_ids)
+
+    # Courses without a stats row have never had an enrollment
+    queryset = queryset.annotate(
+        total_enrollments=Coalesce(F('stats__total_enrollments'), Value(0)),
+        completed_enrollments=Coalesce(F('stats__completed_enrollments'), Value(0)),
+        active_enrollments=Coalesce(F('stats__enrolled_enrollments'), Value(0)),
+    ).annotate(
+        completion_rate=Case(
+            When(total_enrollments=0, then=Value(0.0)),
+            default=ExpressionWrapper(
+                F('completed_enrollments') * 100.0 / F('total_enrollments'),
+                output_field=FloatField()
+            ),
+            output_field=FloatField()
+        )
+    )
+
+    if ordering and ordering.lstrip('-') in COURSE_STATS_ORDERING_FIELDS:
+        queryset = queryset.order_by(ordering, 'id')
+    else:
+        queryset = queryset.order_by('-created_at', 'id')
+
+    return queryset.values(
+        'id', 'title', 'status', 'total_enrollments', 'completed_enrollments', 'active_enrollments'
+    )
+
+def format_course_stats(rows):
+    return [
+        {
+            'course_id': str(row['id']),
+            'title': row['title'],
+            'status': row['status'],
+            'total_enrollments': row['total_enrollments'],
+            'completed_enrollments': row['completed_enrollments'],
+            'active_enrollments': row['active_enrollments'],
+            'completion_rate': completion_rate(row['completed_enrollments'], row['total_enrollments'])
+        }
+        for row in rows
+    ]
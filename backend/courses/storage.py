@@ -0,0 +1,186 @@
+import base64
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import storages
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from core.downloads import is_object_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+# Signed URLs of the local backend stand in for the presigned URLs of an object store
+SIGNING_SALT = 'courses.storage'
+
+def get_submission_storage():
+    """The storage submitted files live in, configured by STORAGES['submissions']"""
+    return storages['submissions']
+
+def is_direct(storage):
+    """
+    Whether clients move bytes to and from ``storage`` themselves through
+    presigned URLs. True for object stores, the local backend is served by
+    the app.
+    """
+    return is_object_store(storage)
+
+def get_object_key(storage, name):
+    return storage._normalize_name(name)
+
+def get_submission_file(submission):
+    """The storage and name the file of ``submission`` is kept under"""
+    if submission.blob_id:
+        return get_submission_storage(), submission.file_path
+    # Files submitted before the storage backends have a path below media/
+    name = os.path.relpath(submission.file_path, 'media')
+    if name.startswith('..'):
+        return None, None
+    return storages['default'], name
+
+def open_chunks(storage, name):
+    """
+    Open stored file ``name`` and return a generator of its content in
+    blocks. Objects are streamed from the store rather than spooled to a
+    local file first.
+    """
+    if is_direct(storage):
+        body = storage.connection.meta.client.get_object(
+            Bucket=storage.bucket_name, Key=get_object_key(storage, name)
+        )['Body']
+        return _read_blocks(body)
+    return _read_blocks(storage.open(name, 'rb'))
+
+def _read_blocks(file):
+    try:
+        while True:
+            data = file.read(READ_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        file.close()
+
+def list_files(storage, prefix, workers=1):
+    """
+    Yield (name, size, modified timestamp) of every file stored below
+    ``prefix``. Directories are scanned by ``workers`` threads, a few at a
+    time, and object stores are listed a page at a time, so memory does not
+    grow with the number of files.
+    """
+    if is_direct(storage):
+        yield from _list_objects(storage, prefix)
+        return
+    root = storage.path(prefix)
+    if not os.path.isdir(root):
+        return
+    pending = deque([root])
+    running = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-scan') as executor:
+        while pending or running:
+            while pending and len(running) < workers * 2:
+                running.add(executor.submit(_scan_directory, pending.popleft()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                directories, files = future.result()
+                pending.extend(directories)
+                for path, size, modified in files:
+                    yield os.path.relpath(path, storage.location).replace(os.sep, '/'), size, modified
+
+def _scan_directory(path):
+    directories, files = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+    except FileNotFoundError:
+        # Removed while the scan was running
+        pass
+    return directories, files
+
+def _list_objects(storage, prefix):
+    key_prefix = get_object_key(storage, prefix).rstrip('/') + '/'
+    location = get_object_key(storage, '')
+    paginator = storage.connection.meta.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=storage.bucket_name, Prefix=key_prefix):
+        for item in page.get('Contents', []):
+            name = item['Key'][len(location):].lstrip('/') if location else item['Key']
+            yield name, item['Size'], item['LastModified'].timestamp()
+
+def get_staging_name(upload):
+    """Where a direct upload is written to before it is committed"""
+    return f'incoming/{upload.id}'
+
+def get_download_url(request, name, file_name):
+    """A time limited URL the stored file ``name`` is downloaded from as ``file_name``"""
+    storage = get_submission_storage()
+    if is_direct(storage):
+        return storage.url(name, parameters={
+            'ResponseContentDisposition': content_disposition_header(True, file_name)
+        })
+    token = signing.dumps({'name': name, 'file_name': file_name}, salt=SIGNING_SALT)
+    return request.build_absolute_uri(reverse('submission-storage', args=[token]))
+
+def get_upload_url(request, upload):
+    """A time limited URL the whole file of a direct ``upload`` is PUT to"""
+    storage = get_submission_storage()
+    if is_direct(storage):
+        return storage.connection.meta.client.generate_presigned_url('put_object', Params={
+            'Bucket': storage.bucket_name,
+            'Key': get_object_key(storage, get_staging_name(upload)),
+            'ContentLength': upload.file_size,
+            'ChecksumSHA256': encode_checksum(upload.sha256),
+        }, ExpiresIn=settings.SUBMISSION_URL_EXPIRY)
+    token = signing.dumps({'upload': str(upload.id)}, salt=SIGNING_SALT)
+    return request.build_absolute_uri(reverse('submission-storage', args=[token]))
+
+def get_upload_headers(upload):
+    """Headers the client has to send along with the PUT to the upload URL"""
+    if is_direct(get_submission_storage()):
+        # Signed into the URL, the store rejects a body with another checksum
+        return {'x-amz-checksum-sha256': encode_checksum(upload.sha256)}
+    return {}
+
+def load_token(token):
+    """Payload of a URL signed by this module, or None when it is invalid or expired"""
+    try:
+        return signing.loads(token, salt=SIGNING_SALT, max_age=settings.SUBMISSION_URL_EXPIRY)
+    except signing.BadSignature:
+        return None
+
+def encode_checksum(sha256):
+    """Hex SHA-256 in the base64 form object stores use"""
+    return base64.b64encode(bytes.fromhex(sha256)).decode()
+
+def get_verified_checksum(storage, name):
+    """
+    Hex SHA-256 of object ``name`` as verified by the store when it was
+    written, or None when the store did not check it.
+    """
+    if not is_direct(storage):
+        return None
+    head = storage.connection.meta.client.head_object(
+        Bucket=storage.bucket_name,
+        Key=get_object_key(storage, name),
+        ChecksumMode='ENABLED'
+    )
+    checksum = head.get('ChecksumSHA256')
+    # Multipart objects carry a checksum of the part checksums, not of the content
+    if not checksum or '-' in checksum:
+        return None
+    return base64.b64decode(checksum).hex()
+
+def copy_object(storage, source, target):
+    """Copy ``source`` to ``target`` inside the store, no bytes go through the app"""
+    storage.bucket.copy(
+        {'Bucket': storage.bucket_name, 'Key': get_object_key(storage, source)},
+        get_object_key(storage, target)
+    )
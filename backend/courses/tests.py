@@ -1,3 +1,1085 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import os
+import socket
+import tempfile
+import tracemalloc
+import unittest
+import urllib.request
+import zipfile
+import zlib
+from contextlib import contextmanager
+from unittest import mock
+from datetime import timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from core.exceptions import ValidationError
+from core.query_budget import QueryBudgetMixin
+from users.models import Organization, User
+from .models import (
+    Course, Module, Lesson, Tag, CourseEnrollment, Assessment,
+    FileSubmissionAssessment, FileSubmission, SubmissionBlob, SubmissionUpload,
+    OrganizationStats, AssessmentStats, CourseStats
+)
+from .stats import rebuild_assessment_stats, rebuild_organization_stats, record_submission_change
+from .blobs import blob_transaction, get_blob_name, release_blobs, store_uploaded_file
+from .search import build_search_query
+from .processing import DOCX_XML_MAX_BYTES, PDF_INFLATED_MAX_BYTES, read_docx, read_pdf
+from .storage import get_submission_storage
+from .uploads import SubmissionUploadHandler, get_temp_path
 
-# Create your tests here.
+try:
+    # A local stand-in for an S3 compatible object store, from moto[server]
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+
+# Size of the seeded catalog. Large enough that a query per row shows up
+# as a failed budget rather than as noise.
+COURSES = 60
+MODULES_PER_COURSE = 4
+LESSONS_PER_MODULE = 5
+LEARNERS = 30
+ENROLLMENTS_PER_LEARNER = 6
+
+class CourseQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets of every route in courses.urls"""
+    query_budgets = {
+        'course-list': {'GET': 10, 'POST': 12},
+        'course-detail': {'GET': 11, 'PATCH': 16, 'DELETE': 12},
+        'course-restore': {'POST': 20},
+        'course-enroll': {'POST': 27},
+        'course-unenroll': {'POST': 18},
+        'course-complete': {'POST': 26},
+        'course-admin-complete': {'POST': 24},
+        'course-test-soft-delete': {'GET': 13},
+        'course-module-list': {'GET': 5, 'POST': 8},
+        'course-module-detail': {'GET': 5, 'PATCH': 8, 'DELETE': 11},
+        'course-module-restore': {'POST': 11},
+        'module-lesson-list': {'GET': 5, 'POST': 9},
+        'module-lesson-detail': {'GET': 5, 'PATCH': 9, 'DELETE': 12},
+        'module-lesson-restore': {'POST': 10},
+        'course-assessment-list': {'GET': 5, 'POST': 6},
+        'course-assessment-detail': {'GET': 7, 'PATCH': 12, 'DELETE': 7},
+        'course-assessment-submissions': {'GET': 9},
+        'course-assessment-download-submission': {'GET': 8},
+        'course-assessment-export-submissions': {'GET': 7},
+        'course-assessment-submit': {'POST': 19},
+        'course-assessment-delete-submission': {'DELETE': 19},
+        'course-assessment-uploads': {'POST': 12},
+        'course-assessment-upload': {'GET': 8, 'DELETE': 9},
+        'course-assessment-upload-chunk': {'PUT': 9},
+        'course-assessment-upload-commit': {'POST': 25},
+        'submission-storage': {'GET': 0, 'PUT': 5},
+        'enrollment-list': {'GET': 3},
+        'enrollment-detail': {'GET': 3, 'PATCH': 16},
+        'tag-list': {'GET': 3, 'POST': 3},
+        'tag-detail': {'GET': 3, 'PATCH': 4, 'DELETE': 5},
+        'global-search': {'GET': 5},
+        'stats': {'GET': 5},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Budget Academy', domain='budget.test')
+        cls.admin = User.objects.create_user(
+            email='admin@budget.test', organization=cls.organization, is_staff=True, is_approved=True
+        )
+        cls.learners = [
+            User.objects.create_user(email=f'learner{index}@budget.test', organization=cls.organization, is_approved=True)
+            for index in range(LEARNERS)
+        ]
+        cls.learner = cls.learners[0]
+        cls.tags = tags = [Tag.objects.create(name=f'topic-{index}') for index in range(8)]
+
+        cls.courses = Course.objects.bulk_create([
+            Course(
+                organization=cls.organization,
+                title=f'Course {index} on python and data',
+                description=f'Everything about topic {index}',
+                status='PUBLISHED'
+            )
+            for index in range(COURSES)
+        ])
+        for index, course in enumerate(cls.courses):
+            course.tags.set(tags[index % len(tags):][:3])
+
+        modules = Module.objects.bulk_create([
+            Module(course=course, title=f'Module {order}', description='Module description', order=order)
+            for course in cls.courses
+            for order in range(MODULES_PER_COURSE)
+        ])
+        Lesson.objects.bulk_create([
+            Lesson(
+                module=module,
+                title=f'Lesson {order} of python',
+                description='Lesson description',
+                content='Lesson content ' * 20,
+                order=order
+            )
+            for module in modules
+            for order in range(LESSONS_PER_MODULE)
+        ])
+
+        # The first course is much larger than the others, the last one much smaller
+        cls.course = cls.courses[0]
+        cls.small_course = cls.courses[-1]
+        Module.objects.bulk_create([
+            Module(course=cls.course, title=f'Extra module {order}', description='Module description', order=order)
+            for order in range(MODULES_PER_COURSE, 20)
+        ])
+        Module.objects.filter(course=cls.small_course, order__gt=0).delete()
+        cls.module = Module.objects.filter(course=cls.course).order_by('order').first()
+        cls.small_module = Module.objects.get(course=cls.small_course)
+        Lesson.objects.bulk_create([
+            Lesson(module=cls.module, title=f'Extra lesson {order}', description='Lesson description', content='Content', order=order)
+            for order in range(LESSONS_PER_MODULE, 30)
+        ])
+        Lesson.objects.filter(module=cls.small_module, order__gt=0).delete()
+        cls.lesson = Lesson.objects.filter(module=cls.module).order_by('order').first()
+
+        cls.assessments = {}
+        for course in (cls.course, cls.small_course):
+            assessment = Assessment.objects.create(
+                organization=cls.organization,
+                assessable_type='Course',
+                assessable_id=course.id,
+                title=f'Assignment for {course.title}',
+                assessment_type='FILE_SUBMISSION'
+            )
+            FileSubmissionAssessment.objects.create(assessment=assessment, allowed_file_types=['pdf', 'txt'])
+            cls.assessments[course.id] = assessment
+        cls.assessment = cls.assessments[cls.course.id]
+
+        # Every learner is enrolled in the large course and a few others, two of them in the small course
+        CourseEnrollment.objects.bulk_create([
+            CourseEnrollment(user=learner, course=cls.courses[index + offset], status='ENROLLED')
+            for index, learner in enumerate(cls.learners)
+            for offset in range(1, ENROLLMENTS_PER_LEARNER + 1)
+        ] + [
+            CourseEnrollment(user=learner, course=cls.course, status='ENROLLED')
+            for learner in cls.learners
+        ] + [
+            CourseEnrollment(user=learner, course=cls.small_course, status='ENROLLED')
+            for learner in cls.learners[:2]
+        ])
+        cls.enrollment = CourseEnrollment.objects.get(user=cls.learner, course=cls.course)
+
+        FileSubmission.objects.bulk_create([
+            FileSubmission(
+                assessment=cls.assessments[course.id],
+                user=learner,
+                file_name='answer.pdf',
+                file_path=f'media/assessments/{cls.assessments[course.id].id}/answer.pdf',
+                file_size=1024
+            )
+            for course, learners in ((cls.course, cls.learners), (cls.small_course, cls.learners[:2]))
+            for learner in learners
+        ])
+
+        rebuild_organization_stats([cls.organization.pk])
+        rebuild_assessment_stats([assessment.pk for assessment in cls.assessments.values()])
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.admin)
+
+    def module_url(self, name, course=None, **kwargs):
+        return reverse(name, kwargs={'course_id': (course or self.course).id, **kwargs})
+
+    def lesson_url(self, name, module=None, **kwargs):
+        module = module or self.module
+        return reverse(name, kwargs={'course_id': module.course_id, 'module_id': module.id, **kwargs})
+
+    def test_every_route_has_a_budget(self):
+        self.assertRoutesHaveBudgets('courses.urls')
+
+    def test_course_list(self):
+        url = reverse('course-list')
+        self.assertConstantQueries('course-list', 'get', {
+            page_size: f'{url}?page_size={page_size}' for page_size in (5, 20, 50)
+        })
+        self.assertConstantQueries('course-list', 'get', {
+            f'cursor {page_size}': f'{url}?pagination=cursor&page_size={page_size}' for page_size in (5, 20, 50)
+        })
+        self.assertQueryBudget('course-list', 'get', f'{url}?search=python', size='search')
+
+        self.authenticate(self.learner)
+        self.assertConstantQueries('course-list', 'get', {
+            f'learner {page_size}': f'{url}?page_size={page_size}' for page_size in (5, 20, 50)
+        })
+
+        # The summary representation applies to a tab, which ?view= still selects
+        response = self.client.get(f'{url}?view=enrolled&representation=summary&page_size=50')
+        enrolled = CourseEnrollment.objects.filter(user=self.learner, status='ENROLLED').values_list('course_id', flat=True)
+        self.assertEqual({course['id'] for course in response.data['results']}, {str(pk) for pk in enrolled})
+        self.assertTrue(all('modules' not in course for course in response.data['results']))
+
+    def test_course_create(self):
+        self.assertQueryBudget('course-list', 'post', reverse('course-list'), status=201, data={
+            'title': 'A new course',
+            'description': 'Created by the budget tests',
+            'status': 'DRAFT',
+        }, format='json')
+
+    def test_course_detail(self):
+        self.assertConstantQueries('course-detail', 'get', {
+            'small': reverse('course-detail', args=[self.small_course.id]),
+            'large': reverse('course-detail', args=[self.course.id]),
+        })
+        self.assertQueryBudget('course-detail', 'patch', reverse('course-detail', args=[self.course.id]), data={
+            'title': 'Renamed course'
+        }, format='json')
+
+    def test_course_delete_and_restore(self):
+        url = reverse('course-detail', args=[self.course.id])
+        self.assertQueryBudget('course-detail', 'delete', url, status=204)
+        self.assertQueryBudget('course-restore', 'post', reverse('course-restore', args=[self.course.id]))
+
+    def test_course_enrollment_actions(self):
+        course = self.courses[40]
+        self.authenticate(self.learner)
+        self.assertQueryBudget('course-enroll', 'post', reverse('course-enroll', args=[course.id]), status=201)
+        self.assertQueryBudget('course-unenroll', 'post', reverse('course-unenroll', args=[course.id]))
+
+        # The enrollment is locked while it changes, and a repeated request changes and counts nothing
+        response, capture = self.measure('post', reverse('course-unenroll', args=[course.id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(any('FOR UPDATE' in sql for sql, _ in capture.queries), capture.format())
+        stats = CourseStats.objects.get(pk=course.pk)
+        self.assertEqual((stats.enrolled_enrollments, stats.dropped_enrollments), (
+            CourseEnrollment.objects.filter(course=course, status='ENROLLED').count(),
+            CourseEnrollment.objects.filter(course=course, status='DROPPED').count(),
+        ))
+
+    def test_course_complete(self):
+        course = self.courses[1]
+        self.authenticate(self.learner)
+        self.assertQueryBudget('course-complete', 'post', reverse('course-complete', args=[course.id]))
+
+        self.authenticate(self.admin)
+        self.assertQueryBudget(
+            'course-admin-complete', 'post', reverse('course-admin-complete', args=[self.course.id]),
+            data={'user_id': self.learner.id}, format='json'
+        )
+
+    def test_course_test_soft_delete(self):
+        self.assertQueryBudget('course-test-soft-delete', 'get', reverse('course-test-soft-delete'))
+
+    def test_module_list(self):
+        self.assertConstantQueries('course-module-list', 'get', {
+            'small': self.module_url('course-module-list', self.small_course),
+            'large': self.module_url('course-module-list'),
+        })
+
+        self.authenticate(self.learner)
+        self.assertConstantQueries('course-module-list', 'get', {
+            'learner small': self.module_url('course-module-list', self.courses[-5]),
+            'learner large': self.module_url('course-module-list'),
+        })
+
+    def test_module_write(self):
+        self.assertQueryBudget('course-module-list', 'post', self.module_url('course-module-list'), status=201, data={
+            'title': 'A new module',
+            'description': 'Created by the budget tests',
+            'order': 100,
+        }, format='json')
+
+        url = self.module_url('course-module-detail', pk=self.module.id)
+        self.assertQueryBudget('course-module-detail', 'get', url)
+        self.assertQueryBudget('course-module-detail', 'patch', url, data={'title': 'Renamed module'}, format='json')
+        self.assertQueryBudget('course-module-detail', 'delete', url, status=204)
+        self.assertQueryBudget('course-module-restore', 'post', self.module_url('course-module-restore', pk=self.module.id))
+
+    def test_lesson_list(self):
+        self.assertConstantQueries('module-lesson-list', 'get', {
+            'small': self.lesson_url('module-lesson-list', self.small_module),
+            'large': self.lesson_url('module-lesson-list'),
+        })
+
+    def test_lesson_write(self):
+        self.assertQueryBudget('module-lesson-list', 'post', self.lesson_url('module-lesson-list'), status=201, data={
+            'title': 'A new lesson',
+            'description': 'Created by the budget tests',
+            'content': 'Lesson content',
+            'order': 100,
+        }, format='json')
+
+        url = self.lesson_url('module-lesson-detail', pk=self.lesson.id)
+        self.assertQueryBudget('module-lesson-detail', 'get', url)
+        self.assertQueryBudget('module-lesson-detail', 'patch', url, data={'title': 'Renamed lesson'}, format='json')
+        self.assertQueryBudget('module-lesson-detail', 'delete', url, status=204)
+        self.assertQueryBudget('module-lesson-restore', 'post', self.lesson_url('module-lesson-restore', pk=self.lesson.id))
+
+    def test_assessments(self):
+        self.assertConstantQueries('course-assessment-list', 'get', {
+            'small': self.module_url('course-assessment-list', self.small_course),
+            'large': self.module_url('course-assessment-list'),
+        })
+        self.assertQueryBudget('course-assessment-list', 'post', self.module_url('course-assessment-list'), status=201, data={
+            'assessable_type': 'Course',
+            'assessable_id': str(self.course.id),
+            'title': 'A new assignment',
+            'assessment_type': 'FILE_SUBMISSION',
+            'file_submission_data': {'allowed_file_types': ['pdf'], 'max_file_size_mb': 5},
+        }, format='json')
+
+        url = self.module_url('course-assessment-detail', pk=self.assessment.id)
+        self.assertQueryBudget('course-assessment-detail', 'get', url)
+        self.assertQueryBudget('course-assessment-detail', 'patch', url, data={'title': 'Renamed assignment'}, format='json')
+        self.assertQueryBudget('course-assessment-detail', 'delete', url, status=204)
+
+    def test_assessment_submissions(self):
+        self.assertConstantQueries('course-assessment-submissions', 'get', {
+            'small': self.module_url('course-assessment-submissions', self.small_course, pk=self.assessments[self.small_course.id].id),
+            'large': self.module_url('course-assessment-submissions', pk=self.assessment.id),
+        })
+
+        self.authenticate(self.learner)
+        self.assertQueryBudget(
+            'course-assessment-submissions', 'get',
+            self.module_url('course-assessment-submissions', pk=self.assessment.id),
+            size='learner'
+        )
+
+    def test_assessment_submissions_filters_and_cursor(self):
+        url = self.module_url('course-assessment-submissions', pk=self.assessment.id)
+        submissions = FileSubmission.objects.filter(assessment=self.assessment)
+        learner = submissions.values_list('user_id', flat=True).first()
+        FileSubmission.objects.create(
+            assessment=self.assessment, user_id=learner, file_name='old.txt',
+            file_path='media/assessments/old.txt', file_size=1
+        )
+        FileSubmission.objects.filter(file_name='old.txt').update(submitted_at=timezone.now() - timedelta(days=30))
+        self.authenticate(self.admin)
+
+        # Cursor pages walk every submission once, newest first, at the same cost
+        seen, next_url = [], f'{url}?pagination=cursor&page_size=7'
+        while next_url:
+            response = self.assertQueryBudget('course-assessment-submissions', 'get', next_url, size='cursor')
+            seen.extend(row['submitted_at'] for row in response.data['results'])
+            next_url = response.data['next']
+        self.assertEqual(len(seen), submissions.count())
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+        response = self.assertQueryBudget(
+            'course-assessment-submissions', 'get', f'{url}?user={learner}&sort_by=submitted_at', size='user'
+        )
+        self.assertEqual(response.data[0]['file_name'], 'old.txt')
+        self.assertEqual({row['user'] for row in response.data}, {learner})
+
+        response = self.assertQueryBudget('course-assessment-submissions', 'get', f'{url}?latest=true', size='latest')
+        users = [row['user'] for row in response.data]
+        self.assertEqual(len(users), len(set(users)))
+        self.assertNotIn('old.txt', [row['file_name'] for row in response.data])
+
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        response = self.assertQueryBudget(
+            'course-assessment-submissions', 'get', f'{url}?submitted_before={since}', size='range'
+        )
+        self.assertEqual([row['file_name'] for row in response.data], ['old.txt'])
+        self.assertQueryBudget(
+            'course-assessment-submissions', 'get', f'{url}?user=someone', status=400, size='invalid'
+        )
+
+    @contextmanager
+    def media_directory(self):
+        """Run in a temporary working directory, submissions are written below it"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                media_root = os.path.join(directory, 'media')
+                with override_settings(MEDIA_ROOT=media_root), self.submission_storage({
+                    'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                    'OPTIONS': {'location': media_root},
+                }):
+                    yield directory
+            finally:
+                os.chdir(cwd)
+
+    def submission_storage(self, backend):
+        return override_settings(STORAGES={**settings.STORAGES, 'submissions': backend})
+
+    @contextmanager
+    def object_store(self):
+        """Store submissions in a throwaway S3 compatible server"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+        server.start()
+        try:
+            with self.media_directory(), self.submission_storage({
+                'BACKEND': 'storages.backends.s3.S3Storage',
+                'OPTIONS': {
+                    'bucket_name': 'submissions',
+                    'endpoint_url': f'http://127.0.0.1:{port}',
+                    'region_name': 'us-east-1',
+                    'access_key': 'access-key',
+                    'secret_key': 'secret-key',
+                    'signature_version': 's3v4',
+                    'file_overwrite': False,
+                    'addressing_style': 'path',
+                    'default_acl': None,
+                },
+            }):
+                storage = get_submission_storage()
+                storage.connection.meta.client.create_bucket(Bucket='submissions')
+                yield storage
+        finally:
+            server.stop()
+
+    def test_assessment_submit_and_delete(self):
+        self.authenticate(self.learner)
+        with self.media_directory():
+            # Hashed while it is received, the blob store does not read the file again to hash it
+            with mock.patch('courses.blobs.hash_chunks', side_effect=AssertionError('hashed twice')):
+                response = self.assertQueryBudget(
+                    'course-assessment-submit', 'post',
+                    self.module_url('course-assessment-submit', pk=self.assessment.id),
+                    data={'file': SimpleUploadedFile('answer.txt', b'My answer')}, format='multipart'
+                )
+            submission = FileSubmission.objects.get(id=response.data['id'])
+            self.assertEqual(submission.blob_id, hashlib.sha256(b'My answer').hexdigest())
+            # The nested route passes course_id along to the action
+            url = self.module_url('course-assessment-delete-submission', pk=self.assessment.id)
+            self.assertQueryBudget(
+                'course-assessment-delete-submission', 'delete',
+                f"{url}?submission_id={response.data['id']}", status=204
+            )
+            self.assertFalse(FileSubmission.objects.filter(id=response.data['id']).exists())
+
+    def test_oversized_submission_is_rejected_while_receiving(self):
+        submit_url = self.module_url('course-assessment-submit', pk=self.assessment.id)
+        self.assessment.file_submission.max_file_size_mb = 1
+        self.assessment.file_submission.save()
+        self.authenticate(self.learner)
+        with self.media_directory():
+            # Content-Length alone gives it away, no byte of the body is read
+            with mock.patch('django.http.multipartparser.Parser') as parser:
+                response = self.assertQueryBudget(
+                    'course-assessment-submit', 'post', submit_url, status=400, size='too-large',
+                    data={'file': SimpleUploadedFile('answer.txt', b'x' * (2 * 1024 * 1024))}, format='multipart'
+                )
+            parser.assert_not_called()
+            self.assertIn('1MB', str(response.data))
+
+            response = self.assertQueryBudget(
+                'course-assessment-submit', 'post', submit_url, status=400, size='wrong-type',
+                data={'file': SimpleUploadedFile('answer.exe', b'MZ')}, format='multipart'
+            )
+            self.assertIn('Invalid file type', str(response.data))
+            self.assertFalse(FileSubmission.objects.filter(file_name__in=['answer.txt', 'answer.exe']).exists())
+
+        # A body that lies about its length is stopped by the running count
+        handler = SubmissionUploadHandler(self.assessment.file_submission)
+        handler.new_file('file', 'answer.txt', 'text/plain', None)
+        self.assertEqual(handler.receive_data_chunk(b'x' * 1024, 0), b'x' * 1024)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b'x' * 1024, 1024 * 1024)
+        self.assertIsNotNone(handler.error)
+
+    def test_download_submission(self):
+        content = b'My answer to download'
+        with self.media_directory():
+            self.authenticate(self.learner)
+            submission = self.assertQueryBudget(
+                'course-assessment-submit', 'post',
+                self.module_url('course-assessment-submit', pk=self.assessment.id),
+                data={'file': SimpleUploadedFile('answer.txt', content)}, format='multipart'
+            ).data
+            url = self.module_url(
+                'course-assessment-download-submission', pk=self.assessment.id, submission_id=submission['id']
+            )
+
+            response = self.assertQueryBudget('course-assessment-download-submission', 'get', url)
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertIn('attachment; filename="answer.txt"', response['Content-Disposition'])
+
+            response = self.assertQueryBudget(
+                'course-assessment-download-submission', 'get', url, status=206, size='range', HTTP_RANGE='bytes=3-8'
+            )
+            self.assertEqual(b''.join(response.streaming_content), content[3:9])
+            self.assertEqual(response['Content-Range'], f'bytes 3-8/{len(content)}')
+            self.assertQueryBudget(
+                'course-assessment-download-submission', 'get', url, status=416, size='range', HTTP_RANGE='bytes=100-'
+            )
+
+            etag = response['ETag']
+            self.assertQueryBudget(
+                'course-assessment-download-submission', 'get', url, status=304, size='cached', HTTP_IF_NONE_MATCH=etag
+            )
+
+            # nginx sends the bytes when it serves MEDIA_ROOT
+            with override_settings(MEDIA_X_ACCEL_REDIRECT='/protected-media/'):
+                response = self.assertQueryBudget('course-assessment-download-submission', 'get', url, size='nginx')
+                self.assertEqual(response['X-Accel-Redirect'], f"/protected-media/{submission['file_path']}")
+                self.assertEqual(response.content, b'')
+
+            self.authenticate(self.admin)
+            self.assertQueryBudget('course-assessment-download-submission', 'get', url, size='admin')
+
+            # Other learners cannot download it
+            self.authenticate(self.learners[1])
+            self.assertQueryBudget('course-assessment-download-submission', 'get', url, status=404, size='other')
+
+    def test_export_submissions(self):
+        submit_url = self.module_url('course-assessment-submit', pk=self.assessment.id)
+        export_url = self.module_url('course-assessment-export-submissions', pk=self.assessment.id)
+        contents = {
+            (self.learners[0], 'draft.txt'): b'First draft',
+            (self.learners[0], 'final.txt'): b'Final answer',
+            (self.learners[1], 'answer.txt'): b'Only answer',
+        }
+        with self.media_directory():
+            for (learner, file_name), content in contents.items():
+                self.authenticate(learner)
+                self.client.post(submit_url, {'file': SimpleUploadedFile(file_name, content)}, format='multipart')
+            FileSubmission.objects.filter(file_name='draft.txt').update(submitted_at=timezone.now() - timedelta(days=3))
+
+            def export(query='', size=''):
+                response = self.assertQueryBudget(
+                    'course-assessment-export-submissions', 'get', f'{export_url}{query}', size=size
+                )
+                self.assertEqual(response['Content-Type'], 'application/zip')
+                # Rows are read while the archive is sent, without their extracted text
+                with CaptureQueriesContext(connection) as streamed:
+                    archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+                rows = [query['sql'] for query in streamed.captured_queries if 'filesubmission' in query['sql']]
+                self.assertTrue(rows)
+                self.assertFalse(any('extracted_text' in sql for sql in rows))
+                manifest = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode())))
+                files = {
+                    row['file_name']: archive.read(row['archive_path'])
+                    for row in manifest if row['status'] == 'included'
+                }
+                return manifest, files
+
+            self.authenticate(self.admin)
+            manifest, files = export(size='all')
+            self.assertEqual(files, {file_name: content for (_, file_name), content in contents.items()})
+            self.assertTrue(all(row['archive_path'].startswith(f"{row['user_email']}/") for row in manifest))
+
+            _, files = export('?latest=true', size='latest')
+            self.assertEqual(set(files), {'final.txt', 'answer.txt'})
+            since = (timezone.now() - timedelta(days=1)).date().isoformat()
+            _, files = export(f'?submitted_after={since}', size='since')
+            self.assertEqual(set(files), {'final.txt', 'answer.txt'})
+
+            # A file gone from storage is reported instead of failing the export
+            get_submission_storage().delete(FileSubmission.objects.get(file_name='answer.txt').file_path)
+            manifest, files = export(size='missing')
+            self.assertEqual(set(files), {'draft.txt', 'final.txt'})
+            self.assertEqual([row['status'] for row in manifest if row['file_name'] == 'answer.txt'], ['missing'])
+
+            self.assertQueryBudget(
+                'course-assessment-export-submissions', 'get', f'{export_url}?submitted_after=yesterday',
+                status=400, size='invalid'
+            )
+            self.authenticate(self.learner)
+            self.assertQueryBudget('course-assessment-export-submissions', 'get', export_url, status=403, size='learner')
+
+    def test_duplicate_submissions_share_a_blob(self):
+        submit_url = self.module_url('course-assessment-submit', pk=self.assessment.id)
+        delete_url = self.module_url('course-assessment-delete-submission', pk=self.assessment.id)
+        with self.media_directory():
+            submissions = []
+            for learner in self.learners[:2]:
+                self.authenticate(learner)
+                response = self.assertQueryBudget(
+                    'course-assessment-submit', 'post', submit_url,
+                    data={'file': SimpleUploadedFile(f'{learner.id}.txt', b'The class template')}, format='multipart'
+                )
+                submissions.append((learner, response.data))
+
+            blob = SubmissionBlob.objects.get(sha256=hashlib.sha256(b'The class template').hexdigest())
+            self.assertEqual(blob.ref_count, 2)
+            self.assertEqual(submissions[0][1]['file_path'], submissions[1][1]['file_path'])
+
+            for learner, submission in submissions:
+                self.authenticate(learner)
+                # The file of the last reference is deleted once the deletion commits
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertQueryBudget(
+                        'course-assessment-delete-submission', 'delete',
+                        f"{delete_url}?submission_id={submission['id']}", status=204
+                    )
+                self.assertEqual(
+                    get_submission_storage().exists(submission['file_path']), learner != submissions[-1][0]
+                )
+            self.assertFalse(SubmissionBlob.objects.filter(pk=blob.pk).exists())
+
+    def test_decompression_bombs_are_bounded(self):
+        inflated = 200 * 1024 * 1024
+        compressor = zlib.compressobj(9)
+        stream = b''.join(compressor.compress(bytes(1024 * 1024)) for _ in range(inflated // (1024 * 1024)))
+        stream += compressor.flush()
+        with self.media_directory():
+            storage = get_submission_storage()
+            pdf = b'%PDF-1.4\n4 0 obj << /Filter /FlateDecode >> stream\n' + stream + b'\nendstream endobj\n%%EOF'
+            storage.save('bomb.pdf', ContentFile(pdf))
+            docx = io.BytesIO()
+            with zipfile.ZipFile(docx, 'w', zipfile.ZIP_DEFLATED) as archive:
+                with archive.open('word/document.xml', 'w', force_zip64=True) as entry:
+                    entry.write(b'<w:p>Hello</w:p>')
+                    for _ in range(inflated // (1024 * 1024)):
+                        entry.write(bytes(1024 * 1024))
+            storage.save('bomb.docx', ContentFile(docx.getvalue()))
+
+            for name, read, limit in (('bomb.pdf', read_pdf, PDF_INFLATED_MAX_BYTES), ('bomb.docx', read_docx, DOCX_XML_MAX_BYTES)):
+                with self.subTest(name):
+                    tracemalloc.start()
+                    try:
+                        result = read(storage, name)
+                        _, peak = tracemalloc.get_traced_memory()
+                    finally:
+                        tracemalloc.stop()
+                    self.assertLessEqual(len(result), limit)
+                    self.assertLess(peak, 4 * limit)
+            self.assertTrue(read_docx(storage, 'bomb.docx').startswith('Hello'))
+
+    def test_blob_files_follow_the_transaction(self):
+        with self.media_directory():
+            storage = get_submission_storage()
+            # A blob written by a transaction that rolls back is removed again
+            with self.assertRaises(RuntimeError), blob_transaction():
+                blob_id = store_uploaded_file(SimpleUploadedFile('draft.txt', b'Rolled back'))
+                self.assertTrue(storage.exists(get_blob_name(blob_id)))
+                raise RuntimeError
+            self.assertFalse(storage.exists(get_blob_name(blob_id)))
+            self.assertFalse(SubmissionBlob.objects.filter(pk=blob_id).exists())
+
+            with blob_transaction():
+                blob_id = store_uploaded_file(SimpleUploadedFile('final.txt', b'Kept'))
+            # A release that rolls back leaves the file in place
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    release_blobs([blob_id])
+                    raise RuntimeError
+            self.assertTrue(storage.exists(get_blob_name(blob_id)))
+            self.assertEqual(SubmissionBlob.objects.get(pk=blob_id).ref_count, 1)
+
+            # and the file goes once the release commits
+            with self.captureOnCommitCallbacks(execute=True):
+                release_blobs([blob_id])
+                self.assertTrue(storage.exists(get_blob_name(blob_id)))
+            self.assertFalse(storage.exists(get_blob_name(blob_id)))
+            self.assertFalse(SubmissionBlob.objects.filter(pk=blob_id).exists())
+
+    @override_settings(SUBMISSION_PROCESSING_WORKERS=0)
+    def test_submissions_are_processed_after_commit(self):
+        submit_url = self.module_url('course-assessment-submit', pk=self.assessment.id)
+        self.assessment.file_submission.allowed_file_types = ['pdf', 'txt', 'png']
+        self.assessment.file_submission.save()
+        image = io.BytesIO()
+        Image.new('RGB', (640, 480), 'navy').save(image, format='PNG')
+        pdf = (
+            b'%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n'
+            b'2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n'
+            b'3 0 obj << /Type /Page /Parent 2 0 R /Contents 4 0 R >> endobj\n'
+        )
+        stream = zlib.compress(b'BT /F1 12 Tf (Hello \\(PDF\\)) Tj T* [(Second) -250 ( line)] TJ ET')
+        pdf += b'4 0 obj << /Filter /FlateDecode >>\nstream\n' + stream + b'\nendstream\nendobj\n%%EOF\n'
+
+        def submit(file_name, content):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    submit_url, {'file': SimpleUploadedFile(file_name, content)}, format='multipart'
+                )
+            self.assertEqual(response.status_code, 200)
+            # The request does not wait for processing
+            self.assertEqual(response.data['processing_status'], 'PENDING')
+            return FileSubmission.objects.get(pk=response.data['id'])
+
+        self.authenticate(self.learner)
+        with self.media_directory():
+            submission = submit('answer.txt', 'Searchable answer, café'.encode())
+            self.assertEqual(submission.processing_status, 'DONE')
+            self.assertEqual(submission.detected_type, 'text/plain')
+            self.assertEqual(submission.extracted_text, 'Searchable answer, café')
+            self.assertIsNotNone(submission.processed_at)
+
+            submission = submit('answer.pdf', pdf)
+            self.assertEqual(submission.processing_status, 'DONE')
+            self.assertEqual(submission.page_count, 1)
+            self.assertEqual(submission.extracted_text, 'Hello (PDF)\nSecond line')
+
+            submission = submit('diagram.png', image.getvalue())
+            self.assertEqual(submission.processing_status, 'DONE')
+            self.assertEqual(submission.detected_type, 'image/png')
+            with get_submission_storage().open(submission.preview_path) as preview, Image.open(preview) as thumbnail:
+                self.assertEqual(thumbnail.size, (320, 240))
+            response = self.client.get(self.module_url('course-assessment-submissions', pk=self.assessment.id))
+            self.assertTrue(any(row['preview_url'] for row in response.data))
+
+            # The extension check passes, the content says otherwise
+            submission = submit('report.pdf', b'Just some text')
+            self.assertEqual(submission.processing_status, 'MISMATCH')
+            self.assertEqual(submission.detected_type, '')
+            self.assertIn('text/plain', submission.processing_error)
+
+            # Identical content is taken from the submission processed before
+            submission = submit('copy.pdf', pdf)
+            self.assertEqual((submission.processing_status, submission.page_count), ('DONE', 1))
+
+            get_submission_storage().delete(FileSubmission.objects.get(file_name='answer.txt').file_path)
+            FileSubmission.objects.filter(file_name='answer.txt').update(processing_status='PENDING')
+            call_command('process_submissions', stdout=io.StringIO())
+            self.assertEqual(FileSubmission.objects.get(file_name='answer.txt').processing_status, 'FAILED')
+
+    def test_clean_media(self):
+        submit_url = self.module_url('course-assessment-submit', pk=self.assessment.id)
+        self.authenticate(self.learner)
+        with self.media_directory():
+            storage = get_submission_storage()
+            for file_name in ('kept.txt', 'corrupted.txt', 'dropped.txt'):
+                self.client.post(submit_url, {'file': SimpleUploadedFile(file_name, file_name.encode())}, format='multipart')
+            kept, corrupted, dropped = (FileSubmission.objects.get(file_name=name) for name in ('kept.txt', 'corrupted.txt', 'dropped.txt'))
+            storage.save(f'assessments/{self.assessment.id}/orphan.txt', ContentFile(b'Nobody refers to this'))
+            storage.save(get_blob_name('f' * 64), ContentFile(b'Nor to this'))
+            with storage.open(corrupted.file_path, 'wb') as file:
+                file.write(b'Changed on disk')
+            # Removed in bulk, the blob keeps counting the submission
+            FileSubmission.objects.filter(pk=dropped.pk).delete()
+            # The seeded submissions predate the blob store and have no file
+            missing = FileSubmission.objects.filter(blob__isnull=True).count()
+            # Abandoned uploads are removed once they expire
+            uploads_url = self.module_url('course-assessment-uploads', pk=self.assessment.id)
+            expired, active = (
+                SubmissionUpload.objects.get(pk=self.client.post(uploads_url, {'file_name': name, 'file_size': 1024}, format='json').data['id'])
+                for name in ('abandoned.txt', 'active.txt')
+            )
+            SubmissionUpload.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+            self.assertTrue(get_temp_path(expired).startswith(str(settings.MEDIA_ROOT)))
+
+            def clean(*args):
+                output = io.StringIO()
+                call_command('clean_media', '--min-age-minutes=0', '--workers=2', *args, stdout=output)
+                return output.getvalue()
+
+            output = clean('--dry-run', '--verify-checksums')
+            self.assertIn('Orphaned files: 2 (32', output)
+            self.assertIn('Corrupt files: 1', output)
+            self.assertIn(f'Missing files: {missing} ', output)
+            self.assertIn(f'Blob {dropped.blob_id} has 1 references, 0 in use', output)
+            self.assertIn('Expired uploads: 1', output)
+            self.assertTrue(storage.exists(dropped.file_path))
+            self.assertTrue(os.path.exists(get_temp_path(expired)))
+            self.assertTrue(storage.exists(f'assessments/{self.assessment.id}/orphan.txt'))
+
+            output = clean()
+            self.assertIn('Deleted 2 orphaned files', output)
+            self.assertFalse(SubmissionUpload.objects.filter(pk=expired.pk).exists())
+            self.assertFalse(os.path.exists(get_temp_path(expired)))
+            self.assertTrue(os.path.exists(get_temp_path(active)))
+            self.assertTrue(SubmissionUpload.objects.filter(pk=active.pk).exists())
+            self.assertFalse(storage.exists(f'assessments/{self.assessment.id}/orphan.txt'))
+            self.assertFalse(storage.exists(get_blob_name('f' * 64)))
+            self.assertFalse(storage.exists(dropped.file_path))
+            self.assertFalse(SubmissionBlob.objects.filter(pk=dropped.blob_id).exists())
+            self.assertTrue(storage.exists(kept.file_path))
+            self.assertIn('Orphaned files: 0', clean('--dry-run'))
+
+            # Submissions of an assessment deleted long enough ago go with their files
+            Assessment.all_objects.filter(pk=self.assessment.pk).update(deleted_at=timezone.now() - timedelta(days=40))
+            clean('--purge-deleted-days=30')
+            self.assertFalse(FileSubmission.objects.filter(assessment=self.assessment).exists())
+            self.assertFalse(storage.exists(kept.file_path))
+
+    @override_settings(SUBMISSION_UPLOAD_CHUNK_SIZE=4)
+    def test_resumable_upload(self):
+        content = b'My resumable answer'
+        chunks = [content[start:start + 4] for start in range(0, len(content), 4)]
+        self.authenticate(self.learner)
+        with self.media_directory():
+            response = self.assertQueryBudget(
+                'course-assessment-uploads', 'post',
+                self.module_url('course-assessment-uploads', pk=self.assessment.id), status=201,
+                data={'file_name': 'answer.txt', 'file_size': len(content)}, format='json'
+            )
+            upload_id = response.data['id']
+            self.assertEqual(response.data['total_chunks'], len(chunks))
+
+            def put_chunk(index, data, status=200, checksum=None):
+                url = self.module_url('course-assessment-upload-chunk', pk=self.assessment.id, upload_id=upload_id, index=index)
+                return self.assertQueryBudget(
+                    'course-assessment-upload-chunk', 'put', url, status=status, data=data,
+                    content_type='application/octet-stream',
+                    HTTP_X_CHUNK_CHECKSUM=checksum or hashlib.sha256(data).hexdigest()
+                )
+
+            # Chunks arrive in any order, a corrupted one is rejected and sent again
+            for index in reversed(range(1, len(chunks))):
+                put_chunk(index, chunks[index])
+            # A failed retry of a received chunk leaves it as it was
+            put_chunk(1, b'XXXX', status=400, checksum=hashlib.sha256(chunks[1]).hexdigest())
+            put_chunk(0, chunks[0], status=400, checksum=hashlib.sha256(b'other').hexdigest())
+            put_chunk(0, chunks[0][:2], status=400)
+
+            url = self.module_url('course-assessment-upload', pk=self.assessment.id, upload_id=upload_id)
+            response = self.assertQueryBudget('course-assessment-upload', 'get', url)
+            self.assertEqual(response.data['received_chunks'], list(range(1, len(chunks))))
+
+            commit_url = self.module_url('course-assessment-upload-commit', pk=self.assessment.id, upload_id=upload_id)
+            self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url, status=400)
+            put_chunk(0, chunks[0])
+            response = self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url)
+            with get_submission_storage().open(response.data['file_path']) as submitted:
+                self.assertEqual(submitted.read(), content)
+
+            # A retried commit returns the same submission
+            retry = self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url)
+            self.assertEqual(retry.data['id'], response.data['id'])
+
+            response = self.assertQueryBudget(
+                'course-assessment-uploads', 'post',
+                self.module_url('course-assessment-uploads', pk=self.assessment.id), status=201,
+                data={'file_name': 'draft.pdf', 'file_size': 10}, format='json'
+            )
+            url = self.module_url('course-assessment-upload', pk=self.assessment.id, upload_id=response.data['id'])
+            self.assertQueryBudget('course-assessment-upload', 'delete', url, status=204)
+
+    def start_direct_upload(self, content, sha256=None):
+        response = self.assertQueryBudget(
+            'course-assessment-uploads', 'post',
+            self.module_url('course-assessment-uploads', pk=self.assessment.id), status=201,
+            data={
+                'file_name': 'answer.txt',
+                'file_size': len(content),
+                'sha256': sha256 or hashlib.sha256(content).hexdigest(),
+            }, format='json'
+        )
+        self.assertEqual(response.data['method'], 'DIRECT')
+        return response.data
+
+    def test_direct_upload(self):
+        content = b'My direct answer'
+        self.authenticate(self.learner)
+        with self.media_directory():
+            upload = self.start_direct_upload(content)
+            self.assertEqual(upload['total_chunks'], 1)
+
+            # Direct uploads are not sent in chunks
+            url = self.module_url('course-assessment-upload-chunk', pk=self.assessment.id, upload_id=upload['id'], index=0)
+            self.assertQueryBudget(
+                'course-assessment-upload-chunk', 'put', url, status=400, data=content,
+                content_type='application/octet-stream', HTTP_X_CHUNK_CHECKSUM=hashlib.sha256(content).hexdigest()
+            )
+
+            # The signed URL takes the whole file without credentials
+            self.authenticate(None)
+            self.assertQueryBudget(
+                'submission-storage', 'put', upload['upload_url'], status=400,
+                data=b'Not my answer!!!', content_type='application/octet-stream'
+            )
+            self.assertQueryBudget(
+                'submission-storage', 'put', upload['upload_url'],
+                data=content, content_type='application/octet-stream'
+            )
+            # The last character of the signature changed, whatever it was
+            tampered = upload['upload_url'][:-2] + ('1' if upload['upload_url'][-2] == '0' else '0') + '/'
+            self.assertQueryBudget('submission-storage', 'put', tampered, status=403)
+
+            self.authenticate(self.learner)
+            commit_url = self.module_url('course-assessment-upload-commit', pk=self.assessment.id, upload_id=upload['id'])
+            submission = self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url).data
+
+            self.authenticate(None)
+            response = self.assertQueryBudget('submission-storage', 'get', submission['file_url'])
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertIn('attachment; filename="answer.txt"', response['Content-Disposition'])
+
+    @unittest.skipIf(ThreadedMotoServer is None, "moto[server] is not installed")
+    def test_direct_upload_to_object_store(self):
+        content = b'My answer, sent straight to the object store'
+        self.authenticate(self.learner)
+        with self.object_store() as storage:
+            upload = self.start_direct_upload(content)
+            self.assertTrue(upload['upload_url'].startswith(storage.endpoint_url))
+
+            def put(url, data, headers):
+                headers = {'Content-Type': 'application/octet-stream', **headers}
+                request = urllib.request.Request(url, data=data, method='PUT', headers=headers)
+                with urllib.request.urlopen(request) as response:
+                    return response.status
+
+            self.assertEqual(put(upload['upload_url'], content, upload['upload_headers']), 200)
+            commit_url = self.module_url('course-assessment-upload-commit', pk=self.assessment.id, upload_id=upload['id'])
+            with self.captureOnCommitCallbacks(execute=True):
+                submission = self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url).data
+            self.assertTrue(storage.exists(submission['file_path']))
+            self.assertFalse(storage.exists(f"incoming/{upload['id']}"))
+            with urllib.request.urlopen(submission['file_url']) as response:
+                self.assertEqual(response.read(), content)
+
+            # A file that does not match its declared checksum is not stored
+            upload = self.start_direct_upload(content, sha256=hashlib.sha256(b'other').hexdigest())
+            put(upload['upload_url'], content, {})
+            commit_url = self.module_url('course-assessment-upload-commit', pk=self.assessment.id, upload_id=upload['id'])
+            self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url, status=400)
+            self.assertFalse(storage.exists(f"incoming/{upload['id']}"))
+
+    def test_resumable_upload_is_validated_up_front(self):
+        self.authenticate(self.learner)
+        url = self.module_url('course-assessment-uploads', pk=self.assessment.id)
+        for data in (
+            {'file_name': 'answer.exe', 'file_size': 10},
+            {'file_name': 'answer.pdf', 'file_size': 11 * 1024 * 1024},
+        ):
+            self.assertQueryBudget('course-assessment-uploads', 'post', url, status=400, data=data, format='json')
+
+    def test_storage_accounting_and_quota(self):
+        submit_url = self.module_url('course-assessment-submit', pk=self.assessment.id)
+        delete_url = self.module_url('course-assessment-delete-submission', pk=self.assessment.id)
+        used = OrganizationStats.objects.get(pk=self.organization.pk).submission_bytes
+        self.assertEqual(used, (LEARNERS + 2) * 1024)
+
+        self.authenticate(self.learner)
+        with self.media_directory():
+            response = self.assertQueryBudget(
+                'course-assessment-submit', 'post', submit_url,
+                data={'file': SimpleUploadedFile('answer.txt', b'My answer')}, format='multipart'
+            )
+            organization_stats = OrganizationStats.objects.get(pk=self.organization.pk)
+            self.assertEqual((organization_stats.submission_files, organization_stats.submission_bytes), (LEARNERS + 3, used + 9))
+            assessment_stats = AssessmentStats.objects.get(pk=self.assessment.pk)
+            self.assertEqual((assessment_stats.submission_files, assessment_stats.submission_bytes), (LEARNERS + 1, LEARNERS * 1024 + 9))
+
+            self.assertQueryBudget(
+                'course-assessment-delete-submission', 'delete',
+                f"{delete_url}?submission_id={response.data['id']}", status=204
+            )
+            self.assertEqual(OrganizationStats.objects.get(pk=self.organization.pk).submission_bytes, used)
+            self.assertEqual(AssessmentStats.objects.get(pk=self.assessment.pk).submission_bytes, LEARNERS * 1024)
+
+            # A file that would take the organization over its quota is stopped while it is received
+            self.organization.storage_quota_mb = 1
+            self.organization.save()
+            response = self.assertQueryBudget(
+                'course-assessment-submit', 'post', submit_url, status=400, size='over-quota',
+                data={'file': SimpleUploadedFile('big.txt', b'x' * (1024 * 1024 - used + 1))}, format='multipart'
+            )
+            self.assertIn('storage quota', str(response.data))
+            self.assertFalse(FileSubmission.objects.filter(file_name='big.txt').exists())
+            self.assertQueryBudget(
+                'course-assessment-uploads', 'post', self.module_url('course-assessment-uploads', pk=self.assessment.id),
+                status=400, size='over-quota', data={'file_name': 'big.pdf', 'file_size': 1024 * 1024}, format='json'
+            )
+
+            # An upload that stopped fitting while it was sent is refused at commit, before its file is
+            # stored, and can be committed again once there is room
+            content = b'Late answer'
+            upload = self.client.post(
+                self.module_url('course-assessment-uploads', pk=self.assessment.id),
+                {'file_name': 'late.txt', 'file_size': len(content)}, format='json'
+            ).data
+            self.client.put(
+                self.module_url('course-assessment-upload-chunk', pk=self.assessment.id, upload_id=upload['id'], index=0),
+                data=content, content_type='application/octet-stream',
+                HTTP_X_CHUNK_CHECKSUM=hashlib.sha256(content).hexdigest()
+            )
+            OrganizationStats.objects.filter(pk=self.organization.pk).update(submission_bytes=1024 * 1024 - 5)
+            commit_url = self.module_url('course-assessment-upload-commit', pk=self.assessment.id, upload_id=upload['id'])
+            blob_name = get_blob_name(hashlib.sha256(content).hexdigest())
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.assertQueryBudget('course-assessment-upload-commit', 'post', commit_url, status=400, size='over-quota')
+                self.assertIn('storage quota', str(response.data))
+                self.assertFalse(get_submission_storage().exists(blob_name))
+                pending = SubmissionUpload.objects.get(pk=upload['id'])
+                self.assertEqual(pending.status, 'PENDING')
+                self.assertTrue(os.path.exists(get_temp_path(pending)))
+            OrganizationStats.objects.filter(pk=self.organization.pk).update(submission_bytes=used)
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(commit_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(os.path.exists(get_temp_path(pending)))
+            with get_submission_storage().open(blob_name) as submitted:
+                self.assertEqual(submitted.read(), content)
+            self.client.delete(f"{delete_url}?submission_id={response.data['id']}")
+
+        # Counting a submission checks the quota again, so concurrent uploads cannot overshoot it
+        with self.assertRaises(ValidationError):
+            record_submission_change(self.assessment, 1, 1024 * 1024 - used + 1)
+        record_submission_change(self.assessment, 1, 1024 * 1024 - used)
+        self.assertEqual(OrganizationStats.objects.get(pk=self.organization.pk).submission_bytes, 1024 * 1024)
+
+        # The rebuild puts the counters back in line with the submissions
+        out = io.StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertIn(f'Assessment {self.assessment.pk} drifted', out.getvalue())
+        self.assertEqual(OrganizationStats.objects.get(pk=self.organization.pk).submission_bytes, used)
+
+    def test_enrollments(self):
+        url = reverse('enrollment-list')
+        self.assertConstantQueries('enrollment-list', 'get', {
+            page_size: f'{url}?page_size={page_size}' for page_size in (5, 20, 50)
+        })
+
+        url = reverse('enrollment-detail', args=[self.enrollment.id])
+        self.assertQueryBudget('enrollment-detail', 'get', url)
+        self.assertQueryBudget('enrollment-detail', 'patch', url, data={'status': 'DROPPED'}, format='json')
+
+    def test_enrollment_permission_follows_the_course(self):
+        # Enrollments have no organization of their own, they are checked through their course
+        other = Organization.objects.create(name='Other Academy', domain='other.test')
+        outsider = User.objects.create_user(email='learner@other.test', organization=other, is_approved=True)
+        course = Course.objects.create(organization=other, title='Elsewhere', description='', status='PUBLISHED')
+        enrollment = CourseEnrollment.objects.create(user=outsider, course=course, status='ENROLLED')
+
+        self.assertEqual(self.client.get(reverse('enrollment-detail', args=[enrollment.id])).status_code, 403)
+        self.authenticate(self.learner)
+        self.assertEqual(self.client.get(reverse('enrollment-detail', args=[self.enrollment.id])).status_code, 200)
+        self.authenticate(outsider)
+        self.assertEqual(self.client.get(reverse('enrollment-detail', args=[enrollment.id])).status_code, 200)
+
+    def test_tags(self):
+        self.assertQueryBudget('tag-list', 'get', reverse('tag-list'))
+        self.assertQueryBudget('tag-list', 'post', reverse('tag-list'), status=201, data={'name': 'new-topic'}, format='json')
+
+        # Only tags used by the organization's courses can be read and changed
+        url = reverse('tag-detail', args=[self.tags[0].id])
+        self.assertQueryBudget('tag-detail', 'get', url)
+        self.assertQueryBudget('tag-detail', 'patch', url, data={'description': 'Renamed'}, format='json')
+        self.assertQueryBudget('tag-detail', 'delete', url, status=204)
+
+    def test_search(self):
+        url = reverse('global-search')
+        self.assertConstantQueries('global-search', 'get', {
+            limit: f'{url}?q=python&limit={limit}' for limit in (5, 20, 50)
+        })
+
+        # Cursors walk every match of a type, best first and each once
+        expected = list(
+            Course.objects.filter(organization=self.organization, search_vector=build_search_query('python'))
+            .values_list('id', flat=True)
+        )
+        found, query = [], f'{url}?q=python&type=courses&limit=5'
+        while query:
+            response = self.assertQueryBudget('global-search', 'get', query, size='cursor')
+            found += [course['id'] for course in response.data['courses']]
+            ranks = [course['rank'] for course in response.data['courses']]
+            self.assertEqual(ranks, sorted(ranks, reverse=True))
+            cursor = response.data['pagination']['courses']['next_cursor']
+            query = cursor and f'{url}?q=python&type=courses&limit=5&cursor={cursor}'
+        self.assertEqual(sorted(found), sorted(str(pk) for pk in expected))
+        self.assertGreater(len(expected), 5)
+
+        self.assertQueryBudget('global-search', 'get', f'{url}?q=python&type=courses&cursor=x', status=400, size='invalid')
+
+    def test_stats(self):
+        url = reverse('stats')
+        self.assertConstantQueries('stats', 'get', {
+            page_size: f'{url}?page_size={page_size}' for page_size in (5, 20, 50)
+        })
@@ -0,0 +1,336 @@
+import hashlib
+import os
+import re
+import tempfile
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db import transaction
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.datastructures import MultiValueDict
+from core.exceptions import ValidationError, NotFoundError
+from .blobs import blob_transaction, get_blob_name, hash_chunks, store_local_file, store_staged_object
+from .processing import schedule_processing
+from .stats import check_storage_quota, get_storage_quota, get_storage_used, record_submission_change
+from .storage import get_submission_storage, is_direct, get_staging_name, get_verified_checksum
+from .models import FileSubmission, SubmissionUpload, SubmissionUploadChunk
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Request bodies are streamed to disk in pieces of this size
+READ_SIZE = 64 * 1024
+
+CHECKSUM_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Room for the boundaries and part headers around a file in a multipart body
+MULTIPART_OVERHEAD = 64 * 1024
+
+def validate_submission_file(file_submission, file_name, file_size):
+    """Check a file's type and size against the assessment before any byte of it is stored"""
+    validate_file_type(file_submission, file_name)
+    validate_file_size(file_submission, file_size)
+
+def validate_file_type(file_submission, file_name):
+    file_extension = file_name.split('.')[-1].lower()
+    if file_extension not in file_submission.allowed_file_types:
+        raise ValidationError(f"Invalid file type. Allowed types: {', '.join(file_submission.allowed_file_types)}")
+
+def validate_file_size(file_submission, file_size):
+    max_size_bytes = file_submission.max_file_size_mb * 1024 * 1024
+    if file_size > max_size_bytes:
+        raise ValidationError(f"File size exceeds the maximum limit of {file_submission.max_file_size_mb}MB")
+
+class SubmissionUploadHandler(FileUploadHandler):
+    """
+    Enforces the limits of a FileSubmissionAssessment while a multipart body
+    is parsed, ahead of the handlers that spool files to memory or disk. A
+    body whose Content-Length is already too large is not read at all, and
+    reading stops at the first file whose name or running size breaks a
+    limit. The reason is kept in ``error`` for the view to raise, since the
+    parser swallows StopUpload. With an ``organization`` its storage quota
+    is enforced the same way as the size limit. Files are hashed as they are
+    received, their SHA-256 is kept in ``checksums`` by field name so the
+    blob store does not read them again.
+    """
+    def __init__(self, file_submission, request=None, organization=None):
+        super().__init__(request)
+        self.file_submission = file_submission
+        self.organization = organization
+        self.quota = get_storage_quota(organization) if organization else None
+        self.used = get_storage_used(organization.pk) if self.quota is not None else None
+        self.error = None
+        self.checksums = {}
+        self.digest = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        try:
+            self._validate_size(self.file_submission, content_length - MULTIPART_OVERHEAD)
+        except ValidationError as e:
+            self.error = e
+            # Handled as an empty form, the body is never read
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self._check(validate_file_type, file_name)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        # Content-Length may be missing or wrong, the bytes actually received are what counts
+        self._check(self._validate_size, start + len(raw_data))
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.checksums[self.field_name] = self.digest.hexdigest()
+        return None
+
+    def _validate_size(self, file_submission, size):
+        validate_file_size(file_submission, size)
+        if self.quota is not None:
+            check_storage_quota(self.organization, size, quota=self.quota, used=self.used)
+
+    def _check(self, validate, value):
+        try:
+            validate(self.file_submission, value)
+        except ValidationError as e:
+            self.error = e
+            # The rest of the body is left unread and the connection closed
+            raise StopUpload(connection_reset=True)
+
+def get_upload_dir():
+    """Directory of the partially received uploads, one sparse file per upload"""
+    return os.path.join(settings.MEDIA_ROOT, 'uploads')
+
+def get_temp_path(upload):
+    return os.path.join(get_upload_dir(), f'{upload.id}.part')
+
+def _check_pending(upload):
+    if upload.status != 'PENDING':
+        raise ValidationError("This upload has already been committed")
+    if upload.expires_at <= timezone.now():
+        raise ValidationError("This upload has expired, please start a new one")
+
+def create_upload(assessment, file_submission, user, file_name, file_size, sha256=''):
+    """
+    Start a resumable upload. The file's type and size are validated against
+    the assessment and the organization's storage quota here, so nothing is
+    transferred for a file that would be rejected. The temporary file is allocated at its full size so chunks can
+    be written in place, in any order and in parallel.
+
+    With the ``sha256`` of the file the upload is direct: the whole file is
+    PUT to a presigned URL, straight into an object store when one is
+    configured, and nothing is allocated here.
+    """
+    validate_submission_file(file_submission, file_name, file_size)
+    check_storage_quota(assessment.organization, file_size)
+
+    method = 'DIRECT' if sha256 else 'CHUNKED'
+    upload = SubmissionUpload.objects.create(
+        assessment=assessment,
+        user=user,
+        file_name=file_name,
+        file_size=file_size,
+        # The local backend receives a direct upload as a single chunk
+        chunk_size=file_size if sha256 else settings.SUBMISSION_UPLOAD_CHUNK_SIZE,
+        method=method,
+        sha256=sha256,
+        expires_at=timezone.now() + settings.SUBMISSION_UPLOAD_EXPIRY
+    )
+    if not is_received_by_storage(upload):
+        os.makedirs(get_upload_dir(), exist_ok=True)
+        with open(get_temp_path(upload), 'wb') as temp_file:
+            temp_file.truncate(file_size)
+    logger.info(f"Started {method.lower()} upload {upload.id} of {file_name} ({file_size} bytes in {upload.total_chunks} chunks)")
+    return upload
+
+def is_received_by_storage(upload):
+    """Whether the client sends the file of ``upload`` to the storage instead of the app"""
+    return upload.method == 'DIRECT' and is_direct(get_submission_storage())
+
+def write_chunk(upload, index, stream, checksum):
+    """
+    Stream chunk ``index`` from ``stream`` to an anonymous staging file while
+    hashing it, then copy it to its offset in the temporary file. The chunk
+    only reaches the temporary file when its length and SHA-256 ``checksum``
+    match, so a failed retry never overwrites a chunk already received. The
+    copy holds the upload's row lock, so a commit never reads a chunk that
+    is half written.
+    """
+    _check_pending(upload)
+    if not 0 <= index < upload.total_chunks:
+        raise ValidationError(f"Chunk index must be between 0 and {upload.total_chunks - 1}")
+    checksum = (checksum or '').strip().lower()
+    if not CHECKSUM_PATTERN.match(checksum):
+        raise ValidationError("X-Chunk-Checksum must be the hex encoded SHA-256 of the chunk")
+
+    length = upload.get_chunk_length(index)
+    offset = index * upload.chunk_size
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        staged = tempfile.TemporaryFile(dir=get_upload_dir())
+    except FileNotFoundError:
+        raise NotFoundError("The data of this upload is gone, please start a new one")
+    with staged:
+        # Read one byte past the expected length to detect oversized chunks
+        while received <= length:
+            data = stream.read(min(READ_SIZE, length + 1 - received))
+            if not data:
+                break
+            received += len(data)
+            if received > length:
+                break
+            digest.update(data)
+            staged.write(data)
+
+        if received != length:
+            raise ValidationError(f"Chunk {index} must be exactly {length} bytes")
+        if digest.hexdigest() != checksum:
+            raise ValidationError(f"Checksum of chunk {index} does not match, please send it again")
+
+        with transaction.atomic():
+            upload = SubmissionUpload.objects.select_for_update().get(pk=upload.pk)
+            _check_pending(upload)
+            try:
+                fd = os.open(get_temp_path(upload), os.O_WRONLY)
+            except FileNotFoundError:
+                raise NotFoundError("The data of this upload is gone, please start a new one")
+            try:
+                staged.seek(0)
+                while data := staged.read(READ_SIZE):
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+            finally:
+                os.close(fd)
+
+            SubmissionUploadChunk.objects.bulk_create(
+                [SubmissionUploadChunk(upload=upload, index=index, size=length, checksum=checksum)],
+                update_conflicts=True,
+                unique_fields=['upload', 'index'],
+                update_fields=['size', 'checksum', 'received_at']
+            )
+
+def get_missing_chunks(upload):
+    received = set(upload.chunks.values_list('index', flat=True))
+    return [index for index in range(upload.total_chunks) if index not in received]
+
+def commit_upload(upload):
+    """
+    Turn a fully received upload into a FileSubmission. The temporary file is
+    hashed and moved into the blob store, not copied, or dropped when the
+    same content is already stored. A file uploaded to the storage directly
+    is copied inside the storage. Committing again returns the same
+    submission, so a commit whose response was lost can be retried.
+    """
+    with blob_transaction():
+        upload = SubmissionUpload.objects.select_for_update(of=('self',)).select_related('assessment', 'submission').get(pk=upload.pk)
+        if upload.status == 'COMMITTED':
+            if upload.submission is None:
+                raise NotFoundError("The submission of this upload has been deleted")
+            return upload.submission
+        _check_pending(upload)
+
+        if is_received_by_storage(upload):
+            sha256 = verify_staged_object(upload)
+        else:
+            missing = get_missing_chunks(upload)
+            if missing:
+                raise ValidationError(
+                    f"{len(missing)} of {upload.total_chunks} chunks have not been received",
+                    details={'missing_chunks': missing}
+                )
+            if not os.path.exists(get_temp_path(upload)):
+                raise NotFoundError("The data of this upload is gone, please start a new one")
+
+        # Counted before the file is stored, raises when it takes the organization over its quota
+        record_submission_change(upload.assessment, 1, upload.file_size)
+        if is_received_by_storage(upload):
+            blob_id = store_staged_object(get_staging_name(upload), sha256, upload.file_size)
+        else:
+            blob_id = store_local_file(get_temp_path(upload))
+        submission = FileSubmission.objects.create(
+            assessment=upload.assessment,
+            user_id=upload.user_id,
+            file_name=upload.file_name,
+            file_path=get_blob_name(blob_id),
+            file_size=upload.file_size,
+            blob_id=blob_id
+        )
+        schedule_processing(submission)
+        upload.status = 'COMMITTED'
+        upload.submission = submission
+        upload.save(update_fields=['status', 'submission', 'updated_at'])
+        upload.chunks.all().delete()
+    logger.info(f"Committed upload {upload.id} as submission {submission.id} with blob {blob_id}")
+    return submission
+
+def verify_staged_object(upload):
+    """
+    Check the file a client uploaded to the storage directly against the
+    declared size and SHA-256, and return the SHA-256. Stores that verified
+    the checksum on write are trusted, the object is read back otherwise.
+    """
+    storage = get_submission_storage()
+    name = get_staging_name(upload)
+    if not storage.exists(name):
+        raise ValidationError("The file of this upload has not been received")
+
+    sha256 = get_verified_checksum(storage, name)
+    if sha256 is None:
+        with storage.open(name) as staged:
+            sha256, size = hash_chunks(staged.chunks())
+    else:
+        size = storage.size(name)
+
+    if size != upload.file_size or sha256 != upload.sha256:
+        storage.delete(name)
+        raise ValidationError("The uploaded file does not match its declared size and checksum, please send it again")
+    return sha256
+
+def abort_upload(upload):
+    """Discard a pending upload and its received chunks"""
+    if upload.status != 'PENDING':
+        raise ValidationError("This upload has already been committed")
+    remove_upload_files(upload)
+    upload.delete()
+
+def remove_upload_files(upload):
+    """Remove what was received of ``upload``: its temporary file or the object staged in the storage"""
+    if is_received_by_storage(upload):
+        get_submission_storage().delete(get_staging_name(upload))
+    try:
+        os.remove(get_temp_path(upload))
+    except FileNotFoundError:
+        pass
+
+def purge_expired_uploads(batch_size, dry_run=False):
+    """
+    Delete the uploads past their expiry, with their received chunks,
+    temporary files and staged objects, a batch at a time. Committed uploads
+    only lose their row, which lets a lost commit response be retried until
+    then. Uploads being committed are skipped. Returns the number of uploads.
+    """
+    expired = SubmissionUpload.objects.filter(expires_at__lte=timezone.now())
+    if dry_run:
+        return expired.count()
+
+    count = 0
+    while True:
+        with transaction.atomic():
+            uploads = list(
+                expired.select_for_update(skip_locked=True).only('id', 'method', 'status').order_by('pk')[:batch_size]
+            )
+            SubmissionUpload.objects.filter(pk__in=[upload.pk for upload in uploads]).delete()
+        # Removed once the rows are gone, so no commit can pick them up in between
+        for upload in uploads:
+            if upload.status == 'PENDING':
+                remove_upload_files(upload)
+        count += len(uploads)
+        if len(uploads) < batch_size:
+            break
+    if count:
+        logger.info(f"Purged {count} expired uploads")
+    return count
@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     CourseViewSet, ModuleViewSet, LessonViewSet,
     CourseEnrollmentViewSet, TagViewSet, SearchViewSet,
-    StatsViewSet, AssessmentViewSet
+    StatsViewSet, AssessmentViewSet, SubmissionStorageView
 )
 
 router = DefaultRouter()
@@ -28,4 +28,5 @@ urlpatterns = [
     path('courses/<uuid:course_id>/modules/<uuid:module_id>/', include(module_router.urls)),
     path('search/', SearchViewSet.as_view(), name='global-search'),
     path('stats/', StatsViewSet.as_view(), name='stats'),
+    path('storage/<str:token>/', SubmissionStorageView.as_view(), name='submission-storage'),
 ] 
\ No newline at end of file
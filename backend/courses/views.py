@@ -1,32 +1,60 @@
 from django.shortcuts import render, get_object_or_404
-from rest_framework import viewsets
-from django.http import Http404
-from .models import Course, Module, Lesson, CourseEnrollment, Tag, User, Assessment, FileSubmissionAssessment, FileSubmission
+from rest_framework import viewsets, serializers
+from django.http import Http404, StreamingHttpResponse
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .models import Course, Module, Lesson, CourseEnrollment, Tag, User, Assessment, FileSubmissionAssessment, FileSubmission, SubmissionUpload
 from .serializers import CourseSerializer, ModuleSerializer, LessonSerializer, CourseEnrollmentSerializer, TagSerializer, AssessmentSerializer, FileSubmissionSerializer
+from .serializers import SubmissionUploadSerializer
+from .serializers import CourseSearchResultSerializer, ModuleSearchResultSerializer, LessonSearchResultSerializer
+from .search import SEARCH_TYPES, build_search_query, decode_search_cursor, encode_search_cursor, search
+from .uploads import SubmissionUploadHandler, validate_submission_file, create_upload, write_chunk, commit_upload, abort_upload
+from .blobs import blob_transaction, get_blob_name, store_uploaded_file, release_blobs
+from .processing import schedule_processing
+from .storage import get_submission_storage, get_submission_file, load_token
+from .exports import parse_bound, filter_submissions, latest_per_user, stream_submissions_zip, EXPORT_FIELDS, EXPORT_CHUNK_SIZE
+from core.downloads import serve_file
+from .cascade import (
+    soft_delete_courses, restore_courses, soft_delete_modules, restore_modules,
+    soft_delete_lessons, restore_lessons
+)
 from core.exceptions import ValidationError, NotFoundError, ServerError, APIError, PermissionError
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from core.permissions import OrganizationPermission, OrganizationAdminPermission
+from core.fieldsets import SparseFieldsetViewMixin
+from core.diagnostics import Diagnostics
+from core.search import search_q, is_similarity_search, rank_by_similarity
 from rest_framework.decorators import action
 from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.utils.text import slugify
 from django.db import transaction, IntegrityError
 from django.db.models import Q
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from core.pagination import KeysetPaginationMixin, KeysetPagination
+from .stats import (
+    get_overview, get_course_stats_queryset, format_course_stats,
+    record_course_change, record_enrollment_change, record_submission_change, course_state
+)
 import logging
 import os
+import uuid
 
 logger = logging.getLogger(__name__)
 
-class CoursePagination(PageNumberPagination):
+class CoursePagination(KeysetPaginationMixin, PageNumberPagination):
     page_size = 10  # Show 10 courses per page
     page_size_query_param = 'page_size'
     max_page_size = 100  # Maximum number of courses that can be requested per page
 
     def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.use_keyset(request)
+        if self.keyset:
+            return self.paginate_keyset(queryset, request)
+
         logger.info("=== Starting CoursePagination.paginate_queryset ===")
-        logger.info(f"Initial queryset count: {queryset.count()}")
         
         # Get the page number from request, default to 1
         page = int(request.query_params.get('page', 1))
@@ -52,6 +80,8 @@ class CoursePagination(PageNumberPagination):
         return items
 
     def get_paginated_response(self, data):
+        if self.keyset:
+            return self.get_keyset_paginated_response(data)
         return Response({
             'count': self.count,
             'next': f"?page={self.next_page}" if self.next_page else None,
@@ -63,7 +93,7 @@ class CoursePagination(PageNumberPagination):
 
 # Create your views here.
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated, OrganizationPermission]
     pagination_class = CoursePagination
@@ -80,11 +110,12 @@ class CourseViewSet(viewsets.ModelViewSet):
         # Get the view parameter to determine which tab we're in
         view = self.request.query_params.get('view')
         logger.info(f"View parameter: {view}")
+        diagnostics = Diagnostics(logger, self.request)
         
         # For admin users, use all_objects to access all courses including deleted ones
         if self.request.user.is_staff:
             queryset = Course.all_objects.filter(organization=self.request.user.organization)
-            logger.info(f"Initial queryset count (all_objects): {queryset.count()}")
+            diagnostics.log("Initial queryset count (all_objects): %s", queryset.count)
             
             # Handle show_deleted parameter
             show_deleted = self.request.query_params.get('show_deleted', 'false').lower() == 'true'
@@ -119,20 +150,26 @@ class CourseViewSet(viewsets.ModelViewSet):
             
             # Handle search query
             search = self.request.query_params.get('search', None)
+            similarity = bool(search) and is_similarity_search(self.request)
             if search:
+                # Tags are matched through a subquery, which avoids joining and de-duplicating courses
+                tagged_courses = Course.tags.through.objects.filter(
+                    tag__in=Tag.objects.filter(search_q(search, ['name'], similarity))
+                ).values('course_id')
                 queryset = queryset.filter(
-                    Q(title__icontains=search) | 
-                    Q(description__icontains=search) |
-                    Q(tags__name__icontains=search)
-                ).distinct()
+                    search_q(search, ['title', 'description'], similarity) |
+                    Q(id__in=tagged_courses)
+                )
                 logger.info(f"Filtered by search: {search}")
             
-            # Always sort by most recent first
+            # Always sort by most recent first, or by closeness when similarity ranking was asked for
             queryset = queryset.order_by('-created_at')
+            if similarity:
+                queryset = rank_by_similarity(queryset, search, ['title', 'description'])
             
             if not show_deleted:
                 queryset = queryset.filter(deleted_at__isnull=True)
-                logger.info(f"Filtered out deleted courses. New count: {queryset.count()}")
+                diagnostics.log("Filtered out deleted courses. New count: %s", queryset.count)
         else:
             # For normal users, use the default manager which already filters out deleted courses
             queryset = Course.objects.filter(
@@ -163,11 +200,11 @@ class CourseViewSet(viewsets.ModelViewSet):
                         enrollments__status='DROPPED'
                     )
             
-            logger.info(f"Normal user queryset count: {queryset.count()}")
+            diagnostics.log("Normal user queryset count: %s", queryset.count)
         
-        logger.info(f"Final queryset count: {queryset.count()}")
+        diagnostics.log("Final queryset count: %s", queryset.count)
         logger.info("=== End get_queryset ===")
-        return queryset
+        return queryset.select_related('organization')
 
     def get_object(self):
         try:
@@ -190,7 +227,9 @@ class CourseViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         try:
             # Ensure the organization is set to the user's organization
-            serializer.save(organization=self.request.user.organization)
+            with transaction.atomic():
+                course = serializer.save(organization=self.request.user.organization)
+                record_course_change(course, None, course_state(course))
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
@@ -200,7 +239,10 @@ class CourseViewSet(viewsets.ModelViewSet):
         try:
             instance = self.get_object()
             logger.info(f"Attempting to update course {instance.id} with data: {serializer.validated_data}")
-            serializer.save()
+            old_state = course_state(serializer.instance)
+            with transaction.atomic():
+                course = serializer.save()
+                record_course_change(course, old_state, course_state(course))
         except ValidationError as e:
             logger.error(f"Validation error updating course: {str(e)}")
             raise e
@@ -227,29 +269,9 @@ class CourseViewSet(viewsets.ModelViewSet):
                     f"Course {instance.id} is being soft deleted with {active_enrollments} active enrollments"
                 )
             
-            # Soft delete the course
-            logger.info("Setting deleted_at to current time")
-            instance.deleted_at = timezone.now()
-            instance.save()
-            logger.info(f"Updated deleted_at value: {instance.deleted_at}")
-            
-            # Verify the soft delete
-            updated_course = Course.all_objects.get(id=instance.id)
-            logger.info(f"Verified deleted_at after save: {updated_course.deleted_at}")
-            
-            # Soft delete all modules in this course
-            modules_count = instance.modules.count()
-            logger.info(f"Soft deleting {modules_count} modules")
-            for module in instance.modules.all():
-                module.deleted_at = timezone.now()
-                module.save()
-                
-                # Soft delete all lessons in this module
-                lessons_count = module.lessons.count()
-                logger.info(f"Soft deleting {lessons_count} lessons in module {module.id}")
-                for lesson in module.lessons.all():
-                    lesson.deleted_at = timezone.now()
-                    lesson.save()
+            # Soft delete the course with its modules, lessons and assessments
+            counts = soft_delete_courses([instance.id])
+            logger.info(f"Soft deleted course {instance.id}: {counts}")
             
             logger.info("=== End perform_destroy ===")
         except Exception as e:
@@ -265,18 +287,10 @@ class CourseViewSet(viewsets.ModelViewSet):
             if not course.deleted_at:
                 raise ValidationError("Course is not deleted")
             
-            course.deleted_at = None
-            course.save()
-            
-            # Restore all modules and their lessons using all_objects to access soft-deleted items
-            for module in Module.all_objects.filter(course=course):
-                module.deleted_at = None
-                module.save()
-                
-                # Restore all lessons in this module
-                for lesson in Lesson.all_objects.filter(module=module):
-                    lesson.deleted_at = None
-                    lesson.save()
+            # Restore the course with its modules, lessons and assessments
+            counts = restore_courses([course.id])
+            logger.info(f"Restored course {course.id}: {counts}")
+            course.refresh_from_db(fields=['deleted_at', 'updated_at'])
             
             serializer = self.get_serializer(course)
             return Response(serializer.data)
@@ -307,6 +321,7 @@ class CourseViewSet(viewsets.ModelViewSet):
                     
                     # Create the enrollment
                     enrollment = serializer.save(user=request.user)
+                    record_enrollment_change(course, None, enrollment.status)
                     
                     # Return updated course data
                     course_serializer = CourseSerializer(course, context={'request': request})
@@ -318,27 +333,39 @@ class CourseViewSet(viewsets.ModelViewSet):
                 raise e
             raise ServerError("Failed to enroll in course")
 
+    def _change_enrollment_status(self, course, user_id, new_status, timestamp_field):
+        """
+        Move the latest ENROLLED enrollment of ``user_id`` in ``course`` to
+        ``new_status``, stamping ``timestamp_field``, and return it, or None
+        when there is none. The row is locked while it changes, so of two
+        concurrent requests only the first finds it ENROLLED and counts it.
+        """
+        with transaction.atomic():
+            enrollment = CourseEnrollment.objects.select_for_update().filter(
+                user_id=user_id,
+                course=course,
+                status='ENROLLED'
+            ).order_by('-enrolled_at').first()
+            if not enrollment:
+                return None
+            old_status = enrollment.status
+            enrollment.status = new_status
+            setattr(enrollment, timestamp_field, timezone.now())
+            enrollment.save(update_fields=['status', timestamp_field, 'last_accessed_at'])
+            record_enrollment_change(course, old_status, enrollment.status)
+        return enrollment
+
     @action(detail=True, methods=['post'])
     def unenroll(self, request, pk=None):
         try:
             course = self.get_object()
             
             try:
-                # Get the latest enrollment for this user and course
-                enrollment = CourseEnrollment.objects.filter(
-                    user=request.user,
-                    course=course,
-                    status='ENROLLED'  # Only allow unenrolling from ENROLLED status
-                ).order_by('-enrolled_at').first()
-                
+                # Only allow unenrolling from ENROLLED status
+                enrollment = self._change_enrollment_status(course, request.user.id, 'DROPPED', 'dropped_at')
                 if not enrollment:
                     raise NotFoundError("You are not enrolled in this course")
                 
-                # Update the enrollment status
-                enrollment.status = 'DROPPED'
-                enrollment.dropped_at = timezone.now()
-                enrollment.save()
-                
                 # Return updated course data
                 course_serializer = CourseSerializer(course, context={'request': request})
                 return Response(course_serializer.data)
@@ -366,24 +393,10 @@ class CourseViewSet(viewsets.ModelViewSet):
                 # Get the user ID from the request data (for admin users) or use the current user
                 user_id = request.data.get('user_id') if request.user.is_staff else request.user.id
                 
-                # Get the latest enrollment for this user and course
-                enrollment = CourseEnrollment.objects.filter(
-                    user_id=user_id,
-                    course=course,
-                    status='ENROLLED'
-                ).order_by('-enrolled_at').first()
-                
+                enrollment = self._change_enrollment_status(course, user_id, 'COMPLETED', 'completed_at')
                 if not enrollment:
                     raise NotFoundError("User is not enrolled in this course")
-                
-                print(f"Marking course {course.id} as complete for user {user_id}")
-                print(f"Current enrollment status: {enrollment.status}")
-                
-                enrollment.status = 'COMPLETED'
-                enrollment.completed_at = timezone.now()
-                enrollment.save()
-                
-                print(f"Updated enrollment status: {enrollment.status}")
+                logger.info(f"Marked course {course.id} as complete for user {user_id}")
                 
                 # Return updated course data
                 course_serializer = CourseSerializer(course, context={'request': request})
@@ -422,20 +435,10 @@ class CourseViewSet(viewsets.ModelViewSet):
                 raise ValidationError("Invalid user_id format")
                 
             try:
-                # Get the latest enrollment for the specified user and course
-                enrollment = CourseEnrollment.objects.filter(
-                    user_id=user_id,
-                    course=course,
-                    status='ENROLLED'
-                ).order_by('-enrolled_at').first()
-                
+                enrollment = self._change_enrollment_status(course, user_id, 'COMPLETED', 'completed_at')
                 if not enrollment:
                     logger.error(f"No active enrollment found for user {user_id} in course {course.id}")
                     raise NotFoundError("User is not enrolled in this course")
-                
-                enrollment.status = 'COMPLETED'
-                enrollment.completed_at = timezone.now()
-                enrollment.save()
                 logger.info(f"Successfully marked course {course.id} as complete for user {user_id}")
                 
                 # Return updated course data
@@ -465,8 +468,8 @@ class CourseViewSet(viewsets.ModelViewSet):
             logger.info(f"Course {course.id} current deleted_at: {course.deleted_at}")
             
             # Soft delete the course
-            course.deleted_at = timezone.now()
-            course.save()
+            soft_delete_courses([course.id])
+            course.refresh_from_db(fields=['deleted_at'])
             
             # Verify the course is soft deleted
             soft_deleted = Course.all_objects.filter(id=course.id, deleted_at__isnull=False).exists()
@@ -481,7 +484,7 @@ class CourseViewSet(viewsets.ModelViewSet):
             logger.error(f"Error in test_soft_delete: {str(e)}")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ModuleViewSet(viewsets.ModelViewSet):
+class ModuleViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = ModuleSerializer
     permission_classes = [IsAuthenticated, OrganizationPermission]
 
@@ -507,8 +510,10 @@ class ModuleViewSet(viewsets.ModelViewSet):
             else:
                 course = get_object_or_404(Course.objects, id=course_id, organization=self.request.user.organization)
             
+            diagnostics = Diagnostics(logger, self.request)
             logger.info(f"Found course: {course.title}")
-            logger.info(f"Course organization: {course.organization}")
+            # Reading the organization is a query of its own
+            diagnostics.log("Course organization: %s", lambda: course.organization)
             
             show_deleted = self.request.query_params.get('show_deleted', 'false').lower() == 'true'
             logger.info(f"show_deleted parameter: {show_deleted}")
@@ -516,21 +521,21 @@ class ModuleViewSet(viewsets.ModelViewSet):
             # For admin users, use all_objects to access all modules including deleted ones
             if self.request.user.is_staff:
                 queryset = Module.all_objects.filter(course=course)
-                logger.info(f"Using all_objects. Initial count: {queryset.count()}")
-                logger.info(f"Deleted modules count: {queryset.filter(deleted_at__isnull=False).count()}")
-                logger.info(f"Active modules count: {queryset.filter(deleted_at__isnull=True).count()}")
+                diagnostics.log("Using all_objects. Initial count: %s", queryset.count)
+                diagnostics.log("Deleted modules count: %s", queryset.filter(deleted_at__isnull=False).count)
+                diagnostics.log("Active modules count: %s", queryset.filter(deleted_at__isnull=True).count)
                 
                 if not show_deleted:
                     queryset = queryset.filter(deleted_at__isnull=True)
-                    logger.info(f"Filtered out deleted modules. New count: {queryset.count()}")
+                    diagnostics.log("Filtered out deleted modules. New count: %s", queryset.count)
             else:
                 # For normal users, use the default manager which already filters out deleted modules
                 queryset = Module.objects.filter(course=course)
-                logger.info(f"Using default manager. Initial count: {queryset.count()}")
+                diagnostics.log("Using default manager. Initial count: %s", queryset.count)
             
             # Log the final queryset SQL
-            logger.info(f"Final SQL query: {str(queryset.query)}")
-            logger.info(f"Final modules count: {queryset.count()}")
+            diagnostics.log("Final SQL query: %s", queryset.query)
+            diagnostics.log("Final modules count: %s", queryset.count)
             logger.info("=== End ModuleViewSet.get_queryset ===")
             return queryset.order_by('order')
         except Http404:
@@ -645,18 +650,9 @@ class ModuleViewSet(viewsets.ModelViewSet):
             if active_enrollments > 0:
                 logger.warning(f"Module has {active_enrollments} active enrollments")
             
-            # Soft delete the module
-            instance.deleted_at = timezone.now()
-            instance.save()
-            logger.info("Set deleted_at to current time")
-            
-            # Verify soft delete
-            updated_module = Module.all_objects.get(id=instance.id)
-            logger.info(f"Verified soft delete - deleted_at: {updated_module.deleted_at}")
-            
-            # Soft delete all lessons in this module
-            lessons_count = instance.lessons.all().update(deleted_at=timezone.now())
-            logger.info(f"Soft deleted {lessons_count} lessons in this module")
+            # Soft delete the module with its lessons and assessments
+            counts = soft_delete_modules([instance.id])
+            logger.info(f"Soft deleted module {instance.id}: {counts}")
             
             logger.info("=== End ModuleViewSet.perform_destroy ===")
         except Exception as e:
@@ -674,19 +670,10 @@ class ModuleViewSet(viewsets.ModelViewSet):
                 raise ValidationError("Module is not deleted")
             
             logger.info(f"Current deleted_at value: {module.deleted_at}")
-            module.deleted_at = None
-            module.save()
-            logger.info("Set deleted_at to None")
-            
-            # Restore all lessons in this module using all_objects to access soft-deleted items
-            for lesson in Lesson.all_objects.filter(module=module):
-                lesson.deleted_at = None
-                lesson.save()
-                logger.info(f"Restored lesson {lesson.id}")
-            
-            # Verify restore
-            updated_module = Module.all_objects.get(id=module.id)
-            logger.info(f"Verified restore - deleted_at: {updated_module.deleted_at}")
+            # Restore the module with its lessons and assessments
+            counts = restore_modules([module.id])
+            logger.info(f"Restored module {module.id}: {counts}")
+            module.refresh_from_db(fields=['deleted_at', 'updated_at'])
             
             serializer = self.get_serializer(module)
             logger.info("=== End ModuleViewSet.restore ===")
@@ -700,7 +687,7 @@ class ModuleViewSet(viewsets.ModelViewSet):
                 raise e
             raise ServerError("Failed to restore module")
 
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, OrganizationPermission]
 
@@ -726,29 +713,35 @@ class LessonViewSet(viewsets.ModelViewSet):
                 # Then check if the module exists and belongs to the course
                 module = get_object_or_404(Module.objects, id=module_id, course=course)
             
+            diagnostics = Diagnostics(logger, self.request)
+            
             # For admin users, use all_objects to access all lessons including deleted ones
             if self.request.user.is_staff:
                 queryset = Lesson.all_objects.filter(module=module)
-                logger.info(f"Initial lessons count (all_objects): {queryset.count()}")
+                diagnostics.log("Initial lessons count (all_objects): %s", queryset.count)
                 
                 show_deleted = self.request.query_params.get('show_deleted', 'false').lower() == 'true'
                 logger.info(f"show_deleted parameter: {show_deleted}")
                 
                 # Log deleted lessons count
-                deleted_count = queryset.filter(deleted_at__isnull=False).count()
-                logger.info(f"Number of deleted lessons in queryset: {deleted_count}")
+                diagnostics.log("Number of deleted lessons in queryset: %s", queryset.filter(deleted_at__isnull=False).count)
                 
                 if show_deleted:
                     logger.info("Including deleted lessons in response")
                 else:
                     queryset = queryset.filter(deleted_at__isnull=True)
-                    logger.info(f"Filtered out deleted lessons. New count: {queryset.count()}")
+                    diagnostics.log("Filtered out deleted lessons. New count: %s", queryset.count)
             else:
                 # For normal users, use the default manager which already filters out deleted lessons
                 queryset = Lesson.objects.filter(module=module)
-                logger.info(f"Normal user lessons count: {queryset.count()}")
+                diagnostics.log("Normal user lessons count: %s", queryset.count)
             
-            logger.info(f"Final lessons count: {queryset.count()}")
+            # The search vector is never rendered, and the lesson body only when asked for
+            queryset = queryset.defer('search_vector')
+            if 'content' not in self.get_rendered_fields():
+                queryset = queryset.defer('content')
+            
+            diagnostics.log("Final lessons count: %s", queryset.count)
             logger.info("=== End LessonViewSet.get_queryset ===")
             return queryset.order_by('order')
         except Http404:
@@ -856,14 +849,9 @@ class LessonViewSet(viewsets.ModelViewSet):
             if active_enrollments > 0:
                 logger.warning(f"Lesson's course has {active_enrollments} active enrollments")
             
-            # Soft delete the lesson
-            instance.deleted_at = timezone.now()
-            instance.save()
-            logger.info("Set deleted_at to current time")
-            
-            # Verify soft delete
-            updated_lesson = Lesson.all_objects.get(id=instance.id)
-            logger.info(f"Verified soft delete - deleted_at: {updated_lesson.deleted_at}")
+            # Soft delete the lesson with its assessments
+            counts = soft_delete_lessons([instance.id])
+            logger.info(f"Soft deleted lesson {instance.id}: {counts}")
             
             logger.info("=== End LessonViewSet.perform_destroy ===")
         except Exception as e:
@@ -881,13 +869,10 @@ class LessonViewSet(viewsets.ModelViewSet):
                 raise ValidationError("Lesson is not deleted")
             
             logger.info(f"Current deleted_at value: {lesson.deleted_at}")
-            lesson.deleted_at = None
-            lesson.save()
-            logger.info("Set deleted_at to None")
-            
-            # Verify restore
-            updated_lesson = Lesson.all_objects.get(id=lesson.id)
-            logger.info(f"Verified restore - deleted_at: {updated_lesson.deleted_at}")
+            # Restore the lesson with its assessments
+            counts = restore_lessons([lesson.id])
+            logger.info(f"Restored lesson {lesson.id}: {counts}")
+            lesson.refresh_from_db(fields=['deleted_at', 'updated_at'])
             
             serializer = self.get_serializer(lesson)
             logger.info("=== End LessonViewSet.restore ===")
@@ -901,13 +886,20 @@ class LessonViewSet(viewsets.ModelViewSet):
                 raise e
             raise ServerError("Failed to restore lesson")
 
+class EnrollmentPagination(KeysetPagination):
+    page_size = 20
+
+class SubmissionPagination(KeysetPagination):
+    page_size = 50
+
 class CourseEnrollmentViewSet(viewsets.ModelViewSet):
     serializer_class = CourseEnrollmentSerializer
     permission_classes = [IsAuthenticated, OrganizationPermission]
+    pagination_class = EnrollmentPagination
     http_method_names = ['get', 'patch', 'head']  # Only allow GET and PATCH operations
 
     def get_queryset(self):
-        queryset = CourseEnrollment.objects.all()
+        queryset = CourseEnrollment.objects.select_related('course', 'user')
         
         # Filter by course if provided
         course_id = self.request.query_params.get('course')
@@ -928,21 +920,29 @@ class CourseEnrollmentViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         try:
             instance = self.get_object()
+            old_course, old_status = serializer.instance.course, serializer.instance.status
             
-            # Only allow updating the status field
-            if 'status' in serializer.validated_data:
-                new_status = serializer.validated_data['status']
-                
-                # If marking as completed, set completed_at
-                if new_status == 'COMPLETED' and instance.status != 'COMPLETED':
-                    serializer.save(completed_at=timezone.now())
-                # If marking as dropped, set dropped_at
-                elif new_status == 'DROPPED' and instance.status != 'DROPPED':
-                    serializer.save(dropped_at=timezone.now())
+            with transaction.atomic():
+                # Only allow updating the status field
+                if 'status' in serializer.validated_data:
+                    new_status = serializer.validated_data['status']
+                    
+                    # If marking as completed, set completed_at
+                    if new_status == 'COMPLETED' and instance.status != 'COMPLETED':
+                        enrollment = serializer.save(completed_at=timezone.now())
+                    # If marking as dropped, set dropped_at
+                    elif new_status == 'DROPPED' and instance.status != 'DROPPED':
+                        enrollment = serializer.save(dropped_at=timezone.now())
+                    else:
+                        enrollment = serializer.save()
                 else:
-                    serializer.save()
-            else:
-                serializer.save()
+                    enrollment = serializer.save()
+
+                if enrollment.course_id != old_course.id:
+                    record_enrollment_change(old_course, old_status, None)
+                    record_enrollment_change(enrollment.course, None, enrollment.status)
+                else:
+                    record_enrollment_change(enrollment.course, old_status, enrollment.status)
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
@@ -950,45 +950,51 @@ class CourseEnrollmentViewSet(viewsets.ModelViewSet):
 
 class SearchViewSet(APIView):
     permission_classes = [IsAuthenticated, OrganizationPermission]
+    result_serializers = {
+        'courses': CourseSearchResultSerializer,
+        'modules': ModuleSearchResultSerializer,
+        'lessons': LessonSearchResultSerializer,
+    }
+    default_limit = 10
+    max_limit = 50
     
     def get(self, request):
         try:
-            query = request.query_params.get('q', '')
-            if not query:
-                return Response({
-                    'courses': [],
-                    'modules': [],
-                    'lessons': []
-                })
-            
-            # Search in courses
-            courses = Course.objects.filter(
-                Q(organization=request.user.organization) &
-                (Q(title__icontains=query) | Q(description__icontains=query))
-            )
-            
-            # Search in modules
-            modules = Module.objects.filter(
-                Q(course__organization=request.user.organization) &
-                (Q(title__icontains=query) | Q(description__icontains=query))
-            )
-            
-            # Search in lessons
-            lessons = Lesson.objects.filter(
-                Q(module__course__organization=request.user.organization) &
-                (Q(title__icontains=query) | Q(description__icontains=query) | Q(content__icontains=query))
-            )
-            
-            # Serialize the results
-            course_serializer = CourseSerializer(courses, many=True, context={'request': request})
-            module_serializer = ModuleSerializer(modules, many=True, context={'request': request})
-            lesson_serializer = LessonSerializer(lessons, many=True, context={'request': request})
-            
-            return Response({
-                'courses': course_serializer.data,
-                'modules': module_serializer.data,
-                'lessons': lesson_serializer.data
-            })
+            types = request.query_params.get('type')
+            types = [name.strip() for name in types.split(',') if name.strip()] if types else SEARCH_TYPES
+            invalid = [name for name in types if name not in SEARCH_TYPES]
+            if invalid:
+                raise ValidationError(f"type must be one of: {', '.join(SEARCH_TYPES)}")
+
+            try:
+                limit = int(request.query_params.get('limit', self.default_limit))
+                offset = max(int(request.query_params.get('offset', 0)), 0)
+            except (TypeError, ValueError):
+                raise ValidationError("limit and offset must be integers")
+            limit = min(max(limit, 1), self.max_limit)
+
+            # A cursor is the position in the results of one type
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                if len(types) != 1:
+                    raise ValidationError("cursor requires a single type")
+                cursor = decode_search_cursor(cursor)
+                offset = 0
+
+            query = build_search_query(request.query_params.get('q', ''))
+            response = {}
+            pagination = {}
+            for search_type in types:
+                results, has_more = search(search_type, request.user.organization, query, offset, limit, cursor) if query else ([], False)
+                response[search_type] = self.result_serializers[search_type](results, many=True).data
+                pagination[search_type] = {
+                    'offset': offset,
+                    'limit': limit,
+                    'next_offset': offset + limit if has_more else None,
+                    'next_cursor': encode_search_cursor(results[-1]) if has_more else None
+                }
+            response['pagination'] = pagination
+            return Response(response)
             
         except Exception as e:
             if isinstance(e, APIError):
@@ -1032,82 +1038,57 @@ class TagViewSet(viewsets.ModelViewSet):
 
 class StatsViewSet(APIView):
     permission_classes = [IsAuthenticated, OrganizationAdminPermission]
-    
+    course_stats_page_size = 50
+    course_stats_max_page_size = 500
+
     def get(self, request):
         try:
             organization = request.user.organization
-            
-            # Course statistics
-            total_courses = Course.objects.filter(organization=organization).count()
-            published_courses = Course.objects.filter(organization=organization, status='PUBLISHED').count()
-            draft_courses = Course.objects.filter(organization=organization, status='DRAFT').count()
-            
-            # Enrollment statistics
-            total_enrollments = CourseEnrollment.objects.filter(
-                course__organization=organization
-            ).count()
-            
-            completed_enrollments = CourseEnrollment.objects.filter(
-                course__organization=organization,
-                status='COMPLETED'
-            ).count()
-            
-            active_enrollments = CourseEnrollment.objects.filter(
-                course__organization=organization,
-                status='ENROLLED'
-            ).count()
-            
-            # User statistics
-            total_users = User.objects.filter(organization=organization).count()
-            active_users = User.objects.filter(
-                organization=organization,
-                is_active=True
-            ).count()
-            
-            # Calculate completion rate
-            completion_rate = 0
-            if total_enrollments > 0:
-                completion_rate = (completed_enrollments / total_enrollments) * 100
-            
+
+            # Optional filters for the course-wise section
+            course_ids = [
+                course_id.strip()
+                for course_id in request.query_params.get('course_ids', '').split(',')
+                if course_id.strip()
+            ]
+            try:
+                course_ids = [str(uuid.UUID(course_id)) for course_id in course_ids]
+            except ValueError:
+                raise ValidationError("course_ids must be a comma separated list of course IDs")
+
+            try:
+                page = max(int(request.query_params.get('page', 1)), 1)
+                page_size = int(request.query_params.get('page_size', self.course_stats_page_size))
+            except (TypeError, ValueError):
+                raise ValidationError("page and page_size must be integers")
+            page_size = min(max(page_size, 1), self.course_stats_max_page_size)
+
+            overview = get_overview(organization)
+
             # Course-wise enrollment statistics
-            course_stats = []
-            courses = Course.objects.filter(organization=organization)
-            for course in courses:
-                course_enrollments = CourseEnrollment.objects.filter(course=course)
-                course_total = course_enrollments.count()
-                course_completed = course_enrollments.filter(status='COMPLETED').count()
-                course_active = course_enrollments.filter(status='ENROLLED').count()
-                
-                course_completion_rate = 0
-                if course_total > 0:
-                    course_completion_rate = (course_completed / course_total) * 100
-                
-                course_stats.append({
-                    'course_id': str(course.id),
-                    'title': course.title,
-                    'status': course.status,
-                    'total_enrollments': course_total,
-                    'completed_enrollments': course_completed,
-                    'active_enrollments': course_active,
-                    'completion_rate': round(course_completion_rate, 2)
-                })
+            course_stats_queryset = get_course_stats_queryset(
+                organization,
+                course_ids=course_ids,
+                ordering=request.query_params.get('ordering')
+            )
+            course_stats_count = course_stats_queryset.count()
+            start = (page - 1) * page_size
+            course_stats = format_course_stats(course_stats_queryset[start:start + page_size])
             
             return Response({
-                'overview': {
-                    'total_courses': total_courses,
-                    'published_courses': published_courses,
-                    'draft_courses': draft_courses,
-                    'total_enrollments': total_enrollments,
-                    'completed_enrollments': completed_enrollments,
-                    'active_enrollments': active_enrollments,
-                    'total_users': total_users,
-                    'active_users': active_users,
-                    'completion_rate': round(completion_rate, 2)
-                },
-                'course_stats': course_stats
+                'overview': overview,
+                'course_stats': course_stats,
+                'course_stats_pagination': {
+                    'count': course_stats_count,
+                    'page': page,
+                    'page_size': page_size,
+                    'total_pages': (course_stats_count + page_size - 1) // page_size
+                }
             })
             
         except Exception as e:
+            if isinstance(e, APIError):
+                raise e
             logger.error(f"Error fetching stats: {str(e)}")
             raise ServerError("Failed to fetch statistics")
 
@@ -1185,9 +1166,14 @@ class AssessmentViewSet(viewsets.ModelViewSet):
     def perform_destroy(self, instance):
         instance.delete()
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=SubmissionPagination)
     def submissions(self, request, pk=None, course_id=None):
-        """Get all submissions for an assessment"""
+        """
+        Get the submissions for an assessment. Optional filters: user,
+        submitted_after and submitted_before (ISO 8601 dates or datetimes),
+        latest=true for the last submission of every user, and sort_by.
+        Keyset paginated when a cursor is requested.
+        """
         try:
             assessment = self.get_object()
             
@@ -1206,13 +1192,36 @@ class AssessmentViewSet(viewsets.ModelViewSet):
                 except Course.DoesNotExist:
                     raise NotFoundError("Associated course not found")
 
-            # Get submissions
-            submissions = FileSubmission.objects.filter(assessment=assessment)
+            # Get submissions, with the submitter rendered in user_email
+            submissions = FileSubmission.objects.filter(assessment=assessment).select_related('user')
             
             # If not staff, only show user's own submissions
             if not request.user.is_staff:
                 submissions = submissions.filter(user=request.user)
-            
+            elif request.query_params.get('user'):
+                try:
+                    submissions = submissions.filter(user_id=int(request.query_params['user']))
+                except ValueError:
+                    raise ValidationError("user must be a user ID")
+
+            submissions = filter_submissions(
+                submissions,
+                submitted_after=parse_bound(request.query_params.get('submitted_after'), 'submitted_after'),
+                submitted_before=parse_bound(request.query_params.get('submitted_before'), 'submitted_before', end=True)
+            )
+            if request.query_params.get('latest', 'false').lower() == 'true':
+                submissions = latest_per_user(submissions)
+
+            sort_by = request.query_params.get('sort_by', '-submitted_at')
+            if sort_by.lstrip('-') in ['submitted_at', 'file_name', 'file_size']:
+                submissions = submissions.order_by(sort_by)
+            else:
+                submissions = submissions.order_by('-submitted_at')
+
+            page = self.paginate_queryset(submissions)
+            if page is not None:
+                serializer = FileSubmissionSerializer(page, many=True, context={'request': request})
+                return self.get_paginated_response(serializer.data)
             serializer = FileSubmissionSerializer(submissions, many=True, context={'request': request})
             return Response(serializer.data)
             
@@ -1221,6 +1230,116 @@ class AssessmentViewSet(viewsets.ModelViewSet):
                 raise e
             raise ServerError("Failed to fetch submissions")
 
+    @action(
+        detail=True, methods=['get'], url_path='submissions/export',
+        permission_classes=[IsAuthenticated, OrganizationAdminPermission]
+    )
+    def export_submissions(self, request, pk=None, course_id=None):
+        """
+        Stream a ZIP of the submitted files with a CSV manifest. Optional
+        filters: submitted_after and submitted_before (ISO 8601 dates or
+        datetimes), and latest=true for the last submission of every user.
+        """
+        try:
+            assessment = self.get_object()
+            submissions = filter_submissions(
+                FileSubmission.objects.filter(assessment=assessment).select_related('user').only(*EXPORT_FIELDS),
+                submitted_after=parse_bound(request.query_params.get('submitted_after'), 'submitted_after'),
+                submitted_before=parse_bound(request.query_params.get('submitted_before'), 'submitted_before', end=True),
+                latest=request.query_params.get('latest', '').lower() == 'true'
+            )
+            logger.info(f"Exporting the submissions of assessment {assessment.id}")
+
+            # Rows are fetched in chunks and files read while the archive is sent
+            response = StreamingHttpResponse(
+                stream_submissions_zip(submissions.iterator(chunk_size=EXPORT_CHUNK_SIZE)),
+                content_type='application/zip'
+            )
+            file_name = f"{slugify(assessment.title) or 'assessment'}-submissions.zip"
+            response['Content-Disposition'] = content_disposition_header(True, file_name)
+            # Passed on to the client as it is generated instead of buffered by nginx
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error exporting submissions: {str(e)}")
+            raise ServerError("Failed to export submissions")
+
+    @action(detail=True, methods=['get'], url_path=r'submissions/(?P<submission_id>[^/.]+)/download')
+    def download_submission(self, request, pk=None, course_id=None, submission_id=None):
+        """
+        Download a submitted file. Admins download any submission of the
+        assessment, learners their own while enrolled in or done with the course.
+        """
+        try:
+            assessment = self.get_object()
+            submissions = FileSubmission.objects.filter(assessment=assessment)
+            if not request.user.is_staff:
+                enrolled = CourseEnrollment.objects.filter(
+                    user=request.user,
+                    course_id=assessment.assessable_id,
+                    status__in=['ENROLLED', 'COMPLETED']
+                ).exists()
+                if not enrolled:
+                    raise PermissionError("You must be enrolled in or have completed the course to download submissions")
+                submissions = submissions.filter(user=request.user)
+
+            try:
+                submission = submissions.get(id=submission_id)
+            except (FileSubmission.DoesNotExist, DjangoValidationError):
+                raise NotFoundError("Submission not found")
+
+            storage, name = get_submission_file(submission)
+            if storage is None:
+                raise NotFoundError("File not found")
+            return serve_file(request, storage, name, submission.file_name)
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error downloading submission {submission_id}: {str(e)}")
+            raise ServerError("Failed to download submission")
+
+    def get_submission_config(self, request, assessment):
+        """
+        Check that the user may submit a file to ``assessment`` and return its
+        FileSubmissionAssessment configuration.
+        """
+        # Get the course associated with this assessment
+        try:
+            course = Course.objects.get(id=assessment.assessable_id)
+            logger.info(f"Found associated course: {course.id} - {course.title}")
+        except Course.DoesNotExist:
+            logger.error(f"Course not found for assessment {assessment.id}")
+            raise NotFoundError("Associated course not found")
+
+        # Check if user is enrolled in the course
+        enrollment = CourseEnrollment.objects.filter(
+            user=request.user,
+            course=course,
+            status='ENROLLED'
+        ).first()
+
+        logger.info(f"User {request.user.email} enrollment status: {enrollment.status if enrollment else 'Not enrolled'}")
+
+        if not enrollment:
+            logger.error(f"User {request.user.email} is not enrolled in course {course.id}")
+            raise PermissionError("You must be enrolled in the course to submit assessments")
+
+        # Validate assessment type
+        if assessment.assessment_type != 'FILE_SUBMISSION':
+            logger.error(f"Invalid assessment type: {assessment.assessment_type}")
+            raise ValidationError("This assessment does not accept file submissions")
+
+        # Get file submission configuration
+        try:
+            file_submission = assessment.file_submission
+            logger.info(f"Found file submission config: allowed_types={file_submission.allowed_file_types}, max_size={file_submission.max_file_size_mb}MB")
+        except FileSubmissionAssessment.DoesNotExist:
+            logger.error(f"File submission config not found for assessment {assessment.id}")
+            raise ValidationError("File submission configuration not found for this assessment")
+        return file_submission
+
     @action(detail=True, methods=['post'])
     def submit(self, request, pk=None, course_id=None):
         logger.info("=== Starting AssessmentViewSet.submit ===")
@@ -1232,94 +1351,44 @@ class AssessmentViewSet(viewsets.ModelViewSet):
             assessment = self.get_object()
             logger.info(f"Found assessment: {assessment.id}")
 
-            # Get the course associated with this assessment
-            try:
-                course = Course.objects.get(id=assessment.assessable_id)
-                logger.info(f"Found associated course: {course.id} - {course.title}")
-            except Course.DoesNotExist:
-                logger.error(f"Course not found for assessment {assessment.id}")
-                raise NotFoundError("Associated course not found")
-
-            # Check if user is enrolled in the course
-            enrollment = CourseEnrollment.objects.filter(
-                user=request.user,
-                course=course,
-                status='ENROLLED'
-            ).first()
-
-            logger.info(f"User {request.user.email} enrollment status: {enrollment.status if enrollment else 'Not enrolled'}")
-            logger.info(f"User organization: {request.user.organization}")
-            logger.info(f"Course organization: {course.organization}")
-
-            if not enrollment:
-                logger.error(f"User {request.user.email} is not enrolled in course {course.id}")
-                raise PermissionError("You must be enrolled in the course to submit assessments")
-
-            # Check if course is completed
-            if enrollment.status == 'COMPLETED':
-                logger.error(f"User {request.user.email} cannot submit files for completed course {course.id}")
-                raise ValidationError("Cannot submit files for a completed course")
+            file_submission = self.get_submission_config(request, assessment)
 
-            # Validate assessment type
-            if assessment.assessment_type != 'FILE_SUBMISSION':
-                logger.error(f"Invalid assessment type: {assessment.assessment_type}")
-                raise ValidationError("This assessment does not accept file submissions")
-
-            # Get file submission configuration
-            try:
-                file_submission = assessment.file_submission
-                logger.info(f"Found file submission config: allowed_types={file_submission.allowed_file_types}, max_size={file_submission.max_file_size_mb}MB")
-            except FileSubmissionAssessment.DoesNotExist:
-                logger.error(f"File submission config not found for assessment {assessment.id}")
-                raise ValidationError("File submission configuration not found for this assessment")
+            # The body is only read from here on, checked against the limits as it arrives
+            upload_handler = SubmissionUploadHandler(file_submission, request, organization=assessment.organization)
+            request.upload_handlers.insert(0, upload_handler)
+            files = request.FILES
+            if upload_handler.error:
+                logger.error(f"Upload rejected while receiving: {str(upload_handler.error)}")
+                raise upload_handler.error
 
             # Check if file was provided
-            if 'file' not in request.FILES:
+            if 'file' not in files:
                 logger.error("No file provided in request")
                 raise ValidationError("No file provided")
 
-            file = request.FILES['file']
+            file = files['file']
             logger.info(f"Received file: {file.name} ({file.size} bytes)")
 
-            # Validate file type
-            file_extension = file.name.split('.')[-1].lower()
-            if file_extension not in file_submission.allowed_file_types:
-                logger.error(f"Invalid file type: {file_extension}. Allowed types: {file_submission.allowed_file_types}")
-                raise ValidationError(f"Invalid file type. Allowed types: {', '.join(file_submission.allowed_file_types)}")
-
-            # Validate file size
-            max_size_bytes = file_submission.max_file_size_mb * 1024 * 1024
-            if file.size > max_size_bytes:
-                logger.error(f"File size {file.size} exceeds limit {max_size_bytes}")
-                raise ValidationError(f"File size exceeds the maximum limit of {file_submission.max_file_size_mb}MB")
-
-            # Create assessments directory if it doesn't exist
-            assessment_dir = os.path.join('media', 'assessments', str(assessment.id))
-            os.makedirs(assessment_dir, exist_ok=True)
-            logger.info(f"Created assessment directory: {assessment_dir}")
-
-            # Generate unique filename with timestamp
-            timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{file.name}"
-            file_path = os.path.join(assessment_dir, filename)
-            logger.info(f"Generated file path: {file_path}")
-
-            # Save the file
-            with open(file_path, 'wb+') as destination:
-                for chunk in file.chunks():
-                    destination.write(chunk)
-
-            # Create new FileSubmission record
-            submission = FileSubmission.objects.create(
-                assessment=assessment,
-                user=request.user,
-                file_name=file.name,
-                file_path=file_path,
-                file_size=file.size
-            )
+            # Validate file type and size
+            validate_submission_file(file_submission, file.name, file.size)
+
+            # Identical contents are stored once, a duplicate is not written again
+            with blob_transaction():
+                # Counted before the file is stored, raises when it takes the organization over its quota
+                record_submission_change(assessment, 1, file.size)
+                blob_id = store_uploaded_file(file, upload_handler.checksums.get('file'))
+                submission = FileSubmission.objects.create(
+                    assessment=assessment,
+                    user=request.user,
+                    file_name=file.name,
+                    file_path=get_blob_name(blob_id),
+                    file_size=file.size,
+                    blob_id=blob_id
+                )
+                schedule_processing(submission)
 
             logger.info(f"File submission record created: {submission.id}")
-            logger.info(f"File saved successfully at {file_path}")
+            logger.info(f"File stored as blob {blob_id}")
 
             serializer = FileSubmissionSerializer(submission, context={'request': request})
             return Response(serializer.data)
@@ -1336,8 +1405,91 @@ class AssessmentViewSet(viewsets.ModelViewSet):
                 raise e
             raise ServerError("Failed to submit assessment")
 
+    def get_upload(self, request, assessment, upload_id):
+        try:
+            return SubmissionUpload.objects.get(id=upload_id, assessment=assessment, user=request.user)
+        except (SubmissionUpload.DoesNotExist, DjangoValidationError):
+            raise NotFoundError("Upload not found")
+
+    @action(detail=True, methods=['post'], url_path='uploads')
+    def uploads(self, request, pk=None, course_id=None):
+        """Start a resumable upload of a file submission"""
+        try:
+            assessment = self.get_object()
+            file_submission = self.get_submission_config(request, assessment)
+
+            serializer = SubmissionUploadSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            upload = create_upload(
+                assessment,
+                file_submission,
+                request.user,
+                serializer.validated_data['file_name'],
+                serializer.validated_data['file_size'],
+                serializer.validated_data.get('sha256', '')
+            )
+            serializer = SubmissionUploadSerializer(upload, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            if isinstance(e, (APIError, serializers.ValidationError)):
+                raise e
+            logger.error(f"Error starting upload: {str(e)}")
+            raise ServerError("Failed to start upload")
+
+    @action(detail=True, methods=['get', 'delete'], url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload(self, request, pk=None, course_id=None, upload_id=None):
+        """Progress of an upload, with the received chunk indices to resume from, or abort it"""
+        try:
+            assessment = self.get_object()
+            upload = self.get_upload(request, assessment, upload_id)
+            if request.method == 'DELETE':
+                abort_upload(upload)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            return Response(SubmissionUploadSerializer(upload, context={'request': request}).data)
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error handling upload {upload_id}: {str(e)}")
+            raise ServerError("Failed to handle upload")
+
+    @action(detail=True, methods=['put'], url_path=r'uploads/(?P<upload_id>[^/.]+)/chunks/(?P<index>\d+)')
+    def upload_chunk(self, request, pk=None, course_id=None, upload_id=None, index=None):
+        """
+        Receive one chunk as the raw request body. The X-Chunk-Checksum header
+        carries the hex SHA-256 of the chunk.
+        """
+        try:
+            assessment = self.get_object()
+            upload = self.get_upload(request, assessment, upload_id)
+            if upload.method != 'CHUNKED':
+                raise ValidationError("The file of a direct upload is sent to its upload_url")
+            write_chunk(upload, int(index), request.stream, request.headers.get('X-Chunk-Checksum'))
+            return Response({'index': int(index), 'size': upload.get_chunk_length(int(index))})
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error receiving chunk {index} of upload {upload_id}: {str(e)}")
+            raise ServerError("Failed to receive chunk")
+
+    @action(detail=True, methods=['post'], url_path=r'uploads/(?P<upload_id>[^/.]+)/commit')
+    def upload_commit(self, request, pk=None, course_id=None, upload_id=None):
+        """Assemble the received chunks into a submission"""
+        try:
+            assessment = self.get_object()
+            upload = self.get_upload(request, assessment, upload_id)
+            # Enrollment may have changed since the upload started
+            self.get_submission_config(request, assessment)
+            submission = commit_upload(upload)
+            serializer = FileSubmissionSerializer(submission, context={'request': request})
+            return Response(serializer.data)
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error committing upload {upload_id}: {str(e)}")
+            raise ServerError("Failed to commit upload")
+
     @action(detail=True, methods=['delete'])
-    def delete_submission(self, request, pk=None):
+    def delete_submission(self, request, pk=None, course_id=None):
         """Delete a user's submission for an assessment"""
         try:
             assessment = self.get_object()
@@ -1356,16 +1508,23 @@ class AssessmentViewSet(viewsets.ModelViewSet):
             except FileSubmission.DoesNotExist:
                 raise NotFoundError("No submission found for this assessment")
 
-            # Delete the file from storage
-            try:
-                if os.path.exists(submission.file_path):
-                    os.remove(submission.file_path)
-            except Exception as e:
-                logger.error(f"Error deleting file: {str(e)}")
-                # Continue with deletion even if file removal fails
-
-            # Delete the submission record
-            submission.delete()
+            if submission.blob_id:
+                # The blob and its file go away with the last submission using them
+                with transaction.atomic():
+                    submission.delete()
+                    release_blobs([submission.blob_id])
+                    record_submission_change(assessment, -1, -submission.file_size)
+            else:
+                # Files submitted before blobs were introduced belong to a single submission
+                try:
+                    if os.path.exists(submission.file_path):
+                        os.remove(submission.file_path)
+                except Exception as e:
+                    logger.error(f"Error deleting file: {str(e)}")
+                    # Continue with deletion even if file removal fails
+                with transaction.atomic():
+                    submission.delete()
+                    record_submission_change(assessment, -1, -submission.file_size)
             
             return Response(status=status.HTTP_204_NO_CONTENT)
             
@@ -1373,3 +1532,44 @@ class AssessmentViewSet(viewsets.ModelViewSet):
             if isinstance(e, APIError):
                 raise e
             raise ServerError("Failed to delete submission")
+
+class SubmissionStorageView(APIView):
+    """
+    Signed URLs of the local submission storage, standing in for the
+    presigned URLs of an object store: GET downloads a stored file, PUT
+    receives the whole file of a direct upload. The signature authorizes the
+    request, so no credentials are needed.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get_payload(self, token, key):
+        payload = load_token(token)
+        if not payload or key not in payload:
+            raise PermissionError("This link is invalid or has expired")
+        return payload
+
+    def get(self, request, token):
+        try:
+            payload = self.get_payload(token, 'name')
+            return serve_file(request, get_submission_storage(), payload['name'], payload['file_name'])
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error serving stored file: {str(e)}")
+            raise ServerError("Failed to download file")
+
+    def put(self, request, token):
+        try:
+            payload = self.get_payload(token, 'upload')
+            try:
+                upload = SubmissionUpload.objects.get(id=payload['upload'], method='DIRECT')
+            except SubmissionUpload.DoesNotExist:
+                raise NotFoundError("Upload not found")
+            write_chunk(upload, 0, request.stream, upload.sha256)
+            return Response({'size': upload.file_size})
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            logger.error(f"Error receiving direct upload: {str(e)}")
+            raise ServerError("Failed to receive file")
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, AccessRequest, EmailOTP, Organization
+from django.db import transaction
+from django.utils import timezone
+from .mail import schedule_delivery
+from .models import User, AccessRequest, EmailOTP, Organization, OutboundEmail
 
 @admin.register(Organization)
 class OrganizationAdmin(admin.ModelAdmin):
@@ -42,8 +45,23 @@ class AccessRequestAdmin(admin.ModelAdmin):
 
 @admin.register(EmailOTP)
 class EmailOTPAdmin(admin.ModelAdmin):
-    list_display = ('email', 'is_used', 'created_at', 'expires_at')
+    list_display = ('email', 'purpose', 'is_used', 'attempts', 'created_at', 'expires_at')
     list_filter = ('is_used', 'created_at', 'expires_at')
     search_fields = ('email', 'otp')
     readonly_fields = ('created_at', 'expires_at')
     ordering = ('-created_at',)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('to', 'subject')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+    ordering = ('-created_at',)
+    actions = ['retry_selected']
+
+    @admin.action(description='Send selected emails again')
+    def retry_selected(self, request, queryset):
+        count = queryset.exclude(status='SENT').update(status='PENDING', attempts=0, next_attempt_at=timezone.now())
+        transaction.on_commit(schedule_delivery)
+        self.message_user(request, f"Queued {count} emails again")
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose entries only the process holding them sees
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn about the state the workers do not share without a shared cache
+    (CACHE_REDIS_URL). Left out with DEBUG, where a single development
+    server is expected.
+    """
+    if settings.DEBUG or settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS:
+        return []
+    warnings = [Warning(
+        "Token revocations are kept in a per process cache.",
+        hint="A revoked user or logged out token is only refused by the worker that revoked it. "
+             "Set CACHE_REDIS_URL.",
+        id='users.W002',
+    ), Warning(
+        "Authenticated users are cached per process.",
+        hint="Other workers see a change to a user up to PRINCIPAL_CACHE_TTL "
+             f"({settings.PRINCIPAL_CACHE_TTL}) seconds later. Set CACHE_REDIS_URL.",
+        id='users.W003',
+    )]
+    if settings.RATE_LIMIT_ENABLED:
+        warnings.append(Warning(
+            "Rate limits are counted in a per process cache.",
+            hint="Every worker counts on its own, so clients get as many times more requests "
+                 "as there are workers. Set CACHE_REDIS_URL.",
+            id='users.W001',
+        ))
+    return warnings
@@ -0,0 +1,149 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import OutboundEmail
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed email is reserved for the worker sending it. Emails
+# left in SENDING by a worker that died are picked up again afterwards
+SEND_LEASE = timedelta(minutes=5)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EMAIL_OUTBOX_WORKERS,
+                thread_name_prefix='email-outbox'
+            )
+        return _executor
+
+def enqueue_email(to, subject, body, from_email=None):
+    """
+    Put an email in the outbox and return its OutboundEmail. It is sent on
+    the worker pool once the current transaction commits, so the request
+    does not wait for the mail server. With EMAIL_OUTBOX_WORKERS = 0 it is
+    sent right after the commit instead.
+    """
+    email = OutboundEmail.objects.create(
+        to=to,
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.EMAIL_HOST_USER
+    )
+    transaction.on_commit(schedule_delivery)
+    return email
+
+def schedule_delivery():
+    if settings.EMAIL_OUTBOX_WORKERS > 0:
+        get_executor().submit(_deliver_in_worker)
+    else:
+        deliver_pending()
+
+def _deliver_in_worker():
+    # Worker threads have their own connection, closed like a request's would be
+    close_old_connections()
+    try:
+        deliver_pending()
+    except Exception as e:
+        logger.error(f"Error delivering emails: {str(e)}")
+    finally:
+        close_old_connections()
+
+def claim_due(batch_size):
+    """
+    Reserve up to ``batch_size`` emails that are due for this worker. Rows
+    locked by another worker are skipped rather than waited for.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True).filter(
+                status__in=['PENDING', 'SENDING'], next_attempt_at__lte=now
+            ).order_by('next_attempt_at')[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status='SENDING', next_attempt_at=now + SEND_LEASE
+        )
+    return emails
+
+def deliver_pending(batch_size=None):
+    """
+    Send the due emails a batch at a time, each batch over one connection
+    to the mail server, until none is due. Returns the number of emails
+    sent and failed.
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    sent = failed = 0
+    while True:
+        emails = claim_due(batch_size)
+        if not emails:
+            break
+        batch_sent, batch_failed = send_batch(emails)
+        sent += batch_sent
+        failed += batch_failed
+    return sent, failed
+
+def send_batch(emails):
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            record_failure(email, e)
+        return 0, len(emails)
+
+    sent = []
+    reconnect = False
+    try:
+        for position, email in enumerate(emails):
+            if reconnect:
+                # The rest of the batch shares a new session, which the backend
+                # would otherwise open and close around every message
+                try:
+                    connection.open()
+                except Exception as e:
+                    for email in emails[position:]:
+                        record_failure(email, e)
+                    break
+                reconnect = False
+            message = EmailMessage(email.subject, email.body, email.from_email, [email.to], connection=connection)
+            try:
+                message.send()
+                sent.append(email.pk)
+            except Exception as e:
+                record_failure(email, e)
+                # The session may be unusable after an error
+                connection.close()
+                reconnect = True
+    finally:
+        connection.close()
+
+    OutboundEmail.objects.filter(pk__in=sent).update(
+        status='SENT', sent_at=timezone.now(), last_error=''
+    )
+    logger.info(f"Sent {len(sent)} of {len(emails)} emails")
+    return len(sent), len(emails) - len(sent)
+
+def record_failure(email, error):
+    """Schedule another try with exponential backoff, or give up after EMAIL_MAX_ATTEMPTS"""
+    attempts = email.attempts + 1
+    if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        status, next_attempt_at = 'FAILED', timezone.now()
+        logger.error(f"Giving up on email {email.pk} to {email.to} after {attempts} attempts: {str(error)}")
+    else:
+        status = 'PENDING'
+        next_attempt_at = timezone.now() + settings.EMAIL_RETRY_DELAY * 2 ** (attempts - 1)
+        logger.warning(f"Email {email.pk} to {email.to} failed, retrying at {next_attempt_at}: {str(error)}")
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=str(error)[:1000]
+    )
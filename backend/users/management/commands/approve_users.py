@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
+from courses.stats import record_user_change
 from users.models import AccessRequest, User
 
 class Command(BaseCommand):
@@ -25,18 +27,20 @@ class Command(BaseCommand):
                     )
                     continue
 
-                # Create user with organization using CustomUserManager
-                user = User.objects.create_user(
-                    email=request.email,
-                    organization=request.organization,  # This is crucial - setting the organization
-                    is_approved=True,
-                    approval_date=timezone.now()
-                )
+                with transaction.atomic():
+                    # Create user with organization using CustomUserManager
+                    user = User.objects.create_user(
+                        email=request.email,
+                        organization=request.organization,  # This is crucial - setting the organization
+                        is_approved=True,
+                        approval_date=timezone.now()
+                    )
+                    record_user_change(user.organization_id, None, user.is_active)
 
-                # Update access request status
-                request.status = 'approved'
-                request.processed_at = timezone.now()
-                request.save()
+                    # Update access request status
+                    request.status = 'approved'
+                    request.processed_at = timezone.now()
+                    request.save()
 
                 approved_count += 1
                 self.stdout.write(
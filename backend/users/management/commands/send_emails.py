@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from users.mail import deliver_pending
+from users.models import OutboundEmail
+
+class Command(BaseCommand):
+    help = 'Sends the queued emails that are due, including retries of failed ones, in batches over reused connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of emails sent over one connection (EMAIL_BATCH_SIZE by default)',
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running and send emails as they become due',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds between checks for due emails with --watch',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many emails are due without sending them',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1) if options['batch_size'] else None
+
+        if options['dry_run']:
+            due = OutboundEmail.objects.filter(
+                status__in=['PENDING', 'SENDING'], next_attempt_at__lte=timezone.now()
+            ).count()
+            self.stdout.write(self.style.SUCCESS(f'Dry run complete. {due} emails would be sent.'))
+            return
+
+        while True:
+            sent, failed = deliver_pending(batch_size)
+            if sent or failed or not options['watch']:
+                message = f'Emails sent: {sent}, failed: {failed}.'
+                self.stdout.write(self.style.WARNING(message) if failed else self.style.SUCCESS(message))
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
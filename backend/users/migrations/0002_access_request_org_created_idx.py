@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accessrequest',
+            index=models.Index(fields=['organization', '-created_at', 'id'], name='access_request_org_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='storage_quota_mb',
+            field=models.PositiveIntegerField(blank=True, help_text='Storage for submitted files in MB, 0 for unlimited. Empty uses ORGANIZATION_STORAGE_QUOTA_MB', null=True),
+        ),
+    ]
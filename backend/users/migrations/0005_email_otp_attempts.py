@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:55
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def prune_otps(apps, schema_editor):
+    # Rows used up or expired before issuing started to replace them
+    EmailOTP = apps.get_model('users', 'EmailOTP')
+    EmailOTP.objects.filter(Q(is_used=True) | Q(expires_at__lte=timezone.now())).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_organization_storage_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailotp',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='emailotp',
+            index=models.Index(fields=['email', 'purpose'], name='email_otp_email_purpose_idx'),
+        ),
+        migrations.RunPython(prune_otps, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.utils import timezone
 import uuid
@@ -14,6 +15,11 @@ class Organization(models.Model):
     domain = models.CharField(max_length=255, unique=True, help_text="Email domain for this organization")
     logo = models.ImageField(upload_to='logos/', null=True, blank=True, help_text="Organization logo")
     theme = models.CharField(max_length=20, choices=THEME_CHOICES, default='default')
+    storage_quota_mb = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Storage for submitted files in MB, 0 for unlimited. Empty uses ORGANIZATION_STORAGE_QUOTA_MB"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
@@ -23,6 +29,10 @@ class Organization(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Trigram indexes serve the admin search box (core.search)
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='organization_name_trgm_idx'),
+        ]
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, **extra_fields):
@@ -65,6 +75,13 @@ class User(AbstractUser):
 
     objects = CustomUserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            GinIndex(fields=['email'], opclasses=['gin_trgm_ops'], name='user_email_trgm_idx'),
+            GinIndex(fields=['first_name'], opclasses=['gin_trgm_ops'], name='user_first_name_trgm_idx'),
+            GinIndex(fields=['last_name'], opclasses=['gin_trgm_ops'], name='user_last_name_trgm_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -98,6 +115,12 @@ class AccessRequest(models.Model):
         related_name='processed_requests'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['organization', '-created_at', 'id'], name='access_request_org_created_idx'),
+            GinIndex(fields=['email'], opclasses=['gin_trgm_ops'], name='access_request_email_trgm_idx'),
+        ]
+
     def __str__(self):
         return f"{self.email} - {self.status}"
 
@@ -113,12 +136,47 @@ class EmailOTP(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     is_used = models.BooleanField(default=False)
+    # Wrong codes tried against this OTP (users.otp)
+    attempts = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['email', 'purpose'], name='email_otp_email_purpose_idx'),
+        ]
 
     def __str__(self):
         return f"OTP for {self.email}"
 
     def is_valid(self):
         return not self.is_used and self.expires_at > timezone.now()
+
+class OutboundEmail(models.Model):
+    """An email waiting in, or delivered from, the outbox (users.mail)"""
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    )
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # When the email is next due: the retry time, or the lease of the worker sending it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
@@ -0,0 +1,115 @@
+import secrets
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from .models import EmailOTP
+
+OTP_LENGTH = 6
+
+def generate_otp():
+    """Generate a 6-digit OTP"""
+    return ''.join(secrets.choice('0123456789') for _ in range(OTP_LENGTH))
+
+class OTPStore:
+    """
+    Where issued OTPs live until they are used or expire. One OTP per email
+    and purpose is live at a time, it can be consumed once, and it is
+    burned after OTP_MAX_ATTEMPTS tries.
+    """
+    def issue(self, email, purpose):
+        """Replace any live OTP of ``email`` for ``purpose`` with a new one and return its code"""
+        raise NotImplementedError
+
+    def consume(self, email, purpose, otp):
+        """Use up the live OTP when ``otp`` matches it, returning whether it did"""
+        raise NotImplementedError
+
+    def discard(self, email, purpose):
+        """Forget the live OTP, e.g. when it could not be sent"""
+        raise NotImplementedError
+
+class CacheOTPStore(OTPStore):
+    """
+    OTPs kept in the cache, which expires them by itself. Needs a cache
+    shared by all workers (CACHE_REDIS_URL), as the OTP may be verified by
+    another worker than the one that sent it.
+    """
+    def get_keys(self, email, purpose):
+        return f'otp:{purpose}:{email}', f'otp:{purpose}:{email}:attempts'
+
+    def issue(self, email, purpose):
+        otp_key, attempts_key = self.get_keys(email, purpose)
+        otp = generate_otp()
+        timeout = int(settings.OTP_EXPIRY.total_seconds())
+        cache.set_many({otp_key: otp, attempts_key: 0}, timeout)
+        return otp
+
+    def consume(self, email, purpose, otp):
+        otp_key, attempts_key = self.get_keys(email, purpose)
+        try:
+            # Counted before the code is compared, so parallel guesses are counted too
+            attempts = cache.incr(attempts_key)
+        except ValueError:
+            # No live OTP
+            return False
+        if attempts > settings.OTP_MAX_ATTEMPTS:
+            self.discard(email, purpose)
+            return False
+        stored = cache.get(otp_key)
+        if stored is None or not constant_time_compare(stored, otp):
+            return False
+        # Only the request whose delete removed the key gets to use the OTP
+        if not cache.delete(otp_key):
+            return False
+        cache.delete(attempts_key)
+        return True
+
+    def discard(self, email, purpose):
+        cache.delete_many(self.get_keys(email, purpose))
+
+class DatabaseOTPStore(OTPStore):
+    """
+    OTPs kept as EmailOTP rows. Issuing a new OTP removes every earlier row
+    of the email and purpose, so the table holds at most one row per pair.
+    """
+    def get_live(self, email, purpose):
+        return EmailOTP.objects.filter(
+            email=email, purpose=purpose, is_used=False, expires_at__gt=timezone.now()
+        )
+
+    def issue(self, email, purpose):
+        otp = generate_otp()
+        EmailOTP.objects.filter(email=email, purpose=purpose).delete()
+        EmailOTP.objects.create(
+            email=email,
+            otp=otp,
+            purpose=purpose,
+            expires_at=timezone.now() + settings.OTP_EXPIRY
+        )
+        return otp
+
+    def consume(self, email, purpose, otp):
+        email_otp = self.get_live(email, purpose).first()
+        if email_otp is None:
+            return False
+        # Every try is counted by a conditional update, so parallel guesses cannot go past the limit
+        tries = EmailOTP.objects.filter(pk=email_otp.pk, is_used=False, attempts__lt=settings.OTP_MAX_ATTEMPTS)
+        if not constant_time_compare(email_otp.otp, otp):
+            tries.update(attempts=F('attempts') + 1)
+            return False
+        # Only the request whose update flipped the row gets to use the OTP
+        return tries.update(is_used=True, attempts=F('attempts') + 1) == 1
+
+    def discard(self, email, purpose):
+        EmailOTP.objects.filter(email=email, purpose=purpose, is_used=False).delete()
+
+OTP_STORES = {
+    'cache': CacheOTPStore,
+    'database': DatabaseOTPStore,
+}
+
+def get_otp_store():
+    """The OTP store configured by OTP_STORE"""
+    return OTP_STORES[settings.OTP_STORE]()
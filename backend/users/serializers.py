@@ -4,14 +4,16 @@ from django.contrib.auth import get_user_model
 from .models import User, AccessRequest, EmailOTP, Organization
 from .utils import verify_otp
 from core.exceptions import ValidationError, NotFoundError
+from core.fieldsets import SparseFieldsetMixin
 
 User = get_user_model()
 
 class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Organization
-        fields = ['id', 'name', 'domain', 'logo', 'theme', 'is_active']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'domain', 'logo', 'theme', 'is_active', 'storage_quota_mb']
+        # The quota is granted by the platform, not chosen by the organization's admins
+        read_only_fields = ['id', 'created_at', 'updated_at', 'storage_quota_mb']
 
 class AccessRequestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,7 +43,7 @@ class EmailOTPSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'otp': 'This field is required.'})
         return data
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     organization = OrganizationSerializer(read_only=True)
 
     class Meta:
@@ -52,6 +54,7 @@ class UserSerializer(serializers.ModelSerializer):
             'is_active', 'last_login'
         ]
         read_only_fields = ['id', 'is_approved', 'approval_date']
+        summary_fields = ['id', 'email', 'first_name', 'last_name', 'is_approved', 'is_staff', 'is_active', 'last_login']
 
     def validate_email(self, value):
         request = self.context.get('request')
@@ -1,3 +1,482 @@
-from django.test import TestCase
+import socketserver
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from core import revocation
+from core.query_budget import QueryBudgetMixin
+from courses.models import Course, CourseEnrollment
+from courses.stats import rebuild_organization_stats
+from .checks import check_shared_cache
+from .models import Organization, User, AccessRequest, EmailOTP, OutboundEmail
+from .mail import deliver_pending, enqueue_email
+from .otp import OTP_STORES, get_otp_store
 
-# Create your tests here.
+USERS = 60
+ACCESS_REQUESTS = 60
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    A local SMTP server standing in for the mail provider. It keeps every
+    message it accepts and refuses recipients whose address starts with
+    'bounce'.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(line)
+                self.server.messages.append(b''.join(data).decode())
+                self.reply('250 Queued')
+            elif command.startswith('RCPT') and 'BOUNCE' in command:
+                self.reply('550 No such user')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+    def reply(self, text):
+        self.wfile.write(f'{text}\r\n'.encode())
+
+class UserQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets of every route in users.urls"""
+    query_budgets = {
+        'user-list': {'GET': 4, 'POST': 8},
+        'user-detail': {'GET': 3, 'PATCH': 7, 'DELETE': 26},
+        'user-me': {'GET': 2, 'PATCH': 3},
+        'user-revoke': {'POST': 8},
+        'user-restore': {'POST': 8},
+        'auth-request-otp': {'POST': 6},
+        'auth-verify-otp': {'POST': 5},
+        'auth-token-refresh': {'POST': 1},
+        'auth-logout': {'POST': 1},
+        'organization-list': {'GET': 3},
+        'organization-detail': {'GET': 3, 'PATCH': 4},
+        'organization-logo': {'GET': 3},
+        'organization-storage': {'GET': 5},
+        'access-request-list': {'GET': 4, 'POST': 4},
+        'access-request-detail': {'GET': 3, 'PATCH': 4, 'DELETE': 4},
+        'access-request-approve': {'POST': 8},
+        'access-request-reject': {'POST': 4},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='Budget Academy', domain='budget.test')
+        cls.admin = User.objects.create_user(
+            email='admin@budget.test', organization=cls.organization, is_staff=True, is_approved=True
+        )
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{index}@budget.test',
+                first_name=f'First{index}',
+                last_name=f'Last{index}',
+                organization=cls.organization,
+                is_approved=True,
+                last_login=timezone.now() - timedelta(days=index)
+            )
+            for index in range(USERS)
+        ]
+        cls.user = cls.users[0]
+
+        # Deleting a user recomputes the statistics of the courses they were enrolled in
+        courses = Course.objects.bulk_create([
+            Course(organization=cls.organization, title=f'Course {index}', description='Description', status='PUBLISHED')
+            for index in range(5)
+        ])
+        CourseEnrollment.objects.bulk_create([
+            CourseEnrollment(user=user, course=course, status='ENROLLED')
+            for user in cls.users[:10]
+            for course in courses
+        ])
+
+        cls.access_requests = AccessRequest.objects.bulk_create([
+            AccessRequest(email=f'applicant{index}@budget.test', organization=cls.organization)
+            for index in range(ACCESS_REQUESTS)
+        ])
+        cls.access_request = cls.access_requests[0]
+
+        rebuild_organization_stats([cls.organization.pk])
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.admin)
+
+    def test_every_route_has_a_budget(self):
+        self.assertRoutesHaveBudgets('users.urls')
+
+    def test_user_list(self):
+        url = reverse('user-list')
+        self.assertConstantQueries('user-list', 'get', {
+            page_size: f'{url}?page_size={page_size}' for page_size in (5, 20, 50)
+        })
+        self.assertConstantQueries('user-list', 'get', {
+            f'cursor {page_size}': f'{url}?pagination=cursor&page_size={page_size}' for page_size in (5, 20, 50)
+        })
+        self.assertQueryBudget('user-list', 'get', f'{url}?search=first1', size='search')
+        self.assertQueryBudget('user-list', 'post', url, status=201, data={
+            'email': 'new.user@budget.test',
+            'first_name': 'New',
+        }, format='json')
+
+    def test_user_detail(self):
+        url = reverse('user-detail', args=[self.user.id])
+        self.assertQueryBudget('user-detail', 'get', url)
+        self.assertQueryBudget('user-detail', 'patch', url, data={'first_name': 'Renamed'}, format='json')
+        self.assertQueryBudget('user-revoke', 'post', reverse('user-revoke', args=[self.user.id]))
+        self.assertQueryBudget('user-restore', 'post', reverse('user-restore', args=[self.user.id]))
+        self.assertQueryBudget('user-detail', 'delete', url, status=204)
+
+    def test_me(self):
+        self.authenticate(self.user)
+        self.assertQueryBudget('user-me', 'get', reverse('user-me'))
+        self.assertQueryBudget('user-me', 'patch', reverse('user-me'), data={'dark_mode': True}, format='json')
+
+    def test_cached_principal(self):
+        self.authenticate(self.user)
+        url = reverse('user-me')
+        self.assertQueryBudget('user-me', 'get', url)
+        # The user and their organization come from the cache, no query runs
+        response, capture = self.measure('get', url)
+        self.assertEqual(capture.count, 0, capture.format())
+        self.assertFalse(response.data['dark_mode'])
+
+        self.assertQueryBudget('user-me', 'patch', url, data={'dark_mode': True}, format='json')
+        self.assertTrue(self.client.get(url).data['dark_mode'])
+
+        self.authenticate(self.admin)
+        self.assertQueryBudget(
+            'organization-detail', 'patch', reverse('organization-detail', kwargs={'id': self.organization.id}),
+            data={'theme': 'corporate'}, format='json'
+        )
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(url).data['organization']['theme'], 'corporate')
+
+        self.authenticate(self.admin)
+        self.assertQueryBudget('user-revoke', 'post', reverse('user-revoke', args=[self.user.id]))
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        self.authenticate(self.admin)
+        self.assertQueryBudget('user-restore', 'post', reverse('user-restore', args=[self.user.id]))
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_auth(self):
+        self.authenticate(None)
+        self.assertQueryBudget('auth-request-otp', 'post', reverse('auth-request-otp'), data={
+            'email': self.user.email,
+            'purpose': 'login',
+        }, format='json')
+
+        otp = get_otp_store().issue(self.user.email, 'login')
+        response = self.assertQueryBudget('auth-verify-otp', 'post', reverse('auth-verify-otp'), data={
+            'email': self.user.email,
+            'otp': otp,
+            'purpose': 'login',
+        }, format='json')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        refreshed = self.assertQueryBudget('auth-token-refresh', 'post', reverse('auth-token-refresh'), data={
+            'refresh': response.data['refresh'],
+        }, format='json')
+        # The refreshed access token is a new, working token
+        self.assertNotEqual(refreshed.data['access'], response.data['access'])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {refreshed.data['access']}")
+        self.assertEqual(self.client.get(reverse('user-me')).status_code, 200)
+        self.assertQueryBudget('auth-logout', 'post', reverse('auth-logout'))
+
+    def test_token_revocation(self):
+        url = reverse('user-me')
+        issued = RefreshToken.for_user(self.user)
+        issued['iat'] = issued.access_token['iat'] - 10
+        access = issued.access_token
+        access['iat'] = issued['iat']
+
+        self.authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('user-revoke', args=[self.user.id]))
+        self.client.post(reverse('user-restore', args=[self.user.id]))
+
+        # Tokens issued before the revocation stay revoked after access is restored
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 401)
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(reverse('auth-token-refresh'), {'refresh': str(issued)}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Logging out revokes the access token and the refresh token sent along
+        refresh = RefreshToken.for_user(self.user)
+        access = refresh.access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertQueryBudget('auth-logout', 'post', reverse('auth-logout'), data={'refresh': str(refresh)}, format='json')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.authenticate(self.user)
+        response = self.client.post(reverse('auth-token-refresh'), {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        # Another worker, without the revocation in memory, finds it in the shared cache
+        revocation._local.clear()
+        self.assertEqual(self.client.get(url).status_code, 401)
+        # and keeps it, refusing the token without the cache
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 401)
+
+    @override_settings(RATE_LIMITS={
+        'request_otp': {'ip': '100/h', 'email': '2/h', 'domain': '3/h'},
+        'access_request': {'ip': '1/m'},
+    })
+    def test_rate_limits(self):
+        self.authenticate(None)
+        url = reverse('auth-request-otp')
+        domain = self.user.email.split('@')[1]
+
+        def request_otp(email, **extra):
+            return self.client.post(url, {'email': email, 'purpose': 'login'}, format='json', **extra)
+
+        for _ in range(2):
+            self.assertEqual(request_otp(self.user.email).status_code, 200)
+        # Refused before any query runs
+        with self.assertNumQueries(0):
+            response = request_otp(self.user.email.upper())
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1800')
+        self.assertEqual(response.data['error']['details'], {'retry_after': 1800})
+
+        # The domain is shared by its emails, a refused request does not use tokens
+        self.assertEqual(request_otp(self.users[1].email).status_code, 200)
+        self.assertEqual(request_otp(self.users[2].email).status_code, 429)
+        self.assertEqual(request_otp(f'other@{domain}x').status_code, 400)
+
+        # Buckets refill over time
+        now = timezone.now().timestamp()
+        with mock.patch('core.ratelimit.time.time', return_value=now + 1200):
+            self.assertEqual(request_otp(self.users[2].email).status_code, 200)
+            self.assertEqual(request_otp(self.users[3].email).status_code, 429)
+
+        # Clients are told apart by their address, behind proxies by X-Forwarded-For
+        access_requests = reverse('access-request-list')
+        data = {'email': f'new@{domain}', 'organization': self.organization.id}
+        self.assertEqual(self.client.post(access_requests, data, format='json').status_code, 201)
+        self.assertEqual(self.client.post(access_requests, data, format='json').status_code, 429)
+        self.assertEqual(self.client.post(access_requests, data, format='json', REMOTE_ADDR='10.0.0.2').status_code, 400)
+        with override_settings(RATE_LIMIT_PROXY_COUNT=1):
+            forwarded = {'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': 'spoofed, 192.0.2.1'}
+            self.assertEqual(self.client.post(access_requests, data, format='json', **forwarded).status_code, 400)
+            self.assertEqual(self.client.post(access_requests, data, format='json', **forwarded).status_code, 429)
+            # Clients behind the same proxy still get a bucket each
+            other = {'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '198.51.100.7'}
+            self.assertEqual(self.client.post(access_requests, data, format='json', **other).status_code, 400)
+            self.assertEqual(self.client.post(access_requests, data, format='json', **other).status_code, 429)
+
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            self.assertEqual(request_otp(self.user.email).status_code, 200)
+
+    def test_shared_cache_checks(self):
+        with override_settings(DEBUG=False):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['users.W002', 'users.W003', 'users.W001'])
+            with override_settings(RATE_LIMIT_ENABLED=False):
+                self.assertEqual([warning.id for warning in check_shared_cache(None)], ['users.W002', 'users.W003'])
+            redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://redis:6379/0'}}
+            with override_settings(CACHES=redis):
+                self.assertEqual(check_shared_cache(None), [])
+        # Development servers are left alone
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_otp_stores(self):
+        email = self.user.email
+        for name in OTP_STORES:
+            with self.subTest(store=name), override_settings(OTP_STORE=name, OTP_MAX_ATTEMPTS=3):
+                store = get_otp_store()
+                otp = store.issue(email, 'login')
+                wrong = f'{(int(otp) + 1) % 1000000:06d}'
+                self.assertFalse(store.consume(email, 'registration', otp))
+                self.assertFalse(store.consume(email, 'login', wrong))
+                self.assertTrue(store.consume(email, 'login', otp))
+                # Consumed once only
+                self.assertFalse(store.consume(email, 'login', otp))
+
+                # Issuing again replaces the OTP, which is burned after too many tries
+                first = store.issue(email, 'login')
+                otp = store.issue(email, 'login')
+                if first != otp:
+                    self.assertFalse(store.consume(email, 'login', first))
+                for _ in range(3):
+                    self.assertFalse(store.consume(email, 'login', wrong))
+                self.assertFalse(store.consume(email, 'login', otp))
+
+                otp = store.issue(email, 'login')
+                store.discard(email, 'login')
+                self.assertFalse(store.consume(email, 'login', otp))
+
+        # Expired rows are not used, and issuing leaves one row per email and purpose
+        with override_settings(OTP_STORE='database'):
+            store = get_otp_store()
+            otp = store.issue(email, 'login')
+            EmailOTP.objects.filter(email=email).update(expires_at=timezone.now() - timedelta(seconds=1))
+            self.assertFalse(store.consume(email, 'login', otp))
+            store.issue(email, 'login')
+            self.assertEqual(EmailOTP.objects.filter(email=email).count(), 1)
+
+    def test_email_outbox(self):
+        server = SMTPStandIn()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=server.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_OUTBOX_WORKERS=0,
+            EMAIL_MAX_ATTEMPTS=2
+        )
+        try:
+            with smtp:
+                # Requesting an OTP only queues its email, it is sent after the commit
+                self.authenticate(None)
+                with self.captureOnCommitCallbacks() as callbacks:
+                    self.assertQueryBudget('auth-request-otp', 'post', reverse('auth-request-otp'), data={
+                        'email': self.user.email,
+                        'purpose': 'login',
+                    }, format='json')
+                self.assertEqual(OutboundEmail.objects.get(to=self.user.email).status, 'PENDING')
+                self.assertEqual(len(callbacks), 1)
+                self.assertEqual(server.messages, [])
+
+                # The next delivery also picks up the OTP email still in the outbox
+                with self.captureOnCommitCallbacks(execute=True):
+                    enqueue_email(self.users[1].email, 'Welcome', 'Hello')
+                    enqueue_email('bounce@budget.test', 'Welcome', 'Hello')
+
+                # Both deliverable emails went over a single connection
+                self.assertEqual(server.connections, 1)
+                self.assertEqual(len(server.messages), 2)
+                self.assertIn('Your Login OTP', server.messages[0])
+                sent = OutboundEmail.objects.get(to=self.user.email)
+                self.assertEqual(sent.status, 'SENT')
+                self.assertIsNotNone(sent.sent_at)
+
+                bounced = OutboundEmail.objects.get(to='bounce@budget.test')
+                self.assertEqual((bounced.status, bounced.attempts), ('PENDING', 1))
+                self.assertIn('550', bounced.last_error)
+                self.assertGreater(bounced.next_attempt_at, timezone.now())
+                # Not due yet
+                self.assertEqual(deliver_pending(), (0, 0))
+
+                OutboundEmail.objects.filter(pk=bounced.pk).update(next_attempt_at=timezone.now())
+                self.assertEqual(deliver_pending(), (0, 1))
+                bounced.refresh_from_db()
+                self.assertEqual((bounced.status, bounced.attempts), ('FAILED', 2))
+
+                # After a failure the rest of the batch shares one new connection
+                connections, messages = server.connections, len(server.messages)
+                with self.captureOnCommitCallbacks(execute=True):
+                    enqueue_email('bounce@budget.test', 'Welcome', 'Hello')
+                    for user in self.users[3:6]:
+                        enqueue_email(user.email, 'Welcome', 'Hello')
+                self.assertEqual(server.connections - connections, 2)
+                self.assertEqual(len(server.messages) - messages, 3)
+
+            # A mail server that cannot be reached leaves the email queued for a retry
+            with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1', EMAIL_PORT=1
+            ):
+                email = enqueue_email(self.users[2].email, 'Welcome', 'Hello')
+                self.assertEqual(deliver_pending(), (0, 1))
+                email.refresh_from_db()
+                self.assertEqual((email.status, email.attempts), ('PENDING', 1))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_organizations(self):
+        self.assertQueryBudget('organization-list', 'get', reverse('organization-list'))
+
+        url = reverse('organization-detail', kwargs={'id': self.organization.id})
+        self.assertQueryBudget('organization-detail', 'get', url)
+        self.assertQueryBudget('organization-detail', 'patch', url, data={'theme': 'corporate'}, format='json')
+
+    def test_organization_logo(self):
+        url = reverse('organization-logo', kwargs={'id': self.organization.id})
+        self.assertQueryBudget('organization-logo', 'get', url, status=404, size='none')
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.organization.logo.save('logo.png', ContentFile(b'\x89PNG logo'))
+            self.authenticate(self.user)
+            response = self.assertQueryBudget('organization-logo', 'get', url)
+            self.assertEqual(b''.join(response.streaming_content), b'\x89PNG logo')
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertTrue(response['Content-Disposition'].startswith('inline'))
+            self.assertQueryBudget(
+                'organization-logo', 'get', url, status=304, size='cached', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+
+        other = Organization.objects.create(name='Other Academy', domain='other.test')
+        url = reverse('organization-logo', kwargs={'id': other.id})
+        self.assertQueryBudget('organization-logo', 'get', url, status=404, size='other')
+
+    def test_organization_storage(self):
+        url = reverse('organization-storage', kwargs={'id': self.organization.id})
+        response = self.assertQueryBudget('organization-storage', 'get', url)
+        self.assertEqual(response.data['submission_bytes'], 0)
+        self.assertIsNone(response.data['quota_bytes'])
+
+        self.organization.storage_quota_mb = 5
+        self.organization.save()
+        response = self.assertQueryBudget('organization-storage', 'get', url, size='quota')
+        self.assertEqual(response.data['available_bytes'], 5 * 1024 * 1024)
+
+        self.authenticate(self.user)
+        self.assertQueryBudget('organization-storage', 'get', url, status=403, size='learner')
+
+    def test_access_request_list(self):
+        url = reverse('access-request-list')
+        self.assertConstantQueries('access-request-list', 'get', {
+            page_size: f'{url}?page_size={page_size}' for page_size in (5, 20, 50)
+        })
+        self.assertQueryBudget('access-request-list', 'get', f'{url}?search=applicant1', size='search')
+
+        self.authenticate(None)
+        self.assertQueryBudget('access-request-list', 'post', url, status=201, data={
+            'email': 'new.applicant@budget.test',
+            'organization': str(self.organization.id),
+        }, format='json')
+
+    def test_access_request_detail(self):
+        url = reverse('access-request-detail', args=[self.access_request.id])
+        self.assertQueryBudget('access-request-detail', 'get', url)
+        self.assertQueryBudget('access-request-detail', 'patch', url, data={'status': 'pending'}, format='json')
+        self.assertQueryBudget('access-request-detail', 'delete', url, status=204)
+
+    def test_access_request_actions(self):
+        self.assertQueryBudget(
+            'access-request-approve', 'post', reverse('access-request-approve', args=[self.access_requests[1].id])
+        )
+        self.assertQueryBudget(
+            'access-request-reject', 'post', reverse('access-request-reject', args=[self.access_requests[2].id])
+        )
@@ -12,22 +12,35 @@ from .utils import create_and_send_otp, verify_otp
 from rest_framework import serializers
 from core.exceptions import ValidationError, NotFoundError, ServerError, AuthenticationError, APIError
 from core.permissions import OrganizationPermission, OrganizationAdminPermission
+from core.authentication import invalidate_principals, invalidate_organization_principals
+from core.fieldsets import SparseFieldsetViewMixin
+from core.ratelimit import RateLimitMixin
+from core.revocation import is_token_revoked, revoke_token, revoke_user
+from core.downloads import serve_file
+from core.pagination import KeysetPaginationMixin
+from core.search import search_q, is_similarity_search, rank_by_similarity
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Q
+from courses.stats import get_storage_usage, record_user_change, rebuild_assessment_stats, rebuild_course_stats, rebuild_organization_stats
+from courses.blobs import release_blobs
+import logging
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
-class StandardResultsSetPagination(pagination.PageNumberPagination):
+class StandardResultsSetPagination(KeysetPaginationMixin, pagination.PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
 # Create your views here.
 
-class AccessRequestViewSet(viewsets.ModelViewSet):
+class AccessRequestViewSet(RateLimitMixin, viewsets.ModelViewSet):
     serializer_class = AccessRequestSerializer
     permission_classes = [permissions.IsAuthenticated, OrganizationAdminPermission]
     pagination_class = StandardResultsSetPagination
+    rate_limits = {'create': 'access_request'}
     
     def get_permissions(self):
         if self.action in ['create']:
@@ -45,17 +58,18 @@ class AccessRequestViewSet(viewsets.ModelViewSet):
         
         # Enhanced search functionality
         search_query = self.request.query_params.get('search', None)
+        similarity = bool(search_query) and is_similarity_search(self.request)
         if search_query:
             # Split search query into words for more natural search
             search_terms = search_query.split()
             q_objects = Q()
             
             for term in search_terms:
+                # Related columns are matched through subqueries so each table can use its trigram index
                 q_objects &= (
-                    Q(email__icontains=term) |
-                    Q(organization__name__icontains=term) |
-                    Q(status__icontains=term) |
-                    Q(processed_by__email__icontains=term)
+                    search_q(term, ['email', 'status'], similarity) |
+                    Q(organization__in=Organization.objects.filter(search_q(term, ['name'], similarity))) |
+                    Q(processed_by__in=User.objects.filter(search_q(term, ['email'], similarity)))
                 )
             
             queryset = queryset.filter(q_objects)
@@ -79,6 +93,10 @@ class AccessRequestViewSet(viewsets.ModelViewSet):
             queryset = queryset.order_by(sort_by)
         else:
             queryset = queryset.order_by('-created_at')
+
+        # Closest matches first when similarity ranking was asked for
+        if similarity:
+            queryset = rank_by_similarity(queryset, search_query, ['email', 'organization__name'])
         
         return queryset
 
@@ -98,19 +116,21 @@ class AccessRequestViewSet(viewsets.ModelViewSet):
             except Http404:
                 raise NotFoundError("Access request not found")
 
-            # Create user with organization using CustomUserManager
-            user = User.objects.create_user(
-                email=access_request.email,
-                organization=access_request.organization,
-                is_approved=True,
-                approval_date=timezone.now()
-            )
-            
-            # Update access request status
-            access_request.status = 'approved'
-            access_request.processed_at = timezone.now()
-            access_request.processed_by = request.user
-            access_request.save()
+            with transaction.atomic():
+                # Create user with organization using CustomUserManager
+                user = User.objects.create_user(
+                    email=access_request.email,
+                    organization=access_request.organization,
+                    is_approved=True,
+                    approval_date=timezone.now()
+                )
+                record_user_change(user.organization_id, None, user.is_active)
+                
+                # Update access request status
+                access_request.status = 'approved'
+                access_request.processed_at = timezone.now()
+                access_request.processed_by = request.user
+                access_request.save()
 
             return Response({
                 'message': 'Access request approved',
@@ -136,8 +156,9 @@ class AccessRequestViewSet(viewsets.ModelViewSet):
                 raise e
             raise ServerError("Failed to reject access request")
 
-class AuthViewSet(viewsets.ViewSet):
+class AuthViewSet(RateLimitMixin, viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
+    rate_limits = {'request_otp': 'request_otp', 'verify_otp': 'verify_otp'}
     
     def get_permissions(self):
         """
@@ -211,7 +232,7 @@ class AuthViewSet(viewsets.ViewSet):
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
-            print(f"Error in request_otp: {str(e)}")  # Add debug logging
+            logger.error(f"Error in request_otp: {str(e)}")
             raise ServerError("An unexpected error occurred. Please try again later.")
 
     @action(detail=False, methods=['post'])
@@ -224,14 +245,12 @@ class AuthViewSet(viewsets.ViewSet):
             otp = serializer.validated_data['otp']
             purpose = serializer.validated_data['purpose']
 
-            print(f"Verifying OTP for email: {email}, purpose: {purpose}")  # Debug log
-
             # Verify OTP
             if not verify_otp(email, otp, purpose):
-                print(f"OTP verification failed for email: {email}")  # Debug log
+                logger.info(f"OTP verification failed for email: {email}")
                 raise ValidationError("Invalid or expired OTP")
 
-            print(f"OTP verified successfully for email: {email}")
+            logger.info(f"OTP verified for email: {email}, purpose: {purpose}")
 
             if purpose == 'login':
                 # Login flow
@@ -289,14 +308,24 @@ class AuthViewSet(viewsets.ViewSet):
                     raise ValidationError("Your organization is not registered with us")
 
         except Exception as e:
-            print(f"Error in verify_otp: {str(e)}")  # Debug log
             if isinstance(e, (ValidationError, NotFoundError)):
                 raise e
+            logger.error(f"Error in verify_otp: {str(e)}")
             raise ServerError("An unexpected error occurred. Please try again later.")
 
     @action(detail=False, methods=['post'])
     def logout(self, request):
         try:
+            revoke_token(request.auth)
+            # The refresh token is revoked too when sent, so no new access token can be made from it
+            refresh_token = request.data.get('refresh')
+            if refresh_token:
+                try:
+                    refresh = RefreshToken(refresh_token)
+                except Exception:
+                    raise ValidationError("Invalid refresh token")
+                if refresh.get('user_id') == request.user.pk:
+                    revoke_token(refresh)
             return Response({"detail": "Logged out successfully"})
         except Exception as e:
             if isinstance(e, APIError):
@@ -312,16 +341,18 @@ class AuthViewSet(viewsets.ViewSet):
 
             try:
                 refresh = RefreshToken(refresh_token)
-                access_token = str(refresh.access_token())
-                return Response({'access': access_token})
             except Exception:
                 raise ValidationError("Invalid refresh token")
+
+            if is_token_revoked(refresh):
+                raise ValidationError("Refresh token has been revoked")
+            return Response({'access': str(refresh.access_token)})
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
             raise ServerError("An error occurred while refreshing token")
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated, OrganizationPermission]
     pagination_class = StandardResultsSetPagination
@@ -335,17 +366,17 @@ class UserViewSet(viewsets.ModelViewSet):
         
         # Search functionality
         search_query = self.request.query_params.get('search', None)
+        similarity = bool(search_query) and is_similarity_search(self.request)
         if search_query:
             # Split search query into words for more natural search
             search_terms = search_query.split()
             q_objects = Q()
             
             for term in search_terms:
+                # The organization name is matched through a subquery so both tables can use their trigram indexes
                 q_objects &= (
-                    Q(email__icontains=term) |
-                    Q(first_name__icontains=term) |
-                    Q(last_name__icontains=term) |
-                    Q(organization__name__icontains=term)
+                    search_q(term, ['email', 'first_name', 'last_name'], similarity) |
+                    Q(organization__in=Organization.objects.filter(search_q(term, ['name'], similarity)))
                 )
             
             queryset = queryset.filter(q_objects)
@@ -377,12 +408,22 @@ class UserViewSet(viewsets.ModelViewSet):
             queryset = queryset.order_by(sort_by)
         else:
             queryset = queryset.order_by('-last_login')
+
+        # Closest matches first when similarity ranking was asked for
+        if similarity:
+            queryset = rank_by_similarity(queryset, search_query, ['email', 'first_name', 'last_name'])
+
+        # Join the organization only when it is rendered
+        if 'organization' in self.get_rendered_fields():
+            queryset = queryset.select_related('organization')
         
         return queryset
 
     def perform_create(self, serializer):
         try:
-            serializer.save(organization=self.request.user.organization)
+            with transaction.atomic():
+                user = serializer.save(organization=self.request.user.organization)
+                record_user_change(user.organization_id, None, user.is_active)
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
@@ -391,7 +432,11 @@ class UserViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         try:
             instance = self.get_object()
-            serializer.save()
+            was_active = serializer.instance.is_active
+            with transaction.atomic():
+                user = serializer.save()
+                record_user_change(user.organization_id, was_active, user.is_active)
+                invalidate_principals([user.pk])
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
@@ -399,7 +444,22 @@ class UserViewSet(viewsets.ModelViewSet):
 
     def perform_destroy(self, instance):
         try:
-            instance.delete()
+            # The user's enrollments are deleted with them, so the affected rollups are recomputed
+            course_ids = list(instance.course_enrollments.values_list('course_id', flat=True).distinct())
+            # Their submissions too, which release the stored files they referenced
+            blob_ids = list(instance.file_submissions.exclude(blob=None).values_list('blob_id', flat=True))
+            assessment_ids = list(instance.file_submissions.values_list('assessment_id', flat=True).distinct())
+            user_id = instance.pk
+            with transaction.atomic():
+                instance.delete()
+                invalidate_principals([user_id])
+                release_blobs(blob_ids)
+                if course_ids:
+                    rebuild_course_stats(course_ids)
+                if assessment_ids:
+                    rebuild_assessment_stats(assessment_ids)
+                if instance.organization_id:
+                    rebuild_organization_stats([instance.organization_id])
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
@@ -414,14 +474,22 @@ class UserViewSet(viewsets.ModelViewSet):
             serializer = UserUpdateSerializer(request.user, data=request.data, partial=request.method == 'PATCH')
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            invalidate_principals([request.user.pk])
             return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def revoke(self, request, *args, **kwargs):
         try:
             user = self.get_object()
-            user.is_active = False
-            user.save()
+            with transaction.atomic():
+                was_active = user.is_active
+                user.is_active = False
+                user.save()
+                record_user_change(user.organization_id, was_active, user.is_active)
+                invalidate_principals([user.pk])
+                # Only once the user is inactive for good, as a rolled back
+                # revocation could not be taken back on the other workers
+                transaction.on_commit(lambda: revoke_user(user.pk))
 
             # Find and update any associated access request
             access_request = AccessRequest.objects.filter(email=user.email).first()
@@ -444,8 +512,12 @@ class UserViewSet(viewsets.ModelViewSet):
     def restore(self, request, *args, **kwargs):
         try:
             user = self.get_object()
-            user.is_active = True
-            user.save()
+            with transaction.atomic():
+                was_active = user.is_active
+                user.is_active = True
+                user.save()
+                record_user_change(user.organization_id, was_active, user.is_active)
+                invalidate_principals([user.pk])
 
             # Find and update any associated access request
             access_request = AccessRequest.objects.filter(email=user.email).first()
@@ -478,14 +550,48 @@ class OrganizationViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['retrieve']:
             permission_classes = [permissions.IsAuthenticated]
+        elif self.action in ['logo']:
+            permission_classes = [permissions.IsAuthenticated, OrganizationPermission]
         else:
             permission_classes = [permissions.IsAuthenticated, OrganizationAdminPermission]
         return [permission() for permission in permission_classes]
 
     def perform_update(self, serializer):
         try:
-            serializer.save()
+            organization = serializer.save()
+            # Every member's cached principal carries the organization
+            invalidate_organization_principals(organization.pk)
         except Exception as e:
             if isinstance(e, APIError):
                 raise e
             raise ServerError("Failed to update organization")
+
+    @action(detail=True, methods=['get'])
+    def logo(self, request, id=None):
+        """The organization's logo, for its members"""
+        try:
+            try:
+                organization = self.get_object()
+            except Http404:
+                raise NotFoundError("Organization not found")
+            if not organization.logo:
+                raise NotFoundError("This organization has no logo")
+            return serve_file(request, organization.logo.storage, organization.logo.name, as_attachment=False)
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            raise ServerError("Failed to fetch organization logo")
+
+    @action(detail=True, methods=['get'])
+    def storage(self, request, id=None):
+        """Storage used by the organization's submissions against its quota, per assessment"""
+        try:
+            try:
+                organization = self.get_object()
+            except Http404:
+                raise NotFoundError("Organization not found")
+            return Response(get_storage_usage(organization))
+        except Exception as e:
+            if isinstance(e, APIError):
+                raise e
+            raise ServerError("Failed to fetch organization storage")
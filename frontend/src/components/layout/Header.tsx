@@ -1,6 +1,7 @@
+import { useEffect, useState } from 'react';
 import { useNavigate, useLocation } from 'react-router-dom';
 import { useAuth } from '@/lib/context/AuthContext';
-import { getMediaUrl } from '@/lib/utils';
+import { apiService } from '@/lib/services/apiService';
 import { Button } from '../ui/button';
 import { Search, Menu } from 'lucide-react';
 import { UserMenu } from './UserMenu';
@@ -15,7 +16,30 @@ export function Header({ onMenuClick }: HeaderProps) {
   const location = useLocation();
   const { state } = useAuth();
 
-  const logoUrl = state.user?.organization?.logo ? getMediaUrl(state.user.organization.logo) : null;
+  const [logoUrl, setLogoUrl] = useState<string | null>(null);
+  const organizationId = state.user?.organization?.id;
+  const hasLogo = Boolean(state.user?.organization?.logo);
+
+  // The logo is only served to members, so it is fetched with the auth token
+  useEffect(() => {
+    if (!organizationId || !hasLogo) {
+      setLogoUrl(null);
+      return;
+    }
+    let objectUrl: string | null = null;
+    let cancelled = false;
+    apiService.organizations.logo(String(organizationId))
+      .then(response => {
+        if (cancelled) return;
+        objectUrl = URL.createObjectURL(response.data);
+        setLogoUrl(objectUrl);
+      })
+      .catch(() => setLogoUrl(null));
+    return () => {
+      cancelled = true;
+      if (objectUrl) URL.revokeObjectURL(objectUrl);
+    };
+  }, [organizationId, hasLogo]);
   const isAdminView = location.pathname.startsWith('/admin');
 
   const handleSearchClick = () => {
@@ -248,7 +248,9 @@ class ApiService {
 
   async logout(): Promise<void> {
     try {
-      await api.post('/auth/logout/');
+      await api.post('/auth/logout/', {
+        refresh: localStorage.getItem(REFRESH_TOKEN_KEY)
+      });
     } catch (error) {
       console.error('Logout failed:', error);
     } finally {
@@ -263,8 +265,11 @@ class ApiService {
       page?: number;
       page_size?: number;
       search?: string;
+      search_mode?: 'similarity';
       view?: string;
       ordering?: string;
+      fields?: string;
+      omit?: string;
     }): Promise<PaginatedResponse<Course>> => {
       const response = await api.get('/courses/', { params });
       return response.data;
@@ -426,6 +431,7 @@ class ApiService {
     get: (id: string) => api.get<Organization>(`/organizations/${id}/`),
     update: (id: string, data: Partial<Organization>) => 
       api.patch<Organization>(`/organizations/${id}/`, data),
+    logo: (id: string) => api.get<Blob>(`/organizations/${id}/logo/`, { responseType: 'blob' }),
   };
 
   // Stats endpoint